@@ -0,0 +1,7 @@
+"""airspeed velocity (asv) benchmarks of stsci.image.
+
+Run them against the current checkout with::
+
+    asv run --python=same --quick      # a quick check
+    asv continuous master HEAD         # compare a branch against master
+"""
@@ -0,0 +1,120 @@
+"""Benchmarks of the stack combiners in stsci.image.combine."""
+import numpy as np
+
+from stsci.image import combine
+
+from .common import masks, pixels_per_second, stack
+
+KINDS = ['median', 'imedian', 'average', 'iaverage', 'minimum']
+
+
+class _Combine(object):
+    """Time, peak memory and throughput of combine.<kind>(); subclasses
+    set 'params' and build the inputs in 'setup'."""
+    timeout = 300
+
+    def run(self):
+        getattr(combine, self.kind)(self.arrays, badmasks=self.badmasks,
+                                    nlow=self.nlow, nhigh=self.nhigh)
+
+    def time_combine(self, *args):
+        self.run()
+
+    def peakmem_combine(self, *args):
+        self.run()
+
+    def track_pixels_per_second(self, *args):
+        return pixels_per_second(self.run, self.arrays.size)
+    track_pixels_per_second.unit = 'pixels/s'
+
+
+class Depth(_Combine):
+    """Stack depth, from a handful of exposures to deep stacks."""
+    params = (KINDS, [4, 16, 64, 256, 1024])
+    param_names = ['kind', 'depth']
+    timeout = 900
+
+    def setup(self, kind, depth):
+        self.kind = kind
+        self.arrays = stack(depth, 256)
+        self.badmasks = None
+        self.nlow = self.nhigh = 0
+
+
+class Size(_Combine):
+    """Image size at a fixed depth."""
+    params = (KINDS, [128, 512, 2048])
+    param_names = ['kind', 'size']
+
+    def setup(self, kind, size):
+        self.kind = kind
+        self.arrays = stack(8, size)
+        self.badmasks = None
+        self.nlow = self.nhigh = 0
+
+
+class Dtype(_Combine):
+    """Input type; the kernels read every supported type in place."""
+    params = (['median', 'average', 'minimum'],
+              ['int16', 'uint16', 'int32', 'float32', 'float64'])
+    param_names = ['kind', 'dtype']
+
+    def setup(self, kind, dtype):
+        self.kind = kind
+        self.arrays = stack(16, 512, dtype)
+        self.badmasks = None
+        self.nlow = self.nhigh = 0
+
+
+class Rejection(_Combine):
+    """Mask density together with nlow/nhigh rejection."""
+    params = (KINDS, [0.0, 0.1, 0.5], [(0, 0), (1, 1), (4, 4)])
+    param_names = ['kind', 'mask_density', 'nlow_nhigh']
+
+    def setup(self, kind, density, clip):
+        self.kind = kind
+        self.arrays = stack(32, 256)
+        self.badmasks = masks(32, 256, density) if density else None
+        self.nlow, self.nhigh = clip
+
+
+class Threshhold(object):
+    """combine.threshhold() with one or both limits."""
+    params = ([16, 64], ['low', 'high', 'both'])
+    param_names = ['depth', 'limits']
+
+    def setup(self, depth, limits):
+        self.arrays = stack(depth, 512)
+        self.low = 990 if limits in ('low', 'both') else None
+        self.high = 1010 if limits in ('high', 'both') else None
+
+    def run(self):
+        combine.threshhold(self.arrays, self.low, self.high)
+
+    def time_threshhold(self, *args):
+        self.run()
+
+    def peakmem_threshhold(self, *args):
+        self.run()
+
+    def track_pixels_per_second(self, *args):
+        return pixels_per_second(self.run, self.arrays.size)
+    track_pixels_per_second.unit = 'pixels/s'
+
+
+class Layout(_Combine):
+    """A cube, read as one buffer, against the same frames as a list."""
+    params = (['median', 'average'], ['cube', 'list'], [16, 256])
+    param_names = ['kind', 'layout', 'depth']
+
+    def setup(self, kind, layout, depth):
+        self.kind = kind
+        self.arrays = stack(depth, 256)
+        if layout == 'list':
+            self.arrays = list(self.arrays)
+        self.badmasks = None
+        self.nlow = self.nhigh = 0
+
+    def track_pixels_per_second(self, *args):
+        return pixels_per_second(self.run, np.size(self.arrays))
+    track_pixels_per_second.unit = 'pixels/s'
@@ -0,0 +1,33 @@
+"""Benchmarks of stsci.image.numcombine.num_combine()."""
+from stsci.image.numcombine import num_combine
+
+from .common import masks, pixels_per_second, stack
+
+
+class NumCombine(object):
+    """num_combine() with masks and upper/lower thresholds."""
+    timeout = 300
+    params = (['median', 'imedian', 'mean', 'iaverage', 'sum', 'minimum'],
+              [8, 64], [False, True])
+    param_names = ['combination_type', 'depth', 'thresholds']
+
+    def setup(self, kind, depth, thresholds):
+        self.kind = kind
+        self.data = list(stack(depth, 512))
+        self.masks = list(masks(depth, 512, 0.05))
+        self.limits = (990, 1010) if thresholds else (None, None)
+
+    def run(self):
+        num_combine(self.data, masks=self.masks,
+                    combination_type=self.kind, nlow=1, nhigh=1,
+                    lower=self.limits[0], upper=self.limits[1])
+
+    def time_num_combine(self, *args):
+        self.run()
+
+    def peakmem_num_combine(self, *args):
+        self.run()
+
+    def track_pixels_per_second(self, *args):
+        return pixels_per_second(self.run, len(self.data) * 512 * 512)
+    track_pixels_per_second.unit = 'pixels/s'
@@ -0,0 +1,49 @@
+"""Benchmarks of stsci.image.translate()."""
+from stsci.image import translate
+
+from .common import pixels_per_second, stack
+
+
+class Translate(object):
+    """Sub-pixel shifts in every quadrant and boundary mode."""
+    params = ([256, 1024], [(0.3, 0.6), (-2.25, 1.5), (-0.7, -3.1)],
+              ['nearest', 'wrap', 'reflect', 'constant'])
+    param_names = ['size', 'shift', 'mode']
+
+    def setup(self, size, shift, mode):
+        self.image = stack(1, size)[0]
+        self.shift = shift
+        self.mode = mode
+
+    def run(self):
+        translate(self.image, self.shift[0], self.shift[1], mode=self.mode)
+
+    def time_translate(self, *args):
+        self.run()
+
+    def peakmem_translate(self, *args):
+        self.run()
+
+    def track_pixels_per_second(self, *args):
+        return pixels_per_second(self.run, self.image.size)
+    track_pixels_per_second.unit = 'pixels/s'
+
+
+class Kernel(object):
+    """The interpolation kernels, from 2 to 10 taps per axis."""
+    params = ([1024], ['bilinear', 'bicubic', 'lanczos3', 'lanczos5'])
+    param_names = ['size', 'kernel']
+
+    def setup(self, size, kernel):
+        self.image = stack(1, size)[0]
+        self.kernel = kernel
+
+    def run(self):
+        translate(self.image, 0.3, -0.6, kernel=self.kernel)
+
+    def time_translate(self, *args):
+        self.run()
+
+    def track_pixels_per_second(self, *args):
+        return pixels_per_second(self.run, self.image.size)
+    track_pixels_per_second.unit = 'pixels/s'
@@ -0,0 +1,28 @@
+"""Helpers shared by the benchmarks.
+
+Every suite times its operation with asv's ``time_`` and ``peakmem_``
+benchmarks and also records the throughput, in input pixels per second,
+with a ``track_`` benchmark timed here.
+"""
+import timeit
+
+import numpy as np
+
+
+def stack(depth, size, dtype=np.float32, seed=0):
+    """A (depth, size, size) stack of noise around 1000."""
+    rng = np.random.RandomState(seed)
+    values = rng.normal(1000, 30, size=(depth, size, size))
+    return values.astype(dtype)
+
+
+def masks(depth, size, density, seed=1):
+    """Bad pixel masks flagging a fraction 'density' of the pixels."""
+    rng = np.random.RandomState(seed)
+    return rng.uniform(size=(depth, size, size)) < density
+
+
+def pixels_per_second(func, npixels, repeat=3):
+    """Input pixels processed per second by func(), best of 'repeat'."""
+    seconds = min(timeit.repeat(func, number=1, repeat=repeat))
+    return npixels / seconds
@@ -26,6 +26,12 @@ setup(
     ext_modules=[
         Extension('stsci.image._combine',
                   ['src/_combinemodule.c'],
+                  depends=['src/_sample.h', 'src/_threads.h'],
+                  include_dirs=[np_include()],
+                  define_macros=[('NUMPY', '1')]),
+        Extension('stsci.image._translate',
+                  ['src/_translatemodule.c'],
+                  depends=['src/_sample.h', 'src/_threads.h'],
                   include_dirs=[np_include()],
                   define_macros=[('NUMPY', '1')]),
     ],
@@ -1,58 +1,557 @@
 #include <Python.h>
 #include <numpy/arrayobject.h>
 
-#define MAX_ARRAYS 1800
+#include "_sample.h"
+#include "_threads.h"
 
 static PyObject *_Error;
 
 
-typedef npy_float64 (*combiner)(int, int, int, int, npy_float64 temp[MAX_ARRAYS]);
+/* Everything a combiner needs to know besides the pixel stack itself. */
+typedef struct
+{
+    int ninputs, nlow, nhigh;
+    npy_float64 lsigma, hsigma;     /* clipping limits, in units of spread */
+    int maxiter;                    /* maximum number of clipping passes */
+} combine_params;
+
+
+typedef npy_float64 (*combiner)(int, const combine_params *, npy_float64 *);
+
+
+/*
+ * Order statistics.
+ *
+ * The combiners only ever look at a few ranks of each pixel stack, so rather
+ * than fully sorting the stack they partially order it in place: sorting
+ * networks for very small stacks, insertion sort for short runs, and an
+ * introspective quickselect (falling back to heapsort) for everything else.
+ */
+
+#define SMALL_SORT 16
+
+#define SWAP(a, b) { npy_float64 tmp_ = (a); (a) = (b); (b) = tmp_; }
+
+/* compare-exchange, written so that compilers emit branchless min/max */
+#define CSWAP(v, i, j) {                        \
+        npy_float64 a_ = v[i], b_ = v[j];       \
+        v[i] = (b_ < a_) ? b_ : a_;             \
+        v[j] = (b_ < a_) ? a_ : b_;             \
+    }
+
+
+static void
+_network_sort(npy_float64 *v, int n)
+{
+    switch (n) {
+    case 2:
+        CSWAP(v, 0, 1);
+        break;
+    case 3:
+        CSWAP(v, 1, 2); CSWAP(v, 0, 2); CSWAP(v, 0, 1);
+        break;
+    case 4:
+        CSWAP(v, 0, 1); CSWAP(v, 2, 3); CSWAP(v, 0, 2); CSWAP(v, 1, 3);
+        CSWAP(v, 1, 2);
+        break;
+    case 5:
+        CSWAP(v, 0, 1); CSWAP(v, 3, 4); CSWAP(v, 2, 4); CSWAP(v, 2, 3);
+        CSWAP(v, 1, 4); CSWAP(v, 0, 3); CSWAP(v, 0, 2); CSWAP(v, 1, 3);
+        CSWAP(v, 1, 2);
+        break;
+    case 6:
+        CSWAP(v, 1, 2); CSWAP(v, 4, 5); CSWAP(v, 0, 2); CSWAP(v, 3, 5);
+        CSWAP(v, 0, 1); CSWAP(v, 3, 4); CSWAP(v, 2, 5); CSWAP(v, 0, 3);
+        CSWAP(v, 1, 4); CSWAP(v, 2, 4); CSWAP(v, 1, 3); CSWAP(v, 2, 3);
+        break;
+    case 7:
+        CSWAP(v, 1, 2); CSWAP(v, 3, 4); CSWAP(v, 5, 6); CSWAP(v, 0, 2);
+        CSWAP(v, 3, 5); CSWAP(v, 4, 6); CSWAP(v, 0, 1); CSWAP(v, 4, 5);
+        CSWAP(v, 2, 6); CSWAP(v, 0, 4); CSWAP(v, 1, 5); CSWAP(v, 0, 3);
+        CSWAP(v, 2, 5); CSWAP(v, 1, 3); CSWAP(v, 2, 4); CSWAP(v, 2, 3);
+        break;
+    case 8:
+        CSWAP(v, 0, 1); CSWAP(v, 2, 3); CSWAP(v, 4, 5); CSWAP(v, 6, 7);
+        CSWAP(v, 0, 2); CSWAP(v, 1, 3); CSWAP(v, 4, 6); CSWAP(v, 5, 7);
+        CSWAP(v, 1, 2); CSWAP(v, 5, 6); CSWAP(v, 0, 4); CSWAP(v, 3, 7);
+        CSWAP(v, 1, 5); CSWAP(v, 2, 6); CSWAP(v, 1, 4); CSWAP(v, 3, 6);
+        CSWAP(v, 2, 4); CSWAP(v, 3, 5); CSWAP(v, 3, 4);
+        break;
+    }
+}
+
+
+static void
+_small_sort(npy_float64 *v, int n)
+{
+    int i, j;
+    npy_float64 x;
+
+    if (n <= 8) {
+        _network_sort(v, n);
+        return;
+    }
+    for (i=1; i<n; i++) {
+        x = v[i];
+        for (j=i; j>0 && x < v[j-1]; j--) {
+            v[j] = v[j-1];
+        }
+        v[j] = x;
+    }
+}
+
+
+static void
+_sift_down(npy_float64 *v, int i, int n)
+{
+    int j;
+    npy_float64 x = v[i];
+
+    for (j=2*i+1; j<n; i=j, j=2*j+1) {
+        if (j+1 < n && v[j] < v[j+1]) j++;
+        if (!(x < v[j])) break;
+        v[i] = v[j];
+    }
+    v[i] = x;
+}
+
+
+static void
+_heap_sort(npy_float64 *v, int n)
+{
+    int i;
+
+    for (i=n/2-1; i>=0; i--) {
+        _sift_down(v, i, n);
+    }
+    for (i=n-1; i>0; i--) {
+        SWAP(v[0], v[i]);
+        _sift_down(v, 0, i);
+    }
+}
 
 
+/*
+ * Partition v[0..n-1] (n > 2) around a median-of-three pivot and return the
+ * pivot's final position.  Elements equal to the pivot stop both scans, so
+ * stacks with many repeated values still split evenly.
+ */
 static int
-_mask_and_sort(int ninputs, int index, int fill, npy_float64 **inputs,
-               npy_uint8 **masks, npy_float64 temp[MAX_ARRAYS])
+_partition(npy_float64 *v, int n)
 {
-    int i, j, goodpix;
-    npy_float64 temp2;
+    int lo = 0, hi = n-1, mid = n/2, ll, hh;
 
-    if (masks) {
-        for (i=j=0; i<ninputs; i++) {
-            if (masks[i][index] == 0) {
-                temp[j++] = inputs[i][index];
-            }
+    if (v[hi] < v[mid]) SWAP(v[hi], v[mid]);
+    if (v[hi] < v[lo]) SWAP(v[hi], v[lo]);
+    if (v[lo] < v[mid]) SWAP(v[lo], v[mid]);
+    /* v[mid] <= v[lo] <= v[hi]; v[lo+1] and v[hi] now act as sentinels */
+    SWAP(v[mid], v[lo+1]);
+    ll = lo+1;
+    hh = hi;
+    for (;;) {
+        do ll++; while (v[ll] < v[lo]);
+        do hh--; while (v[lo] < v[hh]);
+        if (hh < ll) break;
+        SWAP(v[ll], v[hh]);
+    }
+    SWAP(v[lo], v[hh]);
+    return hh;
+}
+
+
+static int
+_depth_limit(int n)
+{
+    int depth = 0;
+    while (n > 1) {
+        n >>= 1;
+        depth++;
+    }
+    return 2*depth;
+}
+
+
+static void
+_introsort(npy_float64 *v, int n, int depth)
+{
+    int p;
+
+    while (n > SMALL_SORT) {
+        if (depth-- <= 0) {
+            _heap_sort(v, n);
+            return;
         }
-        if (j == 0 && fill == 1) {
-            for (i=0; i<ninputs; i++) {
-                if (inputs[i][index] != 0){
-                    temp[j++] = inputs[i][index];
-                    break;
-                }
-            }
+        p = _partition(v, n);
+        /* recurse into the smaller half, loop on the larger one */
+        if (p < n-1-p) {
+            _introsort(v, p, depth);
+            v += p+1;
+            n -= p+1;
+        } else {
+            _introsort(v+p+1, n-1-p, depth);
+            n = p;
         }
-    } else {
-        for (i=j=0; i<ninputs; i++) {
-            temp[j++] = inputs[i][index];
+    }
+    _small_sort(v, n);
+}
+
+
+static void
+_sort(npy_float64 *v, int n)
+{
+    _introsort(v, n, _depth_limit(n));
+}
+
+
+/*
+ * Return the k-th smallest of v[0..n-1], leaving v partitioned so that
+ * v[0..k-1] <= v[k] <= v[k+1..n-1].
+ */
+static npy_float64
+_select(npy_float64 *v, int n, int k)
+{
+    int lo = 0, hi = n-1, p, depth = _depth_limit(n);
+
+    while (hi-lo+1 > SMALL_SORT) {
+        if (depth-- <= 0) {
+            _heap_sort(v+lo, hi-lo+1);
+            return v[k];
+        }
+        p = lo + _partition(v+lo, hi-lo+1);
+        if (p == k) {
+            return v[k];
+        } else if (p > k) {
+            hi = p-1;
+        } else {
+            lo = p+1;
         }
     }
-    goodpix = j;
-    for(i=0; i<goodpix; i++) {
-        for (j=i+1; j<goodpix; j++) {
-            if (temp[j] < temp[i]) {
-                temp2 = temp[j];
-                temp[j] = temp[i];
-                temp[i] = temp2;
-            }
+    _small_sort(v+lo, hi-lo+1);
+    return v[k];
+}
+
+
+static npy_float64
+_min(npy_float64 *v, int n)
+{
+    int i;
+    npy_float64 m = v[0];
+    for (i=1; i<n; i++) {
+        if (v[i] < m) m = v[i];
+    }
+    return m;
+}
+
+
+static npy_float64
+_max(npy_float64 *v, int n)
+{
+    int i;
+    npy_float64 m = v[0];
+    for (i=1; i<n; i++) {
+        if (m < v[i]) m = v[i];
+    }
+    return m;
+}
+
+
+/*
+ * Move the ranks [nlow, goodpix-nhigh) of v to v[nlow..goodpix-nhigh-1],
+ * in no particular order.
+ */
+static void
+_clip(npy_float64 *v, int goodpix, int nlow, int nhigh)
+{
+    if (nlow > 0) {
+        _select(v, goodpix, nlow);
+    }
+    if (nhigh > 0) {
+        _select(v+nlow, goodpix-nlow, goodpix-nlow-nhigh-1);
+    }
+}
+
+
+/*
+ * The value found in temp[ninputs-1] after the full sort the combiners used
+ * to rely on: the largest value when every input contributed, otherwise one
+ * of the zeroed scratch slots.
+ */
+static npy_float64
+_last_slot(int goodpix, int ninputs, npy_float64 *temp)
+{
+    if (ninputs > 0 && goodpix == ninputs) {
+        return _max(temp, goodpix);
+    }
+    return 0;
+}
+
+
+/*
+ * Gathering.
+ *
+ * Inputs are read in place in their own type, following their strides, and
+ * promoted to npy_float64 as each pixel stack is gathered.  That is exact
+ * for every supported type except npy_int64, whose values beyond 2**53 are
+ * rounded to the nearest npy_float64.  One gather function is generated per
+ * input type.
+ */
+
+/*
+ * Optional per-frame terms applied while gathering: each value is multiplied
+ * by its frame's scale and offset by its zero, and when weights are in use
+ * the weight of temp[j] is stored in temp[ninputs+j].
+ */
+typedef struct
+{
+    npy_float64 *scales, *zeros;     /* one per frame, or NULL */
+    npy_float64 *weights;            /* one per frame, or NULL */
+    PyArrayObject **pixel_weights;   /* one array per frame, or NULL */
+    int single;                      /* pixel_weights are npy_float32 */
+} frame_terms;
+
+
+/*
+ * Bad pixel masks come in several formats, all read in place: one byte per
+ * pixel (bool), integer data quality flags where any of 'bits' marks a bad
+ * pixel, and bool masks packed eight pixels per byte along the last axis
+ * by numpy.packbits.
+ */
+enum { MASK_BYTES, MASK_BITS8, MASK_BITS16, MASK_BITS32, MASK_BITS64,
+       MASK_PACKED };
+
+typedef struct
+{
+    int kind;                        /* MASK_* */
+    npy_uint64 bits;                 /* the bad flags of MASK_BITS* */
+} mask_format;
+
+
+/* Whether pixel 'index' of the mask row at 'm' marks a bad pixel. */
+static NPY_INLINE int
+_masked(const char *m, npy_intp stride, npy_intp index,
+        const mask_format *f)
+{
+    if (f->kind == MASK_BYTES) {
+        return *(const npy_uint8 *) (m + index*stride) != 0;
+    }
+    switch (f->kind) {
+    case MASK_BITS8:
+        return (*(const npy_uint8 *) (m + index*stride) & f->bits) != 0;
+    case MASK_BITS16:
+        return (*(const npy_uint16 *) (m + index*stride) & f->bits) != 0;
+    case MASK_BITS32:
+        return (*(const npy_uint32 *) (m + index*stride) & f->bits) != 0;
+    case MASK_BITS64:
+        return (*(const npy_uint64 *) (m + index*stride) & f->bits) != 0;
+    default:
+        return (*(const npy_uint8 *) (m + (index >> 3)*stride) >>
+                (7 - (index & 7))) & 1;
+    }
+}
+
+
+/*
+ * The current row of every input, as seen by a gatherer.  Values < low or
+ * >= high are rejected as they are read, like masked ones; a missing limit
+ * is NaN, which rejects nothing.  So are NaNs when 'skipnan' is set.
+ */
+typedef struct
+{
+    int ninputs;
+    char **inputs, **masks, **weights;
+    npy_intp *strides, *mstrides, *wstrides;
+    const frame_terms *terms;        /* NULL when there are none */
+    mask_format mask;
+    int limits;                      /* low or high is given */
+    npy_float64 low, high;
+    int skipnan;
+} gather_row;
+
+
+static void
+_apply_terms(const gather_row *g, int i, npy_intp index, npy_float64 *temp,
+             int j)
+{
+    const frame_terms *t = g->terms;
+    char *w;
+
+    if (t->scales) temp[j] *= t->scales[i];
+    if (t->zeros) temp[j] += t->zeros[i];
+    if (t->weights) {
+        temp[g->ninputs+j] = t->weights[i];
+    } else if (t->pixel_weights) {
+        w = g->weights[i] + index*g->wstrides[i];
+        temp[g->ninputs+j] = t->single ? *(npy_float32 *) w
+                                       : *(npy_float64 *) w;
+    }
+}
+
+
+typedef int (*gatherer)(const gather_row *, npy_intp, int, npy_float64 *);
+
+#define GATHER(i, value) {                                                  \
+        temp[j] = (value);                                                  \
+        if (g->terms) _apply_terms(g, i, index, temp, j);                   \
+        j++;                                                                \
+    }
+
+#define DEFINE_GATHER(type)                                                 \
+static int                                                                  \
+_mask_and_gather_##type(const gather_row *g, npy_intp index, int fill,      \
+                        npy_float64 *temp)                                  \
+{                                                                           \
+    int i, j, ninputs = g->ninputs;                                         \
+    npy_float64 value;                                                      \
+                                                                            \
+    if (g->masks || g->limits || g->skipnan) {                              \
+        for (i=j=0; i<ninputs; i++) {                                       \
+            if (g->masks && _masked(g->masks[i], g->mstrides[i], index,    \
+                                    &g->mask)) {                            \
+                continue;                                                   \
+            }                                                               \
+            value = *(type *) (g->inputs[i] + index*g->strides[i]);         \
+            if (g->limits && (value < g->low || value >= g->high)) {        \
+                continue;                                                   \
+            }                                                               \
+            if (g->skipnan && npy_isnan(value)) {                           \
+                continue;                                                   \
+            }                                                               \
+            GATHER(i, value);                                               \
+        }                                                                   \
+        if (j == 0 && fill == 1) {                                          \
+            for (i=0; i<ninputs; i++) {                                     \
+                value = *(type *) (g->inputs[i] + index*g->strides[i]);     \
+                if (value != 0 && !(g->skipnan && npy_isnan(value))) {      \
+                    GATHER(i, value);                                       \
+                    break;                                                  \
+                }                                                           \
+            }                                                               \
+        }                                                                   \
+    } else {                                                                \
+        for (i=j=0; i<ninputs; i++) {                                       \
+            GATHER(i, *(type *) (g->inputs[i] + index*g->strides[i]));      \
+        }                                                                   \
+    }                                                                       \
+    return j;                                                               \
+}
+
+DEFINE_GATHER(npy_int8)
+DEFINE_GATHER(npy_uint8)
+DEFINE_GATHER(npy_int16)
+DEFINE_GATHER(npy_uint16)
+DEFINE_GATHER(npy_int32)
+DEFINE_GATHER(npy_int64)
+DEFINE_GATHER(npy_float32)
+DEFINE_GATHER(npy_float64)
+
+
+/* Combined values are converted to the output type as they are stored.
+   Integers are truncated toward zero as numpy's casts do, but saturate at
+   the limits of their type and take NaN (a 'nan' kind with nothing left,
+   or a NaN input to an average) to zero, where a C cast is undefined. */
+
+typedef void (*putter)(char *, npy_float64);
+
+#define DEFINE_PUT(type, convert)                                           \
+static void                                                                 \
+_put_##type(char *p, npy_float64 value)                                     \
+{                                                                           \
+    *(type *) p = convert(value);                                           \
+}
+
+DEFINE_PUT(npy_int8, _saturate_npy_int8)
+DEFINE_PUT(npy_uint8, _saturate_npy_uint8)
+DEFINE_PUT(npy_int16, _saturate_npy_int16)
+DEFINE_PUT(npy_uint16, _saturate_npy_uint16)
+DEFINE_PUT(npy_int32, _saturate_npy_int32)
+DEFINE_PUT(npy_int64, _saturate_npy_int64)
+DEFINE_PUT(npy_float32, (npy_float32))
+DEFINE_PUT(npy_float64, (npy_float64))
+
+/* Shifted inputs are sampled a row at a time (see _sample_row). */
+DEFINE_LOAD(npy_int8)
+DEFINE_LOAD(npy_uint8)
+DEFINE_LOAD(npy_int16)
+DEFINE_LOAD(npy_uint16)
+DEFINE_LOAD(npy_int32)
+DEFINE_LOAD(npy_int64)
+DEFINE_LOAD(npy_float32)
+DEFINE_LOAD(npy_float64)
+
+/* Deep stacks are read a tile at a time (see _fill_tile): a tiler converts
+   n pixels of a row to every 'step'th element of v. */
+typedef void (*tiler)(const char *, npy_intp, npy_intp, npy_float64 *,
+                      npy_intp);
+
+#define DEFINE_TILE(type)                                                   \
+static void                                                                 \
+_tile_##type(const char *p, npy_intp stride, npy_intp n, npy_float64 *v,    \
+             npy_intp step)                                                 \
+{                                                                           \
+    npy_intp i;                                                             \
+    for (i=0; i<n; i++) {                                                   \
+        v[i*step] = *(const type *) (p + i*stride);                         \
+    }                                                                       \
+}
+
+DEFINE_TILE(npy_int8)
+DEFINE_TILE(npy_uint8)
+DEFINE_TILE(npy_int16)
+DEFINE_TILE(npy_uint16)
+DEFINE_TILE(npy_int32)
+DEFINE_TILE(npy_int64)
+DEFINE_TILE(npy_float32)
+DEFINE_TILE(npy_float64)
+
+
+typedef struct
+{
+    int type_num;
+    gatherer gather;
+    putter put;
+    loader load;
+    tiler tile;
+} tmapping;
+
+
+static tmapping types[] = {
+    {NPY_INT8, _mask_and_gather_npy_int8, _put_npy_int8, _load_npy_int8,
+     _tile_npy_int8},
+    {NPY_UINT8, _mask_and_gather_npy_uint8, _put_npy_uint8, _load_npy_uint8,
+     _tile_npy_uint8},
+    {NPY_INT16, _mask_and_gather_npy_int16, _put_npy_int16, _load_npy_int16,
+     _tile_npy_int16},
+    {NPY_UINT16, _mask_and_gather_npy_uint16, _put_npy_uint16,
+     _load_npy_uint16, _tile_npy_uint16},
+    {NPY_INT32, _mask_and_gather_npy_int32, _put_npy_int32, _load_npy_int32,
+     _tile_npy_int32},
+    {NPY_INT64, _mask_and_gather_npy_int64, _put_npy_int64, _load_npy_int64,
+     _tile_npy_int64},
+    {NPY_FLOAT32, _mask_and_gather_npy_float32, _put_npy_float32,
+     _load_npy_float32, _tile_npy_float32},
+    {NPY_FLOAT64, _mask_and_gather_npy_float64, _put_npy_float64,
+     _load_npy_float64, _tile_npy_float64},
+};
+
+
+/* The kernels for 'type_num', or NULL if it has to be converted first. */
+static tmapping *
+_find_type(int type_num)
+{
+    size_t i;
+    for (i=0; i<sizeof(types)/sizeof(types[0]); i++) {
+        if (PyArray_EquivTypenums(types[i].type_num, type_num)) {
+            return &types[i];
         }
     }
-    return goodpix;
+    return NULL;
 }
 
 
 static npy_float64
-_inner_median(int goodpix, int nlow, int nhigh, int ninputs,
-              npy_float64 temp[MAX_ARRAYS])
+_inner_median(int goodpix, const combine_params *p, npy_float64 *temp)
 {
+    int nlow = p->nlow, nhigh = p->nhigh, ninputs = p->ninputs;
     npy_float64 median;
     int midpoint, medianpix = goodpix-nhigh-nlow;
     if (medianpix <= 0 && goodpix > 0) {
@@ -67,18 +566,13 @@ _inner_median(int goodpix, int nlow, int nhigh, int ninputs,
         medianpix = goodpix-nhigh-nlow;
     }
     if (medianpix <= 0) {
-        if (ninputs > 0) {
-            median = temp[ninputs-1];
-        } else{
-            median = 0;
-        }
+        median = _last_slot(goodpix, ninputs, temp);
     } else {
         midpoint = medianpix / 2;
-        if (medianpix % 2) /* odd */ {
-            median = temp[ midpoint + nlow ];
-        } else {
-            median = (temp[ midpoint + nlow ] +
-                      temp[midpoint + nlow - 1 ]) / 2.0;
+        median = _select(temp, goodpix, midpoint + nlow);
+        if (medianpix % 2 == 0) /* even */ {
+            /* the rank below the midpoint is the largest value left of it */
+            median = (median + _max(temp, midpoint + nlow)) / 2.0;
         }
     }
     return median;
@@ -86,20 +580,18 @@ _inner_median(int goodpix, int nlow, int nhigh, int ninputs,
 
 
 static npy_float64
-_inner_old_median(int goodpix, int nlow, int nhigh, int ninputs,
-                  npy_float64 temp[MAX_ARRAYS])
+_inner_old_median(int goodpix, const combine_params *p, npy_float64 *temp)
 {
+    int nlow = p->nlow, nhigh = p->nhigh;
     npy_float64 median;
     int midpoint, medianpix = goodpix-nhigh-nlow;
     if (medianpix <= 0) {
         median = 0;
     } else {
         midpoint = medianpix / 2;
-        if (medianpix % 2) /* odd */ {
-            median = temp[ midpoint + nlow ];
-        } else {
-            median = (temp[ midpoint + nlow ] +
-                  temp[ midpoint + nlow - 1 ]) / 2.0;
+        median = _select(temp, goodpix, midpoint + nlow);
+        if (medianpix % 2 == 0) /* even */ {
+            median = (median + _max(temp, midpoint + nlow)) / 2.0;
         }
     }
     return median;
@@ -107,19 +599,21 @@ _inner_old_median(int goodpix, int nlow, int nhigh, int ninputs,
 
 
 static npy_float64
-_inner_average(int goodpix, int nlow, int nhigh, int ninputs,
-               npy_float64 temp[MAX_ARRAYS])
+_inner_average(int goodpix, const combine_params *p, npy_float64 *temp)
 {
+    int nlow = p->nlow, nhigh = p->nhigh, ninputs = p->ninputs;
     npy_float64 average;
     int i, averagepix = goodpix - nhigh - nlow;
 
     if (averagepix <= 0) {
-        if (ninputs > 0) {
-            average = temp[ninputs-1];
-        } else{
-            average = 0;
-        }
+        average = _last_slot(goodpix, ninputs, temp);
     } else {
+        /*
+         * Only the kept ranks are sorted; they are summed in ascending
+         * order so the result does not depend on the input order.
+         */
+        _clip(temp, goodpix, nlow, nhigh);
+        _sort(temp+nlow, averagepix);
         for(i=nlow, average=0; i<averagepix+nlow;  i++) {
             average += temp[i];
         }
@@ -129,187 +623,1904 @@ _inner_average(int goodpix, int nlow, int nhigh, int ninputs,
 }
 
 
-static npy_float64
-_inner_minimum(int goodpix, int nlow, int nhigh, int ninputs,
-               npy_float64 temp[MAX_ARRAYS])
+static void
+_sift_down_pairs(npy_float64 *v, npy_float64 *w, int i, int n)
 {
-    int minimumpix = goodpix - nhigh - nlow;
-    if (minimumpix <= 0) {
-        return 0;
-    } else {
-        return temp[nlow];
+    int child;
+
+    for (; (child = 2*i + 1) < n; i = child) {
+        if (child + 1 < n && v[child] < v[child+1]) child++;
+        if (!(v[i] < v[child])) break;
+        SWAP(v[i], v[child]);
+        SWAP(w[i], w[child]);
     }
 }
 
 
-static int
-_combine(combiner f, int dim, int maxdim, int ninputs, int nlow, int nhigh,
-         int fillval, PyArrayObject *inputs[], PyArrayObject *masks[],
-         PyArrayObject *output)
+/* Sort v[0..n-1], carrying the weights w[0..n-1] along with the values. */
+static void
+_sort_pairs(npy_float64 *v, npy_float64 *w, int n)
 {
     int i, j;
+    npy_float64 x, y;
 
-    if (dim == maxdim-1) {
-        npy_float64 sorted[MAX_ARRAYS];
-        npy_float64 *tinputs[MAX_ARRAYS];
-        npy_uint8    *tmasks[MAX_ARRAYS];
-        npy_float64 *toutput;
-        int cols = inputs[0]->dimensions[dim];
-
-        /* Allocate and convert 1 temporary row at a time */
-        for(i=0; i<ninputs; i++) {
-            tinputs[i] = (npy_float64 *) inputs[i]->data;
-        }
-        if (masks) {
-            for(i=0; i<ninputs; i++) {
-                tmasks[i] = (npy_uint8 *) masks[i]->data;
-            }
-        }
-        toutput = (npy_float64 *) output->data;
-
-        for(j=0; j<cols; j++) {
-            int goodpix = _mask_and_sort(
-                ninputs, j, fillval, tinputs, masks ? tmasks : NULL, sorted);
-            if (fillval == 1) fillval = ninputs;
-            toutput[j] = f(goodpix, nlow, nhigh, ninputs, sorted);
-            for (i=0;i<ninputs;i++)
-                sorted[i] = 0;
-        }
-    } else {
-        for (i=0; i<inputs[0]->dimensions[dim]; i++) {
-            for(j=0; j<ninputs; j++) {
-                inputs[j]->data += inputs[j]->strides[dim]*i;
-                if (masks) {
-                    masks[j]->data += masks[j]->strides[dim]*i;
-                }
-            }
-            output->data += output->strides[dim]*i;
-            _combine(f, dim+1, maxdim, ninputs, nlow, nhigh, fillval,
-                     inputs, masks, output);
-            for(j=0; j<ninputs; j++) {
-                inputs[j]->data -= inputs[j]->strides[dim]*i;
-                if (masks) {
-                    masks[j]->data -= masks[j]->strides[dim]*i;
-                }
+    if (n <= SMALL_SORT) {
+        for (i=1; i<n; i++) {
+            x = v[i];
+            y = w[i];
+            for (j=i; j>0 && x < v[j-1]; j--) {
+                v[j] = v[j-1];
+                w[j] = w[j-1];
             }
-            output->data -= output->strides[dim]*i;
+            v[j] = x;
+            w[j] = y;
         }
+        return;
+    }
+    for (i=n/2-1; i>=0; i--) {
+        _sift_down_pairs(v, w, i, n);
+    }
+    for (i=n-1; i>0; i--) {
+        SWAP(v[0], v[i]);
+        SWAP(w[0], w[i]);
+        _sift_down_pairs(v, w, 0, i);
     }
-    return 0;
 }
 
 
-typedef struct
+/*
+ * The weighted mean of the values left after discarding the nlow lowest
+ * and nhigh highest; the weights follow the values (see frame_terms).
+ */
+static npy_float64
+_inner_waverage(int goodpix, const combine_params *p, npy_float64 *temp)
 {
-    char *name;
-    combiner fptr;
-} fmapping;
-
+    int nlow = p->nlow, nhigh = p->nhigh, ninputs = p->ninputs;
+    npy_float64 *weights = temp + ninputs, sum = 0, wsum = 0;
+    int i, averagepix = goodpix - nhigh - nlow;
 
-static fmapping functions[] = {
-    {"median", _inner_median},
-    {"average", _inner_average},
-    {"minimum", _inner_minimum},
-    {"imedian", _inner_median},
-    {"iaverage", _inner_average},
-};
+    if (averagepix <= 0) {
+        return _last_slot(goodpix, ninputs, temp);
+    }
+    if (nlow > 0 || nhigh > 0) {
+        _sort_pairs(temp, weights, goodpix);
+    }
+    for (i=nlow; i<averagepix+nlow; i++) {
+        sum += weights[i] * temp[i];
+        wsum += weights[i];
+    }
+    return wsum != 0 ? sum / wsum : 0;
+}
 
 
-static PyObject *
-_Py_combine(PyObject *obj, PyObject *args, PyObject *kw)
+static npy_float64
+_inner_minimum(int goodpix, const combine_params *p, npy_float64 *temp)
 {
-    PyObject   *arrays, *output;
-    int        nlow=0, nhigh=0, narrays;
-    PyObject   *badmasks=Py_None;
-    char       *keywds[] = { "arrays", "output", "nlow", "nhigh",
-                             "badmasks", "kind", NULL };
-    char *kind;
-    combiner f;
-    PyArrayObject *arr[MAX_ARRAYS], *bmk[MAX_ARRAYS], *toutput;
-    int i;
-    int fillval = 0;
-    char fname[] = " ";
+    int nlow = p->nlow, nhigh = p->nhigh;
+    int minimumpix = goodpix - nhigh - nlow;
+    if (minimumpix <= 0) {
+        return 0;
+    } else if (nlow == 0) {
+        return _min(temp, goodpix);
+    } else {
+        return _select(temp, goodpix, nlow);
+    }
+}
 
-    if (!PyArg_ParseTupleAndKeywords(args, kw, "OO|iiOs:combine", keywds,
-             &arrays, &output, &nlow, &nhigh, &badmasks, &kind)) {
-        return NULL;
+
+static npy_float64
+_inner_maximum(int goodpix, const combine_params *p, npy_float64 *temp)
+{
+    int nlow = p->nlow, nhigh = p->nhigh;
+    int maximumpix = goodpix - nhigh - nlow;
+    if (maximumpix <= 0) {
+        return 0;
+    } else if (nhigh == 0) {
+        return _max(temp, goodpix);
+    } else {
+        return _select(temp, goodpix, goodpix - 1 - nhigh);
     }
+}
 
-    narrays = PySequence_Length(arrays);
-    if (narrays < 0) {
-        return PyErr_Format(
-            PyExc_TypeError, "combine: arrays is not a sequence");
+
+/* The sum of the values left after discarding the nlow lowest and nhigh
+   highest, or 0 when none are. */
+static npy_float64
+_inner_sum(int goodpix, const combine_params *p, npy_float64 *temp)
+{
+    int nlow = p->nlow, nhigh = p->nhigh;
+    int i, sumpix = goodpix - nhigh - nlow;
+    npy_float64 sum = 0;
+
+    if (sumpix <= 0) {
+        return 0;
     }
-    if (narrays > MAX_ARRAYS) {
-        return PyErr_Format(
-            PyExc_TypeError, "combine: too many arrays.");
+    if (nlow > 0 || nhigh > 0) {
+        _clip(temp, goodpix, nlow, nhigh);
     }
-
-    for(i=0; i<narrays; i++) {
-        PyObject *a = PySequence_GetItem(arrays, i);
-        if (!a) {
-            return NULL;
-        }
-        arr[i] = (PyArrayObject *) PyArray_FROM_OTF(a, NPY_FLOAT64,
-                                                    NPY_ARRAY_INOUT_ARRAY2);
-        if (!arr[i]) {
-            return NULL;
-        }
-        Py_DECREF(a);
-        if (badmasks != Py_None) {
-            a =  PySequence_GetItem(badmasks, i);
-            if (!a) {
-                return NULL;
-            }
-            bmk[i] = (PyArrayObject *) PyArray_FROM_OTF(a, NPY_UINT8,
-                                                        NPY_IN_ARRAY);
-            if (!bmk[i]) {
-                return NULL;
-            }
-            Py_DECREF(a);
-        }
+    for (i=nlow; i<sumpix+nlow; i++) {
+        sum += temp[i];
     }
+    return sum;
+}
 
-    toutput = (PyArrayObject *) PyArray_FROM_OTF(output, NPY_FLOAT64,
-                                                 NPY_ARRAY_INOUT_ARRAY2);
-    if (!toutput) {
-        return NULL;
-    }
 
-    for (i=0,f=0; i<(sizeof(functions)/sizeof(functions[0])); i++)
-        if  (!strcmp(kind, functions[i].name)) {
-            f = functions[i].fptr;
-            strncpy(fname,functions[i].name,1);
-            if (!strcmp(fname,"i")) {
-                fillval = 1;
-            }
-            break;
-        }
-    if (!f)    return PyErr_Format(
-        PyExc_ValueError, "Invalid comination function.");
+/*
+ * Iterative rejection.
+ *
+ * Once the nlow/nhigh ranks are discarded, the values left are sorted a
+ * single time.  Every clipping pass then only moves the ends of the
+ * surviving range v[lo..hi-1] inwards, so nothing is gathered or sorted
+ * again however many passes are made.
+ */
 
-    if (_combine(f, 0, arr[0]->nd, narrays, nlow, nhigh, fillval, arr,
-                 (badmasks != Py_None ? bmk : NULL), toutput) < 0) {
-        return NULL;
-    }
+/* 1 / Phi^-1(3/4): turns a median absolute deviation into a sigma */
+#define MAD_TO_SIGMA 1.482602218505602
 
-    for(i=0; i<narrays; i++) {
-        PyArray_ResolveWritebackIfCopy(arr[i]);
-        Py_DECREF(arr[i]);
-        if (badmasks != Py_None) {
-            PyArray_ResolveWritebackIfCopy(bmk[i]);
-            Py_DECREF(bmk[i]);
-        }
-    }
-    PyArray_ResolveWritebackIfCopy(toutput);
-    Py_DECREF(toutput);
 
-    Py_INCREF(Py_None);
-    return Py_None;
+static npy_float64
+_sorted_median(npy_float64 *v, int n)
+{
+    return n % 2 ? v[n/2] : (v[n/2] + v[n/2-1]) / 2.0;
+}
+
+
+static npy_float64
+_sorted_mean(npy_float64 *v, int n)
+{
+    int i;
+    npy_float64 sum = 0;
+    for (i=0; i<n; i++) {
+        sum += v[i];
+    }
+    return sum / n;
+}
+
+
+static npy_float64
+_std(npy_float64 *v, int n)
+{
+    int i;
+    npy_float64 d, sum = 0, mean = _sorted_mean(v, n);
+    for (i=0; i<n; i++) {
+        d = v[i] - mean;
+        sum += d * d;
+    }
+    return sqrt(sum / n);
+}
+
+
+/*
+ * Median absolute deviation of the sorted v[0..n-1] from 'center', found by
+ * merging the deviations on either side of it in increasing order.
+ */
+static npy_float64
+_sorted_mad(npy_float64 *v, int n, npy_float64 center)
+{
+    int i, left, right;
+    npy_float64 d = 0, prev = 0;
+
+    for (right=0; right<n && v[right] < center; right++)
+        ;
+    left = right-1;
+    for (i=0; i<=n/2; i++) {
+        prev = d;
+        if (left >= 0 && (right >= n || center-v[left] <= v[right]-center)) {
+            d = center - v[left--];
+        } else {
+            d = v[right++] - center;
+        }
+    }
+    return n % 2 ? d : (prev + d) / 2.0;
+}
+
+
+/*
+ * Narrow the sorted range v[*lo..*hi-1] by rejecting values further than
+ * lsigma (below) or hsigma (above) times the spread from the median, until
+ * nothing more is rejected or maxiter passes have been made.  The spread is
+ * the standard deviation, or the scaled MAD when 'mad' is set.  A pass that
+ * would reject everything is not applied.
+ */
+static void
+_clip_range(npy_float64 *v, int *lo, int *hi, const combine_params *p,
+            int mad)
+{
+    int iter, newlo, newhi, n;
+    npy_float64 center, spread, low, high;
+
+    for (iter=0; iter<p->maxiter; iter++) {
+        n = *hi - *lo;
+        if (n < 2) break;
+        center = _sorted_median(v + *lo, n);
+        spread = mad ? MAD_TO_SIGMA * _sorted_mad(v + *lo, n, center)
+                     : _std(v + *lo, n);
+        low = center - p->lsigma * spread;
+        high = center + p->hsigma * spread;
+        for (newlo=*lo; newlo<*hi && v[newlo] < low; newlo++)
+            ;
+        for (newhi=*hi; newhi>newlo && v[newhi-1] > high; newhi--)
+            ;
+        if (newhi <= newlo || (newlo == *lo && newhi == *hi)) break;
+        *lo = newlo;
+        *hi = newhi;
+    }
+}
+
+
+static npy_float64
+_clipped(int goodpix, const combine_params *p, npy_float64 *temp, int mad,
+         int median)
+{
+    int lo = p->nlow, hi = goodpix - p->nhigh;
+
+    if (hi <= lo) {
+        return _last_slot(goodpix, p->ninputs, temp);
+    }
+    _clip(temp, goodpix, p->nlow, p->nhigh);
+    _sort(temp+lo, hi-lo);
+    _clip_range(temp, &lo, &hi, p, mad);
+    return median ? _sorted_median(temp+lo, hi-lo)
+                  : _sorted_mean(temp+lo, hi-lo);
+}
+
+
+static npy_float64
+_inner_sigclip_median(int goodpix, const combine_params *p,
+                      npy_float64 *temp)
+{
+    return _clipped(goodpix, p, temp, 0, 1);
+}
+
+
+static npy_float64
+_inner_sigclip_average(int goodpix, const combine_params *p,
+                       npy_float64 *temp)
+{
+    return _clipped(goodpix, p, temp, 0, 0);
+}
+
+
+static npy_float64
+_inner_madclip_median(int goodpix, const combine_params *p,
+                      npy_float64 *temp)
+{
+    return _clipped(goodpix, p, temp, 1, 1);
+}
+
+
+static npy_float64
+_inner_madclip_average(int goodpix, const combine_params *p,
+                       npy_float64 *temp)
+{
+    return _clipped(goodpix, p, temp, 1, 0);
+}
+
+
+/*
+ * Several statistics of one pixel stack from a single sort.  All but the
+ * count describe the values left once the nlow/nhigh ranks and, when 'clip'
+ * is CLIP_SIGMA or CLIP_MAD, iteratively clipped values are discarded; the
+ * median, mean and minimum agree with the single combiners.
+ */
+enum { STAT_MEDIAN, STAT_MEAN, STAT_MINIMUM, STAT_MAXIMUM, STAT_COUNT,
+       STAT_STD, STAT_MAD, NSTATS };
+enum { CLIP_NONE, CLIP_SIGMA, CLIP_MAD };
+
+
+static void
+_inner_stats(int goodpix, const combine_params *p, int clip,
+             npy_float64 *temp, npy_float64 *stats)
+{
+    int nlow = p->nlow, nhigh = p->nhigh, lo = nlow, hi = goodpix - nhigh;
+
+    _sort(temp, goodpix);
+    stats[STAT_COUNT] = goodpix;
+    if (hi <= lo) {
+        stats[STAT_MEAN] = _last_slot(goodpix, p->ninputs, temp);
+        stats[STAT_MEDIAN] = clip ? stats[STAT_MEAN] : 0;
+        stats[STAT_MINIMUM] = stats[STAT_MAXIMUM] = 0;
+        stats[STAT_STD] = stats[STAT_MAD] = 0;
+        if (!clip && goodpix > 0) {
+            /* reduce nlow/nhigh until something is left, as median does */
+            while (nhigh+nlow >= goodpix) {
+                if (nhigh > 0) nhigh = nhigh-1;
+                if (nlow > 0) nlow = nlow-1;
+            }
+            stats[STAT_MEDIAN] = _sorted_median(temp+nlow,
+                                                goodpix-nlow-nhigh);
+        }
+        return;
+    }
+    if (clip) {
+        _clip_range(temp, &lo, &hi, p, clip == CLIP_MAD);
+    }
+    stats[STAT_MEDIAN] = _sorted_median(temp+lo, hi-lo);
+    stats[STAT_MEAN] = _sorted_mean(temp+lo, hi-lo);
+    stats[STAT_MINIMUM] = temp[lo];
+    stats[STAT_MAXIMUM] = temp[hi-1];
+    stats[STAT_STD] = _std(temp+lo, hi-lo);
+    stats[STAT_MAD] = _sorted_mad(temp+lo, hi-lo, stats[STAT_MEDIAN]);
+}
+
+
+/*
+ * A frame of the stack as the kernels read it: the address of its first
+ * element and the shape and strides of its own axes.  The frames of a
+ * sequence describe its arrays; those of a cube are its planes, which share
+ * the shape and strides of the cube's trailing axes and lie a fixed stride
+ * apart, so that no array is ever made for them.
+ */
+typedef struct
+{
+    char *data;
+    int nd;
+    const npy_intp *dims, *strides;
+} frame;
+
+
+/*
+ * Each combine is split into independent output rows; a job covers a
+ * contiguous range of them and owns its own scratch, so jobs can run on
+ * separate threads without the GIL.
+ */
+typedef struct
+{
+    combiner f;
+    gatherer gather;
+    putter put;
+    combine_params params;
+    int ninputs, fillval;
+    const frame *inputs, *masks;
+    PyArrayObject *output;
+    const frame_terms *terms;
+    mask_format mask;
+    int limits;                      /* see gather_row */
+    npy_float64 low, high;
+    int skipnan;
+    int clip;                        /* combine_stats only */
+    PyArrayObject **outputs;         /* NSTATS, or NULL when not wanted */
+    putter *puts;
+    const shift_taps *xtaps, *ytaps; /* per input, when shifted */
+    loader load;                     /* reads shifted inputs */
+    tiler load_tile;
+    npy_intp tile;                   /* columns per tile, 0 for none */
+    npy_intp start, stop;
+    char *scratch, *rows;
+} combine_job;
+
+
+/*
+ * Per-job scratch: the gathered pixel stack and its weights plus the row
+ * pointer and stride of every input, mask and weight array.  Stacks of up
+ * to SMALL_STACK inputs use a buffer on the worker's own stack; deeper
+ * stacks get a heap block sized to the stack, allocated once per job and
+ * reused for every pixel.
+ */
+#define SMALL_STACK 64
+#define SCRATCH_SIZE(n) ((n) * (2*sizeof(npy_float64) + 3*sizeof(char *) + \
+                                3*sizeof(npy_intp)))
+
+
+/* Address of the first element of row 'row' of the frame 'f', all but the
+   last dimension counting as rows. */
+static char *
+_frame_row(const frame *f, npy_intp row)
+{
+    int d;
+    char *p = f->data;
+
+    for (d=f->nd-2; d>=0; d--) {
+        p += (row % f->dims[d]) * f->strides[d];
+        row /= f->dims[d];
+    }
+    return p;
+}
+
+
+static npy_intp
+_frame_cols(const frame *f)
+{
+    return f->nd ? f->dims[f->nd-1] : 1;
+}
+
+
+static npy_intp
+_frame_stride(const frame *f)
+{
+    return f->nd ? f->strides[f->nd-1] : 0;
+}
+
+
+/* The whole of 'a' as a frame. */
+static frame
+_frame_of(PyArrayObject *a)
+{
+    frame f;
+
+    f.data = PyArray_DATA(a);
+    f.nd = PyArray_NDIM(a);
+    f.dims = PyArray_DIMS(a);
+    f.strides = PyArray_STRIDES(a);
+    return f;
+}
+
+
+static char *
+_row_pointer(PyArrayObject *a, npy_intp row)
+{
+    frame f = _frame_of(a);
+    return _frame_row(&f, row);
+}
+
+
+static npy_intp
+_row_length(PyArrayObject *a)
+{
+    return PyArray_NDIM(a) ? PyArray_DIM(a, PyArray_NDIM(a)-1) : 1;
+}
+
+
+static npy_intp
+_row_stride(PyArrayObject *a)
+{
+    return PyArray_NDIM(a) ? PyArray_STRIDE(a, PyArray_NDIM(a)-1) : 0;
+}
+
+
+/* Whether the frame 'f' has the shape of 'a'. */
+static int
+_same_shape(const frame *f, PyArrayObject *a)
+{
+    return f->nd == PyArray_NDIM(a) &&
+        !memcmp(f->dims, PyArray_DIMS(a), f->nd * sizeof(npy_intp));
+}
+
+
+/*
+ * Lay 'g' out in the scratch of 'job' (or in 'small' when it has none),
+ * record the row strides of every input, mask and weight array and return
+ * where the pixel stack is gathered.
+ */
+static npy_float64 *
+_start_rows(const combine_job *job, gather_row *g, npy_float64 *small)
+{
+    int i, ninputs = job->ninputs;
+    PyArrayObject **weights = job->terms ? job->terms->pixel_weights : NULL;
+    npy_float64 *temp = job->scratch ? (npy_float64 *) job->scratch : small;
+
+    g->ninputs = ninputs;
+    g->inputs = (char **) (temp + 2*ninputs);
+    g->masks = g->inputs + ninputs;
+    g->weights = g->masks + ninputs;
+    g->strides = (npy_intp *) (g->weights + ninputs);
+    g->mstrides = g->strides + ninputs;
+    g->wstrides = g->mstrides + ninputs;
+    g->terms = job->terms;
+    g->mask = job->mask;
+    g->limits = job->limits;
+    g->low = job->low;
+    g->high = job->high;
+    g->skipnan = job->skipnan;
+
+    for(i=0; i<ninputs; i++) {
+        g->strides[i] = _frame_stride(&job->inputs[i]);
+        if (job->masks) {
+            g->mstrides[i] = _frame_stride(&job->masks[i]);
+        }
+        if (weights) {
+            g->wstrides[i] = _row_stride(weights[i]);
+        }
+    }
+    if (!job->masks) g->masks = NULL;
+    return temp;
+}
+
+
+/* Point 'g' at row 'row' of every input, mask and weight array. */
+static void
+_seek_row(const combine_job *job, gather_row *g, npy_intp row)
+{
+    int i;
+    PyArrayObject **weights = job->terms ? job->terms->pixel_weights : NULL;
+
+    for(i=0; i<job->ninputs; i++) {
+        g->inputs[i] = _frame_row(&job->inputs[i], row);
+        if (job->masks) {
+            g->masks[i] = _frame_row(&job->masks[i], row);
+        }
+        if (weights) {
+            g->weights[i] = _row_pointer(weights[i], row);
+        }
+    }
+}
+
+
+/*
+ * Cache blocking.
+ *
+ * Gathering a pixel stack straight from the inputs reads one value from
+ * every frame, each in a cache line of its own.  Deep stacks are instead
+ * gathered a tile of columns at a time: the tile's part of the current row
+ * of every input is read sequentially, converted to npy_float64 and laid
+ * out pixel-major in the job's row scratch, so that the stack of each
+ * pixel is contiguous, with its mask flags alongside as bytes.  The stacks
+ * are then gathered from the tile as from npy_float64 inputs with byte
+ * masks, in the same order and with the same values as from the inputs.
+ */
+#define TILE_MIN_INPUTS 18
+#define TILE_BYTES (128*1024)
+
+#define TILE_SIZE(n, cols) \
+    ((cols) * (n) * (sizeof(npy_float64) + 1) + \
+     (n) * (3*sizeof(char *) + 3*sizeof(npy_intp)))
+
+
+/* The columns per tile of 'ninputs' inputs for rows of 'cols' columns. */
+static npy_intp
+_tile_cols(int ninputs, npy_intp cols)
+{
+    npy_intp n = TILE_BYTES / (ninputs * (sizeof(npy_float64) + 1));
+
+    if (n < 8) n = 8;
+    return n < cols ? n : cols;
+}
+
+
+typedef struct
+{
+    npy_float64 *values;
+    npy_uint8 *flags;
+    gather_row g;                    /* reads the tile */
+} tile;
+
+
+/* Lay 't' out in the row scratch of 'job', to read tiles of the rows 'g'
+   points at. */
+static void
+_start_tile(const combine_job *job, const gather_row *g, tile *t)
+{
+    int i, ninputs = job->ninputs;
+
+    t->values = (npy_float64 *) job->rows;
+    t->g = *g;
+    t->g.inputs = (char **) (t->values + job->tile*ninputs);
+    t->g.masks = t->g.inputs + ninputs;
+    t->g.weights = t->g.masks + ninputs;
+    t->g.strides = (npy_intp *) (t->g.weights + ninputs);
+    t->g.mstrides = t->g.strides + ninputs;
+    t->g.wstrides = t->g.mstrides + ninputs;
+    t->flags = (npy_uint8 *) (t->g.wstrides + ninputs);
+    t->g.mask.kind = MASK_BYTES;
+    for (i=0; i<ninputs; i++) {
+        t->g.inputs[i] = (char *) (t->values + i);
+        t->g.strides[i] = ninputs * sizeof(npy_float64);
+        t->g.masks[i] = (char *) (t->flags + i);
+        t->g.mstrides[i] = ninputs;
+        t->g.wstrides[i] = g->wstrides[i];
+    }
+    if (!g->masks) t->g.masks = NULL;
+}
+
+
+/* Read the 'n' columns from 'first' of the rows 'g' points at into 't'. */
+static void
+_fill_tile(const combine_job *job, const gather_row *g, npy_intp first,
+           npy_intp n, tile *t)
+{
+    int i, ninputs = job->ninputs;
+    npy_intp k;
+
+    for (i=0; i<ninputs; i++) {
+        job->load_tile(g->inputs[i] + first*g->strides[i], g->strides[i],
+                       n, t->values + i, ninputs);
+        if (g->masks) {
+            for (k=0; k<n; k++) {
+                t->flags[k*ninputs + i] = _masked(
+                    g->masks[i], g->mstrides[i], first + k, &g->mask);
+            }
+        }
+        if (g->terms && g->terms->pixel_weights) {
+            t->g.weights[i] = g->weights[i] + first*g->wstrides[i];
+        }
+    }
+}
+
+
+/*
+ * Gather the stack of every pixel of the current row, a tile at a time
+ * when the job has tiles, and hand each to 'reduce'.  Tiles with nothing
+ * to reject or weigh already hold every stack whole, and are reduced in
+ * place.
+ */
+typedef void (*reducer)(const combine_job *, npy_intp, int, npy_float64 *,
+                        void *);
+
+static void
+_reduce_row(const combine_job *job, const gather_row *g, tile *t,
+            npy_intp cols, npy_float64 *sorted, reducer reduce, void *arg)
+{
+    npy_intp j, first, n = job->tile ? job->tile : cols;
+    int goodpix, ninputs = job->ninputs, fillval = job->fillval;
+    int whole = !g->masks && !g->limits && !g->skipnan && !g->terms;
+    npy_float64 *stack = sorted;
+
+    for (first=0; first<cols; first+=n) {
+        if (n > cols - first) n = cols - first;
+        if (job->tile) {
+            _fill_tile(job, g, first, n, t);
+        }
+        for (j=0; j<n; j++) {
+            if (!job->tile) {
+                goodpix = job->gather(g, j, fillval, sorted);
+            } else if (whole) {
+                goodpix = ninputs;
+                stack = t->values + j*ninputs;
+            } else {
+                goodpix = _mask_and_gather_npy_float64(&t->g, j, fillval,
+                                                       sorted);
+            }
+            if (fillval == 1) fillval = ninputs;
+            reduce(job, first + j, goodpix, stack, arg);
+        }
+    }
+}
+
+
+static void
+_put_combined(const combine_job *job, npy_intp j, int goodpix,
+              npy_float64 *sorted, void *toutput)
+{
+    job->put((char *) toutput + j*_row_stride(job->output),
+             job->f(goodpix, &job->params, sorted));
+}
+
+
+static void
+_combine(void *arg)
+{
+    combine_job *job = (combine_job *) arg;
+    npy_intp row, cols = _row_length(job->output);
+    npy_float64 small[SCRATCH_SIZE(SMALL_STACK) / sizeof(npy_float64)];
+    npy_float64 *sorted;
+    gather_row g;
+    tile t;
+
+    sorted = _start_rows(job, &g, small);
+    if (job->tile) {
+        _start_tile(job, &g, &t);
+    }
+    for (row=job->start; row<job->stop; row++) {
+        _seek_row(job, &g, row);
+        _reduce_row(job, &g, &t, cols, sorted, _put_combined,
+                    _row_pointer(job->output, row));
+    }
+}
+
+
+static void
+_put_stats(const combine_job *job, npy_intp j, int goodpix,
+           npy_float64 *sorted, void *toutputs)
+{
+    npy_float64 stats[NSTATS];
+    int k;
+
+    _inner_stats(goodpix, &job->params, job->clip, sorted, stats);
+    for (k=0; k<NSTATS; k++) {
+        if (job->outputs[k]) {
+            job->puts[k](((char **) toutputs)[k] +
+                         j*_row_stride(job->outputs[k]), stats[k]);
+        }
+    }
+}
+
+
+static void
+_combine_stats(void *arg)
+{
+    combine_job *job = (combine_job *) arg;
+    int k;
+    npy_intp row, cols = _row_length(job->output);
+    npy_float64 small[SCRATCH_SIZE(SMALL_STACK) / sizeof(npy_float64)];
+    npy_float64 *sorted;
+    char *toutputs[NSTATS];
+    gather_row g;
+    tile t;
+
+    sorted = _start_rows(job, &g, small);
+    if (job->tile) {
+        _start_tile(job, &g, &t);
+    }
+    for (row=job->start; row<job->stop; row++) {
+        _seek_row(job, &g, row);
+        for (k=0; k<NSTATS; k++) {
+            toutputs[k] = job->outputs[k] ?
+                _row_pointer(job->outputs[k], row) : NULL;
+        }
+        _reduce_row(job, &g, &t, cols, sorted, _put_stats, toutputs);
+    }
+}
+
+
+/*
+ * Shifted inputs.
+ *
+ * Each input is sampled at its own sub-pixel offset while the output is
+ * combined: for every output row, the matching row of every shifted input
+ * is interpolated into the job's row scratch, with a flag for every sample
+ * that is masked (any input pixel it draws on is) or falls beyond the edges
+ * of the input.  The pixel stacks are then gathered from those rows as
+ * from npy_float64 inputs with byte masks, so only one row of each shifted
+ * input ever exists.
+ */
+#define SHIFTED_SIZE(n, cols) \
+    ((n) * (cols) * (sizeof(npy_float64) + 1) + (cols) * sizeof(npy_float64))
+
+
+static void
+_sample_row(const combine_job *job, int i, npy_intp row, npy_float64 *values,
+            npy_uint8 *flags, npy_float64 *buf)
+{
+    const frame *a = &job->inputs[i];
+    const frame *m = job->masks ? &job->masks[i] : NULL;
+    const shift_taps *xt = &job->xtaps[i], *yt = &job->ytaps[i];
+    npy_intp x, c, r, cols = _frame_cols(a);
+    npy_intp mstride = m ? _frame_stride(m) : 0;
+    npy_float64 sum;
+    char *mrow = NULL;
+    int s, t;
+
+    memset(flags, 0, cols);
+    for (x=0; x<cols; x++) {
+        values[x] = 0;
+    }
+    for (t=0; t<yt->ntaps; t++) {
+        r = row + yt->first + t;
+        if (r < 0 || r >= a->dims[0]) {
+            memset(flags, 1, cols);
+            return;
+        }
+        job->load(_frame_row(a, r), _frame_stride(a), cols, buf);
+        if (m) {
+            mrow = _frame_row(m, r);
+        }
+        for (x=0; x<cols; x++) {
+            for (s=0, sum=0; s<xt->ntaps; s++) {
+                c = x + xt->first + s;
+                if (c < 0 || c >= cols) {
+                    flags[x] = 1;
+                    break;
+                }
+                if (mrow && _masked(mrow, mstride, c, &job->mask)) {
+                    flags[x] = 1;
+                }
+                sum += xt->weights[s] * buf[c];
+            }
+            values[x] += yt->weights[t] * sum;
+        }
+    }
+}
+
+
+static void
+_combine_shifted(void *arg)
+{
+    combine_job *job = (combine_job *) arg;
+    int i, ninputs = job->ninputs;
+    npy_intp j, row, cols = _row_length(job->output);
+    npy_intp ostride = _row_stride(job->output);
+    npy_float64 small[SCRATCH_SIZE(SMALL_STACK) / sizeof(npy_float64)];
+    npy_float64 *sorted, *values = (npy_float64 *) job->rows;
+    npy_float64 *buf = values + ninputs*cols;
+    npy_uint8 *flags = (npy_uint8 *) (buf + cols);
+    char *toutput;
+    gather_row g;
+
+    sorted = _start_rows(job, &g, small);
+    g.masks = g.inputs + ninputs;
+    for (i=0; i<ninputs; i++) {
+        g.inputs[i] = (char *) (values + i*cols);
+        g.strides[i] = sizeof(npy_float64);
+        g.masks[i] = (char *) (flags + i*cols);
+        g.mstrides[i] = 1;
+    }
+    g.mask.kind = MASK_BYTES;
+    for (row=job->start; row<job->stop; row++) {
+        int fillval = job->fillval;
+
+        for (i=0; i<ninputs; i++) {
+            _sample_row(job, i, row, values + i*cols, flags + i*cols, buf);
+        }
+        toutput = _row_pointer(job->output, row);
+        for(j=0; j<cols; j++) {
+            int goodpix = job->gather(&g, j, fillval, sorted);
+            if (fillval == 1) fillval = ninputs;
+            job->put(toutput + j*ostride,
+                     job->f(goodpix, &job->params, sorted));
+        }
+    }
+}
+
+
+/* Don't bother starting a thread for less than this many input values. */
+#define MIN_VALUES_PER_THREAD 65536
+
+
+/*
+ * Split the rows of job->output among up to 'nthreads' copies of 'job' and
+ * run 'worker' on all of them with the GIL released.
+ */
+static int
+_combine_threaded(void (*worker)(void *), const combine_job *job,
+                  int nthreads)
+{
+    combine_job *jobs;
+    int ninputs = job->ninputs;
+    char *scratch = NULL, *rowscratch = NULL;
+    npy_intp i, cols = _row_length(job->output);
+    size_t rowsize = job->xtaps ? SHIFTED_SIZE(ninputs, cols) :
+        job->tile ? TILE_SIZE(ninputs, job->tile) : 0;
+    npy_intp rows = cols ? PyArray_SIZE(job->output) / cols : 0;
+    npy_intp work = rows * cols * ninputs;
+
+    if (nthreads > rows) nthreads = (int) rows;
+    if (nthreads > work / MIN_VALUES_PER_THREAD) {
+        nthreads = (int) (work / MIN_VALUES_PER_THREAD);
+    }
+    if (nthreads < 1) nthreads = 1;
+
+    jobs = (combine_job *) malloc(nthreads * sizeof(combine_job));
+    if (ninputs > SMALL_STACK) {
+        scratch = (char *) malloc(nthreads * SCRATCH_SIZE(ninputs));
+    }
+    if (rowsize) {
+        rowscratch = (char *) malloc(nthreads * rowsize);
+    }
+    if (!jobs || (ninputs > SMALL_STACK && !scratch) ||
+            (rowsize && !rowscratch)) {
+        free(jobs);
+        free(scratch);
+        free(rowscratch);
+        PyErr_NoMemory();
+        return -1;
+    }
+    for (i=0; i<nthreads; i++) {
+        jobs[i] = *job;
+        jobs[i].start = rows * i / nthreads;
+        jobs[i].stop = rows * (i+1) / nthreads;
+        jobs[i].scratch = scratch ? scratch + i*SCRATCH_SIZE(ninputs) : NULL;
+        jobs[i].rows = rowscratch ? rowscratch + i*rowsize : NULL;
+    }
+
+    Py_BEGIN_ALLOW_THREADS
+    _run_parallel(worker, jobs, sizeof(combine_job), nthreads);
+    Py_END_ALLOW_THREADS
+
+    free(jobs);
+    free(scratch);
+    free(rowscratch);
+    return 0;
+}
+
+
+/*
+ * How a combiner gathers its pixel stacks:
+ *
+ *   FILL       a pixel with no good values takes the first nonzero value
+ *              of its stack instead
+ *   SKIP_NAN   NaNs are rejected like masked values
+ */
+enum { FILL = 1, SKIP_NAN = 2 };
+
+typedef struct
+{
+    char *name;
+    combiner fptr;
+    int flags;
+} fmapping;
+
+
+static fmapping functions[] = {
+    {"median", _inner_median, 0},
+    {"average", _inner_average, 0},
+    {"minimum", _inner_minimum, 0},
+    {"maximum", _inner_maximum, 0},
+    {"sum", _inner_sum, 0},
+    {"imedian", _inner_median, FILL},
+    {"iaverage", _inner_average, FILL},
+    {"sigclip_median", _inner_sigclip_median, 0},
+    {"sigclip_average", _inner_sigclip_average, 0},
+    {"madclip_median", _inner_madclip_median, 0},
+    {"madclip_average", _inner_madclip_average, 0},
+    {"nanmedian", _inner_median, SKIP_NAN},
+    {"nanaverage", _inner_average, SKIP_NAN},
+    {"nanminimum", _inner_minimum, SKIP_NAN},
+    {"nanmaximum", _inner_maximum, SKIP_NAN},
+    {"nansum", _inner_sum, SKIP_NAN},
+    {"nanimedian", _inner_median, FILL | SKIP_NAN},
+    {"naniaverage", _inner_average, FILL | SKIP_NAN},
+    {"nansigclip_median", _inner_sigclip_median, SKIP_NAN},
+    {"nansigclip_average", _inner_sigclip_average, SKIP_NAN},
+    {"nanmadclip_median", _inner_madclip_median, SKIP_NAN},
+    {"nanmadclip_average", _inner_madclip_average, SKIP_NAN},
+};
+
+
+/*
+ * Inputs are used in place when they already have a supported type, are
+ * aligned and in native byte order; otherwise (or when the inputs do not
+ * all share one type) they are converted to npy_float64.  Nothing is ever
+ * written to them.
+ */
+static tmapping *
+_input_type(PyArrayObject *arr[], int narrays)
+{
+    int i;
+    tmapping *type = narrays ? _find_type(PyArray_TYPE(arr[0])) : NULL;
+
+    for (i=1; type && i<narrays; i++) {
+        if (!PyArray_EquivTypenums(PyArray_TYPE(arr[i]), type->type_num)) {
+            type = NULL;
+        }
+    }
+    return type ? type : _find_type(NPY_FLOAT64);
+}
+
+
+/*
+ * Settle the format of the masks bmk[] and convert those that do not have
+ * it.  Masks are read in place when they are bool or integer arrays of a
+ * common size: bytes when no 'bad_bits' are given and they are all one
+ * byte, and flags of the widest size otherwise, with 'bad_bits' (or, when
+ * it is None, every bit) marking bad pixels.  Packed masks are uint8.
+ */
+static int
+_as_masks(PyArrayObject *bmk[], int narrays, PyObject *bad_bits, int packed,
+          mask_format *format)
+{
+    int i, size = 1, type_num;
+
+    format->bits = ~(npy_uint64) 0;
+    if (bad_bits != Py_None) {
+        if (packed) {
+            PyErr_Format(PyExc_ValueError,
+                         "combine: packed masks cannot have bad_bits.");
+            return -1;
+        }
+        format->bits = PyLong_AsUnsignedLongLongMask(bad_bits);
+        if (PyErr_Occurred()) {
+            return -1;
+        }
+    }
+    for (i=0; i<narrays; i++) {
+        if (PyArray_ISINTEGER(bmk[i]) && PyArray_ITEMSIZE(bmk[i]) > size) {
+            size = (int) PyArray_ITEMSIZE(bmk[i]);
+        }
+    }
+    if (packed) {
+        format->kind = MASK_PACKED;
+    } else if (size == 1 && bad_bits == Py_None) {
+        format->kind = MASK_BYTES;
+    } else {
+        format->kind = size == 1 ? MASK_BITS8 : size == 2 ? MASK_BITS16 :
+            size == 4 ? MASK_BITS32 : MASK_BITS64;
+    }
+    if (packed) size = 1;
+
+    for (i=0; i<narrays; i++) {
+        PyArrayObject *m = bmk[i];
+        int flags = NPY_ARRAY_ALIGNED | NPY_ARRAY_NOTSWAPPED;
+        int integer = PyArray_ISINTEGER(m) || PyArray_ISBOOL(m);
+
+        if (integer && PyArray_ITEMSIZE(m) == size) {
+            /* flags of either sign are read as unsigned */
+            type_num = PyArray_TYPE(m);
+        } else {
+            type_num = size == 1 ? NPY_UINT8 : size == 2 ? NPY_UINT16 :
+                size == 4 ? NPY_UINT32 : NPY_UINT64;
+            if (integer) flags |= NPY_ARRAY_FORCECAST;
+        }
+        bmk[i] = (PyArrayObject *) PyArray_FROM_OTF(
+            (PyObject *) m, type_num, flags);
+        Py_DECREF(m);
+        if (!bmk[i]) {
+            return -1;
+        }
+    }
+    return 0;
+}
+
+
+/*
+ * The output is written in place when it has a supported type; any other
+ * output goes through a npy_float64 copy that is written back at the end.
+ */
+static PyArrayObject *
+_as_output(PyObject *output, tmapping **type)
+{
+    *type = PyArray_Check(output) ?
+        _find_type(PyArray_TYPE((PyArrayObject *) output)) : NULL;
+    if (*type) {
+        return (PyArrayObject *) PyArray_FROM_OTF(
+            output, (*type)->type_num,
+            NPY_ARRAY_ALIGNED | NPY_ARRAY_NOTSWAPPED | NPY_ARRAY_WRITEABLE |
+            NPY_ARRAY_WRITEBACKIFCOPY);
+    }
+    *type = _find_type(NPY_FLOAT64);
+    return (PyArrayObject *) PyArray_FROM_OTF(output, NPY_FLOAT64,
+                                              NPY_ARRAY_INOUT_ARRAY2);
+}
+
+
+/* A rejection limit: None (NaN), or a number. */
+static int
+_limit(PyObject *o, npy_float64 *value)
+{
+    if (o == Py_None) {
+        *value = NPY_NAN;
+        return 0;
+    }
+    *value = PyFloat_AsDouble(o);
+    return *value == -1.0 && PyErr_Occurred() ? -1 : 0;
+}
+
+
+/* Per-frame terms are npy_float64 vectors with one value per input. */
+static PyArrayObject *
+_per_frame(PyObject *a, int narrays, const char *name)
+{
+    PyArrayObject *r = (PyArrayObject *) PyArray_FROM_OTF(
+        a, NPY_FLOAT64, NPY_ARRAY_IN_ARRAY);
+
+    if (r && (PyArray_NDIM(r) != 1 || PyArray_DIM(r, 0) != narrays)) {
+        PyErr_Format(PyExc_ValueError,
+                     "combine: %s must have one value per array.", name);
+        Py_DECREF(r);
+        r = NULL;
+    }
+    return r;
 }
 
+
+/*
+ * Per-pixel weights are read in place when they are all npy_float32 or
+ * npy_float64; otherwise they are converted to npy_float64.
+ */
+static int
+_as_weights(PyObject *weights, const frame frames[], PyArrayObject *wgt[],
+            int narrays, int *single)
+{
+    int i, type_num;
+
+    if (PySequence_Length(weights) != narrays) {
+        if (!PyErr_Occurred()) {
+            PyErr_Format(PyExc_ValueError,
+                         "combine: weights must have one array per array.");
+        }
+        return -1;
+    }
+    *single = 1;
+    for (i=0; i<narrays; i++) {
+        PyObject *a = PySequence_GetItem(weights, i);
+        if (!a) {
+            return -1;
+        }
+        wgt[i] = (PyArrayObject *) PyArray_FROM_O(a);
+        Py_DECREF(a);
+        if (!wgt[i]) {
+            return -1;
+        }
+        if (PyArray_TYPE(wgt[i]) != NPY_FLOAT32) {
+            *single = 0;
+        }
+    }
+    type_num = *single ? NPY_FLOAT32 : NPY_FLOAT64;
+    for (i=0; i<narrays; i++) {
+        PyArrayObject *w = (PyArrayObject *) PyArray_FROM_OTF(
+            (PyObject *) wgt[i], type_num,
+            NPY_ARRAY_ALIGNED | NPY_ARRAY_NOTSWAPPED);
+        Py_DECREF(wgt[i]);
+        wgt[i] = w;
+        if (!wgt[i]) {
+            return -1;
+        }
+        if (!_same_shape(&frames[i], wgt[i])) {
+            PyErr_Format(PyExc_ValueError,
+                         "combine: weights must match the shape of arrays.");
+            return -1;
+        }
+    }
+    return 0;
+}
+
+
+/*
+ * Fetch the stack 'stack' of 'narrays' frames into arr[]: an array of at
+ * least one dimension whole into arr[0], as a cube of frames along its
+ * first axis, and any other sequence item by item.  Returns whether it was
+ * a cube, or -1.
+ */
+static int
+_fetch_stack(PyObject *stack, int narrays, PyArrayObject *arr[])
+{
+    int i;
+
+    if (PyArray_Check(stack) && PyArray_NDIM((PyArrayObject *) stack) > 0 &&
+            PyArray_DIM((PyArrayObject *) stack, 0) > 0) {
+        Py_INCREF(stack);
+        arr[0] = (PyArrayObject *) stack;
+        return 1;
+    }
+    for(i=0; i<narrays; i++) {
+        PyObject *a = PySequence_GetItem(stack, i);
+        if (!a) {
+            return -1;
+        }
+        arr[i] = (PyArrayObject *) PyArray_FROM_O(a);
+        Py_DECREF(a);
+        if (!arr[i]) {
+            return -1;
+        }
+    }
+    return 0;
+}
+
+
+/* The frames of a stack fetched into arr[]. */
+static void
+_stack_frames(PyArrayObject *arr[], int cube, int narrays, frame frames[])
+{
+    int i;
+
+    for(i=0; i<narrays; i++) {
+        if (cube) {
+            frames[i].data = PyArray_BYTES(arr[0]) +
+                i * PyArray_STRIDE(arr[0], 0);
+            frames[i].nd = PyArray_NDIM(arr[0]) - 1;
+            frames[i].dims = PyArray_DIMS(arr[0]) + 1;
+            frames[i].strides = PyArray_STRIDES(arr[0]) + 1;
+        } else {
+            frames[i] = _frame_of(arr[i]);
+        }
+    }
+}
+
+
+/*
+ * Fetch the inputs into arr[] and frames[] and, unless 'badmasks' is None,
+ * the masks into bmk[] and mframes[] in the format *mask, converting every
+ * input to their common type *itype.  A cube is kept whole in arr[0] (or
+ * bmk[0]), with nothing in the other entries.  On failure the arrays
+ * fetched so far are left in arr[] and bmk[] for the caller to release.
+ */
+static int
+_get_inputs(PyObject *arrays, PyObject *badmasks, int narrays,
+            PyArrayObject *arr[], PyArrayObject *bmk[], frame frames[],
+            frame mframes[], tmapping **itype, PyObject *bad_bits,
+            int packed, mask_format *mask)
+{
+    int i, n, ok, cube, mcube = 0;
+
+    if ((cube = _fetch_stack(arrays, narrays, arr)) < 0) {
+        return -1;
+    }
+    n = cube ? 1 : narrays;
+    if (badmasks != Py_None) {
+        if ((mcube = _fetch_stack(badmasks, narrays, bmk)) < 0 ||
+                _as_masks(bmk, mcube ? 1 : narrays, bad_bits, packed,
+                          mask) < 0) {
+            return -1;
+        }
+    }
+
+    *itype = _input_type(arr, n);
+    for(i=0; i<n; i++) {
+        PyArrayObject *a = (PyArrayObject *) PyArray_FROM_OTF(
+            (PyObject *) arr[i], (*itype)->type_num,
+            NPY_ARRAY_ALIGNED | NPY_ARRAY_NOTSWAPPED);
+        Py_DECREF(arr[i]);
+        arr[i] = a;
+        if (!arr[i]) {
+            return -1;
+        }
+    }
+    _stack_frames(arr, cube, narrays, frames);
+    if (badmasks == Py_None) {
+        return 0;
+    }
+
+    _stack_frames(bmk, mcube, narrays, mframes);
+    ok = !mcube || PyArray_DIM(bmk[0], 0) == narrays;
+    for(i=0; ok && i<narrays; i++) {
+        const frame *a = &frames[i], *m = &mframes[i];
+
+        ok = m->nd == a->nd;
+        if (ok && packed) {
+            ok = a->nd > 0 &&
+                !memcmp(m->dims, a->dims, (a->nd-1) * sizeof(npy_intp)) &&
+                _frame_cols(m) == (_frame_cols(a) + 7) / 8;
+        } else if (ok) {
+            ok = !memcmp(m->dims, a->dims, a->nd * sizeof(npy_intp));
+        }
+    }
+    if (!ok) {
+        PyErr_Format(PyExc_ValueError,
+                     "combine: badmasks must match the shape of arrays.");
+        return -1;
+    }
+    return 0;
+}
+
+
+static PyObject *
+_Py_combine(PyObject *obj, PyObject *args, PyObject *kw)
+{
+    PyObject   *arrays, *output, *result = NULL;
+    int        nlow=0, nhigh=0, narrays;
+    PyObject   *badmasks=Py_None, *weights=Py_None, *frame_weights=Py_None;
+    PyObject   *scales=Py_None, *zeros=Py_None, *offsets=Py_None;
+    PyObject   *low=Py_None, *high=Py_None, *bad_bits=Py_None;
+    char       *keywds[] = { "arrays", "output", "nlow", "nhigh",
+                             "badmasks", "kind", "nthreads", "lsigma",
+                             "hsigma", "maxiter", "weights", "frame_weights",
+                             "scales", "zeros", "offsets", "low", "high",
+                             "bad_bits", "packed_masks", NULL };
+    char *kind;
+    combiner f;
+    tmapping *itype, *otype;
+    PyArrayObject **arr = NULL, **bmk = NULL, **wgt = NULL, *toutput = NULL;
+    frame *frames = NULL;
+    PyArrayObject *fscales = NULL, *fzeros = NULL, *fweights = NULL;
+    PyArrayObject *foffsets = NULL;
+    shift_taps *taps = NULL;
+    frame_terms terms, *pterms = NULL;
+    combine_job job;
+    int i;
+    int fillval = 0;
+    int nthreads = 1, packed = 0;
+    combine_params params;
+
+    params.lsigma = params.hsigma = 3.0;
+    params.maxiter = 5;
+    if (!PyArg_ParseTupleAndKeywords(args, kw, "OO|iiOsiddiOOOOOOOOi:combine",
+             keywds, &arrays, &output, &nlow, &nhigh, &badmasks, &kind,
+             &nthreads, &params.lsigma, &params.hsigma, &params.maxiter,
+             &weights, &frame_weights, &scales, &zeros, &offsets, &low,
+             &high, &bad_bits, &packed)) {
+        return NULL;
+    }
+    memset(&job, 0, sizeof(job));
+    if (_limit(low, &job.low) < 0 || _limit(high, &job.high) < 0) {
+        return NULL;
+    }
+    job.limits = low != Py_None || high != Py_None;
+    if (params.lsigma < 0 || params.hsigma < 0) {
+        return PyErr_Format(PyExc_ValueError,
+                            "combine: lsigma and hsigma must be >= 0.");
+    }
+
+    for (i=0,f=0; i<(int) (sizeof(functions)/sizeof(functions[0])); i++)
+        if  (!strcmp(kind, functions[i].name)) {
+            f = functions[i].fptr;
+            if (functions[i].flags & FILL) {
+                fillval = 1;
+            }
+            job.skipnan = (functions[i].flags & SKIP_NAN) != 0;
+            break;
+        }
+    if (!f)    return PyErr_Format(
+        PyExc_ValueError, "Invalid comination function.");
+    if (weights != Py_None || frame_weights != Py_None) {
+        if (f != _inner_average) {
+            return PyErr_Format(PyExc_ValueError,
+                "combine: weights are only supported by average.");
+        }
+        if (weights != Py_None && frame_weights != Py_None) {
+            return PyErr_Format(PyExc_ValueError,
+                "combine: give either weights or frame_weights, not both.");
+        }
+        f = _inner_waverage;
+    }
+    if (offsets != Py_None && weights != Py_None) {
+        return PyErr_Format(PyExc_ValueError,
+            "combine: per-pixel weights cannot be shifted.");
+    }
+    if (offsets != Py_None && job.limits) {
+        return PyErr_Format(PyExc_ValueError,
+            "combine: low and high cannot be used with offsets.");
+    }
+
+    narrays = PySequence_Length(arrays);
+    if (narrays < 0) {
+        return PyErr_Format(
+            PyExc_TypeError, "combine: arrays is not a sequence");
+    }
+
+    arr = (PyArrayObject **) PyMem_Malloc(
+        3*narrays * sizeof(PyArrayObject *));
+    if (!arr) {
+        return PyErr_NoMemory();
+    }
+    bmk = arr + narrays;
+    wgt = bmk + narrays;
+    for(i=0; i<narrays; i++) {
+        arr[i] = bmk[i] = wgt[i] = NULL;
+    }
+    frames = (frame *) PyMem_Malloc(2*(narrays ? narrays : 1) *
+                                    sizeof(frame));
+    if (!frames) {
+        PyErr_NoMemory();
+        goto exit;
+    }
+    if (_get_inputs(arrays, badmasks, narrays, arr, bmk, frames,
+                    frames + narrays, &itype, bad_bits, packed,
+                    &job.mask) < 0) {
+        goto exit;
+    }
+
+    toutput = _as_output(output, &otype);
+    if (!toutput) {
+        goto exit;
+    }
+    for(i=0; i<narrays; i++) {
+        if (!_same_shape(&frames[i], toutput)) {
+            PyErr_Format(PyExc_ValueError,
+                         "combine: all arrays must have identical shapes.");
+            goto exit;
+        }
+    }
+
+    memset(&terms, 0, sizeof(terms));
+    if (scales != Py_None) {
+        if (!(fscales = _per_frame(scales, narrays, "scales"))) goto exit;
+        terms.scales = (npy_float64 *) PyArray_DATA(fscales);
+        pterms = &terms;
+    }
+    if (zeros != Py_None) {
+        if (!(fzeros = _per_frame(zeros, narrays, "zeros"))) goto exit;
+        terms.zeros = (npy_float64 *) PyArray_DATA(fzeros);
+        pterms = &terms;
+    }
+    if (frame_weights != Py_None) {
+        if (!(fweights = _per_frame(frame_weights, narrays, "weights"))) {
+            goto exit;
+        }
+        terms.weights = (npy_float64 *) PyArray_DATA(fweights);
+        pterms = &terms;
+    }
+    if (weights != Py_None) {
+        if (_as_weights(weights, frames, wgt, narrays, &terms.single) < 0) {
+            goto exit;
+        }
+        terms.pixel_weights = wgt;
+        pterms = &terms;
+    }
+    if (offsets != Py_None) {
+        npy_float64 *d;
+
+        foffsets = (PyArrayObject *) PyArray_FROMANY(
+            offsets, NPY_FLOAT64, 2, 2, NPY_ARRAY_CARRAY_RO);
+        if (!foffsets) goto exit;
+        if (PyArray_DIM(foffsets, 0) != narrays ||
+                PyArray_DIM(foffsets, 1) != 2) {
+            PyErr_Format(PyExc_ValueError,
+                         "combine: offsets must hold a (dx, dy) pair for "
+                         "each array.");
+            goto exit;
+        }
+        if (PyArray_NDIM(toutput) != 2) {
+            PyErr_Format(PyExc_ValueError,
+                         "combine: shifted arrays must be 2-dimensional.");
+            goto exit;
+        }
+        taps = (shift_taps *) PyMem_Malloc(
+            2*(narrays ? narrays : 1) * sizeof(shift_taps));
+        if (!taps) {
+            PyErr_NoMemory();
+            goto exit;
+        }
+        d = (npy_float64 *) PyArray_DATA(foffsets);
+        for (i=0; i<narrays; i++) {
+            if (!Py_IS_FINITE(d[2*i]) || !Py_IS_FINITE(d[2*i+1])) {
+                PyErr_Format(PyExc_ValueError,
+                             "combine: offsets must be finite.");
+                goto exit;
+            }
+            _linear_taps(d[2*i], &taps[i]);
+            _linear_taps(d[2*i+1], &taps[narrays+i]);
+        }
+    }
+
+    params.ninputs = narrays;
+    params.nlow = nlow;
+    params.nhigh = nhigh;
+    job.f = f;
+    job.gather = itype->gather;
+    job.put = otype->put;
+    job.params = params;
+    job.ninputs = narrays;
+    job.fillval = fillval;
+    job.inputs = frames;
+    job.masks = badmasks != Py_None ? frames + narrays : NULL;
+    job.terms = pterms;
+    job.output = toutput;
+    job.load = itype->load;
+    job.load_tile = itype->tile;
+    if (!taps && narrays >= TILE_MIN_INPUTS) {
+        job.tile = _tile_cols(narrays, _row_length(toutput));
+    }
+    if (taps) {
+        job.gather = _mask_and_gather_npy_float64;
+        job.xtaps = taps;
+        job.ytaps = taps + narrays;
+    }
+    if (_combine_threaded(taps ? _combine_shifted : _combine, &job,
+                          nthreads) < 0) {
+        goto exit;
+    }
+
+    Py_INCREF(Py_None);
+    result = Py_None;
+
+  exit:
+    for(i=0; i<narrays; i++) {
+        Py_XDECREF(arr[i]);
+        Py_XDECREF(bmk[i]);
+        Py_XDECREF(wgt[i]);
+    }
+    PyMem_Free(arr);
+    PyMem_Free(frames);
+    PyMem_Free(taps);
+    Py_XDECREF(fscales);
+    Py_XDECREF(fzeros);
+    Py_XDECREF(fweights);
+    Py_XDECREF(foffsets);
+    if (toutput) {
+        if (result) {
+            PyArray_ResolveWritebackIfCopy(toutput);
+        } else {
+            PyArray_DiscardWritebackIfCopy(toutput);
+        }
+        Py_DECREF(toutput);
+    }
+    return result;
+}
+
+/*
+ * combine_stats(arrays, outputs, ...) fills every output that is not None,
+ * in the order median, mean, minimum, maximum, count, std and mad, from a
+ * single sort of each pixel stack.
+ */
+static PyObject *
+_Py_combine_stats(PyObject *obj, PyObject *args, PyObject *kw)
+{
+    PyObject   *arrays, *outputs, *result = NULL;
+    int        nlow=0, nhigh=0, narrays;
+    PyObject   *badmasks=Py_None, *bad_bits=Py_None;
+    char       *keywds[] = { "arrays", "outputs", "nlow", "nhigh",
+                             "badmasks", "nthreads", "clip", "lsigma",
+                             "hsigma", "maxiter", "bad_bits", "packed_masks",
+                             NULL };
+    char *clip = NULL;
+    tmapping *itype, *otype;
+    PyArrayObject **arr = NULL, **bmk = NULL;
+    frame *frames = NULL;
+    PyArrayObject *toutputs[NSTATS];
+    putter puts[NSTATS];
+    combine_job job;
+    int i, k;
+    int nthreads = 1, packed = 0;
+
+    memset(&job, 0, sizeof(job));
+    job.params.lsigma = job.params.hsigma = 3.0;
+    job.params.maxiter = 5;
+    if (!PyArg_ParseTupleAndKeywords(args, kw, "OO|iiOizddiOi:combine_stats",
+             keywds, &arrays, &outputs, &nlow, &nhigh, &badmasks, &nthreads,
+             &clip, &job.params.lsigma, &job.params.hsigma,
+             &job.params.maxiter, &bad_bits, &packed)) {
+        return NULL;
+    }
+    if (job.params.lsigma < 0 || job.params.hsigma < 0) {
+        return PyErr_Format(PyExc_ValueError,
+                            "combine_stats: lsigma and hsigma must be >= 0.");
+    }
+    if (!clip) {
+        job.clip = CLIP_NONE;
+    } else if (!strcmp(clip, "sigma")) {
+        job.clip = CLIP_SIGMA;
+    } else if (!strcmp(clip, "mad")) {
+        job.clip = CLIP_MAD;
+    } else {
+        return PyErr_Format(PyExc_ValueError,
+                            "combine_stats: clip must be 'sigma' or 'mad'.");
+    }
+    if (PySequence_Length(outputs) != NSTATS) {
+        if (!PyErr_Occurred()) {
+            PyErr_Format(PyExc_ValueError,
+                         "combine_stats: outputs must have %d entries.",
+                         NSTATS);
+        }
+        return NULL;
+    }
+    narrays = PySequence_Length(arrays);
+    if (narrays < 0) {
+        return PyErr_Format(
+            PyExc_TypeError, "combine_stats: arrays is not a sequence");
+    }
+
+    for (k=0; k<NSTATS; k++) {
+        toutputs[k] = NULL;
+    }
+    arr = (PyArrayObject **) PyMem_Malloc(
+        2*narrays * sizeof(PyArrayObject *));
+    if (!arr) {
+        return PyErr_NoMemory();
+    }
+    bmk = arr + narrays;
+    for(i=0; i<narrays; i++) {
+        arr[i] = bmk[i] = NULL;
+    }
+    frames = (frame *) PyMem_Malloc(2*(narrays ? narrays : 1) *
+                                    sizeof(frame));
+    if (!frames) {
+        PyErr_NoMemory();
+        goto exit;
+    }
+    if (_get_inputs(arrays, badmasks, narrays, arr, bmk, frames,
+                    frames + narrays, &itype, bad_bits, packed,
+                    &job.mask) < 0) {
+        goto exit;
+    }
+
+    for (k=0; k<NSTATS; k++) {
+        PyObject *o = PySequence_GetItem(outputs, k);
+        if (!o) {
+            goto exit;
+        }
+        if (o != Py_None) {
+            toutputs[k] = _as_output(o, &otype);
+            puts[k] = otype->put;
+        }
+        Py_DECREF(o);
+        if (o != Py_None && !toutputs[k]) {
+            goto exit;
+        }
+        if (toutputs[k] && !job.output) {
+            job.output = toutputs[k];
+        }
+    }
+    if (!job.output) {
+        PyErr_Format(PyExc_ValueError,
+                     "combine_stats: no outputs were given.");
+        goto exit;
+    }
+    for (k=0; k<NSTATS; k++) {
+        for(i=0; toutputs[k] && i<narrays; i++) {
+            if (!_same_shape(&frames[i], toutputs[k])) {
+                PyErr_Format(
+                    PyExc_ValueError,
+                    "combine_stats: all arrays must have identical shapes.");
+                goto exit;
+            }
+        }
+    }
+
+    job.params.ninputs = narrays;
+    job.params.nlow = nlow;
+    job.params.nhigh = nhigh;
+    job.gather = itype->gather;
+    job.ninputs = narrays;
+    job.inputs = frames;
+    job.masks = badmasks != Py_None ? frames + narrays : NULL;
+    job.outputs = toutputs;
+    job.puts = puts;
+    job.load_tile = itype->tile;
+    if (narrays >= TILE_MIN_INPUTS) {
+        job.tile = _tile_cols(narrays, _row_length(job.output));
+    }
+    if (_combine_threaded(_combine_stats, &job, nthreads) < 0) {
+        goto exit;
+    }
+
+    Py_INCREF(Py_None);
+    result = Py_None;
+
+  exit:
+    for(i=0; i<narrays; i++) {
+        Py_XDECREF(arr[i]);
+        Py_XDECREF(bmk[i]);
+    }
+    PyMem_Free(arr);
+    PyMem_Free(frames);
+    for (k=0; k<NSTATS; k++) {
+        if (toutputs[k]) {
+            if (result) {
+                PyArray_ResolveWritebackIfCopy(toutputs[k]);
+            } else {
+                PyArray_DiscardWritebackIfCopy(toutputs[k]);
+            }
+            Py_DECREF(toutputs[k]);
+        }
+    }
+    return result;
+}
+
+/*
+ * Threshholding.
+ *
+ * Every row of every frame is loaded once and compared against both
+ * limits, and the result is written straight into the caller's mask plane
+ * for that frame: one byte per pixel, or one bit per pixel in the
+ * big-endian order of numpy.packbits(..., axis=-1).  With 'update' the
+ * result is ORed into what the plane already holds.  A missing limit is
+ * NaN, which no comparison passes, so that the loops need no branches.
+ */
+typedef void (*flagger)(const char *, npy_intp, npy_intp, npy_float64,
+                        npy_float64, npy_uint8 *);
+
+#define DEFINE_FLAG(type)                                                   \
+static void                                                                 \
+_flag_##type(const char *p, npy_intp stride, npy_intp n, npy_float64 low,   \
+             npy_float64 high, npy_uint8 *flags)                            \
+{                                                                           \
+    npy_intp i;                                                             \
+    if (stride == sizeof(type)) {                                           \
+        const type *v = (const type *) p;                                   \
+        for (i=0; i<n; i++) {                                               \
+            flags[i] = (v[i] < low) | (v[i] >= high);                       \
+        }                                                                   \
+    } else {                                                                \
+        for (i=0; i<n; i++) {                                               \
+            type v = *(const type *) (p + i*stride);                        \
+            flags[i] = (v < low) | (v >= high);                             \
+        }                                                                   \
+    }                                                                       \
+}
+
+DEFINE_FLAG(npy_int8)
+DEFINE_FLAG(npy_uint8)
+DEFINE_FLAG(npy_int16)
+DEFINE_FLAG(npy_uint16)
+DEFINE_FLAG(npy_int32)
+DEFINE_FLAG(npy_int64)
+DEFINE_FLAG(npy_float32)
+DEFINE_FLAG(npy_float64)
+
+
+static flagger
+_find_flagger(int type_num)
+{
+    switch (type_num) {
+    case NPY_INT8: return _flag_npy_int8;
+    case NPY_UINT8: return _flag_npy_uint8;
+    case NPY_INT16: return _flag_npy_int16;
+    case NPY_UINT16: return _flag_npy_uint16;
+    case NPY_INT32: return _flag_npy_int32;
+    case NPY_INT64: return _flag_npy_int64;
+    case NPY_FLOAT32: return _flag_npy_float32;
+    default: return _flag_npy_float64;
+    }
+}
+
+
+typedef struct
+{
+    PyArrayObject **inputs, **outputs;
+    flagger *flags;
+    npy_intp rows;                   /* per frame */
+    npy_float64 low, high;
+    int packed, update;
+    npy_intp start, stop;            /* rows of the stack, frame by frame */
+    npy_uint8 *buf;
+} threshhold_job;
+
+
+static void
+_threshhold(void *arg)
+{
+    threshhold_job *job = (threshhold_job *) arg;
+    npy_intp r, row, x, b, cols, ostride;
+    npy_uint8 *f = job->buf;
+    int i;
+    char *out;
+
+    for (r=job->start; r<job->stop; r++) {
+        PyArrayObject *a, *o;
+
+        i = (int) (r / job->rows);
+        row = r % job->rows;
+        a = job->inputs[i];
+        o = job->outputs[i];
+        cols = _row_length(a);
+        ostride = _row_stride(o);
+        out = _row_pointer(o, row);
+        if (!job->packed && !job->update && ostride == 1) {
+            job->flags[i](_row_pointer(a, row), _row_stride(a), cols,
+                          job->low, job->high, (npy_uint8 *) out);
+            continue;
+        }
+        job->flags[i](_row_pointer(a, row), _row_stride(a), cols, job->low,
+                      job->high, f);
+        if (!job->packed) {
+            for (x=0; x<cols; x++, out+=ostride) {
+                *(npy_uint8 *) out = job->update ?
+                    (*(npy_uint8 *) out != 0) | f[x] : f[x];
+            }
+            continue;
+        }
+        for (x=cols; x<(cols+7)/8*8; x++) {
+            f[x] = 0;
+        }
+        for (b=0; b*8<cols; b++, out+=ostride) {
+            const npy_uint8 *g = f + b*8;
+            npy_uint8 bits = (npy_uint8) (
+                g[0] << 7 | g[1] << 6 | g[2] << 5 | g[3] << 4 |
+                g[4] << 3 | g[5] << 2 | g[6] << 1 | g[7]);
+
+            *(npy_uint8 *) out = job->update ?
+                *(npy_uint8 *) out | bits : bits;
+        }
+    }
+}
+
+
+/*
+ * threshhold(arrays, outputs, low=None, high=None, packed=0, update=0,
+ * nthreads=1) flags the pixels of every frame that are < low or >= high in
+ * the matching plane of 'outputs', bool (or, packed, uint8) or cast to it.
+ */
+static PyObject *
+_Py_threshhold(PyObject *obj, PyObject *args, PyObject *kw)
+{
+    PyObject   *arrays, *outputs, *result = NULL;
+    PyObject   *low = Py_None, *high = Py_None;
+    char       *keywds[] = { "arrays", "outputs", "low", "high", "packed",
+                             "update", "nthreads", NULL };
+    PyArrayObject **arr = NULL, **out = NULL;
+    threshhold_job job, *jobs = NULL;
+    npy_uint8 *bufs = NULL;
+    npy_intp cols, rows, ncols;
+    int i, narrays = 0, nthreads = 1, ok;
+
+    memset(&job, 0, sizeof(job));
+    if (!PyArg_ParseTupleAndKeywords(args, kw, "OO|OOiii:threshhold", keywds,
+             &arrays, &outputs, &low, &high, &job.packed, &job.update,
+             &nthreads)) {
+        return NULL;
+    }
+    if (_limit(low, &job.low) < 0 || _limit(high, &job.high) < 0) {
+        return NULL;
+    }
+    narrays = PySequence_Length(arrays);
+    if (narrays < 0) {
+        return PyErr_Format(
+            PyExc_TypeError, "threshhold: arrays is not a sequence");
+    }
+    if (PySequence_Length(outputs) != narrays) {
+        if (!PyErr_Occurred()) {
+            PyErr_Format(PyExc_ValueError,
+                         "threshhold: outputs must have one plane per array.");
+        }
+        return NULL;
+    }
+    arr = (PyArrayObject **) PyMem_Malloc(
+        2*(narrays ? narrays : 1) * sizeof(PyArrayObject *));
+    job.flags = (flagger *) PyMem_Malloc(
+        (narrays ? narrays : 1) * sizeof(flagger));
+    if (!arr || !job.flags) {
+        PyMem_Free(arr);
+        PyMem_Free(job.flags);
+        return PyErr_NoMemory();
+    }
+    out = arr + narrays;
+    for (i=0; i<narrays; i++) {
+        arr[i] = out[i] = NULL;
+    }
+
+    for (i=0; i<narrays; i++) {
+        PyObject *a = PySequence_GetItem(arrays, i);
+        tmapping *type;
+
+        if (!a) goto exit;
+        type = PyArray_Check(a) ?
+            _find_type(PyArray_TYPE((PyArrayObject *) a)) : NULL;
+        if (!type) type = _find_type(NPY_FLOAT64);
+        arr[i] = (PyArrayObject *) PyArray_FROM_OTF(
+            a, type->type_num, NPY_ARRAY_ALIGNED | NPY_ARRAY_NOTSWAPPED);
+        Py_DECREF(a);
+        if (!arr[i]) goto exit;
+        job.flags[i] = _find_flagger(type->type_num);
+
+        /* planes of any other type are flagged in a copy, which is cast
+           back into them */
+        a = PySequence_GetItem(outputs, i);
+        if (!a) goto exit;
+        out[i] = (PyArrayObject *) PyArray_FROM_OTF(
+            a, job.packed ? NPY_UINT8 : NPY_BOOL,
+            NPY_ARRAY_ALIGNED | NPY_ARRAY_WRITEABLE |
+            NPY_ARRAY_WRITEBACKIFCOPY | NPY_ARRAY_FORCECAST);
+        Py_DECREF(a);
+        if (!out[i]) goto exit;
+
+        ok = PyArray_NDIM(arr[i]) == PyArray_NDIM(arr[0]) &&
+            PyArray_NDIM(out[i]) == PyArray_NDIM(arr[0]);
+        if (ok && !PyArray_SAMESHAPE(arr[i], arr[0])) ok = 0;
+        if (ok && job.packed) {
+            ok = PyArray_NDIM(arr[i]) > 0 &&
+                !memcmp(PyArray_DIMS(out[i]), PyArray_DIMS(arr[i]),
+                        (PyArray_NDIM(arr[i])-1) * sizeof(npy_intp)) &&
+                _row_length(out[i]) == (_row_length(arr[i]) + 7) / 8;
+        } else if (ok) {
+            ok = PyArray_SAMESHAPE(out[i], arr[i]);
+        }
+        if (!ok) {
+            PyErr_Format(PyExc_ValueError,
+                         "threshhold: arrays must have identical shapes "
+                         "and outputs must match them.");
+            goto exit;
+        }
+    }
+    if (narrays == 0 || PyArray_SIZE(arr[0]) == 0) {
+        goto done;
+    }
+
+    cols = _row_length(arr[0]);
+    job.rows = PyArray_SIZE(arr[0]) / cols;
+    job.inputs = arr;
+    job.outputs = out;
+    rows = job.rows * narrays;
+    if (nthreads > rows) nthreads = (int) rows;
+    if (nthreads > rows * cols / MIN_VALUES_PER_THREAD) {
+        nthreads = (int) (rows * cols / MIN_VALUES_PER_THREAD);
+    }
+    if (nthreads < 1) nthreads = 1;
+    ncols = cols + 8;
+    jobs = (threshhold_job *) malloc(nthreads * sizeof(threshhold_job));
+    bufs = (npy_uint8 *) malloc(nthreads * ncols);
+    if (!jobs || !bufs) {
+        PyErr_NoMemory();
+        goto exit;
+    }
+    for (i=0; i<nthreads; i++) {
+        jobs[i] = job;
+        jobs[i].start = rows * i / nthreads;
+        jobs[i].stop = rows * (i+1) / nthreads;
+        jobs[i].buf = bufs + i*ncols;
+    }
+    Py_BEGIN_ALLOW_THREADS
+    _run_parallel(_threshhold, jobs, sizeof(threshhold_job), nthreads);
+    Py_END_ALLOW_THREADS
+
+  done:
+    Py_INCREF(Py_None);
+    result = Py_None;
+
+  exit:
+    free(jobs);
+    free(bufs);
+    for (i=0; i<narrays; i++) {
+        Py_XDECREF(arr[i]);
+        if (out[i]) {
+            if (result) {
+                PyArray_ResolveWritebackIfCopy(out[i]);
+            } else {
+                PyArray_DiscardWritebackIfCopy(out[i]);
+            }
+            Py_DECREF(out[i]);
+        }
+    }
+    PyMem_Free(arr);
+    PyMem_Free(job.flags);
+    return result;
+}
+
+
 static PyMethodDef _combineMethods[] = {
     {"combine", (PyCFunction) _Py_combine, METH_VARARGS | METH_KEYWORDS},
+    {"combine_stats", (PyCFunction) _Py_combine_stats,
+     METH_VARARGS | METH_KEYWORDS},
+    {"threshhold", (PyCFunction) _Py_threshhold,
+     METH_VARARGS | METH_KEYWORDS},
     {NULL, NULL} /* Sentinel */
 };
 
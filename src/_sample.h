@@ -0,0 +1,246 @@
+/*
+ * Sampling an image at a sub-pixel shift, shared by the translate and
+ * combine kernels: boundary modes and the separable interpolation taps of
+ * a shift.
+ */
+#ifndef STSCI_IMAGE_SAMPLE_H
+#define STSCI_IMAGE_SAMPLE_H
+
+#include <math.h>
+#include <string.h>
+#include "numpy/npy_math.h"
+
+
+/*
+ * Images are read in place in their own type, following their strides; a
+ * loader converts n pixels of a row to npy_float64 on the way in.
+ */
+typedef void (*loader)(const char *, npy_intp, npy_intp, npy_float64 *);
+
+#define DEFINE_LOAD(type)                                                   \
+static void                                                                 \
+_load_##type(const char *p, npy_intp stride, npy_intp n, npy_float64 *v)    \
+{                                                                           \
+    npy_intp i;                                                             \
+    for (i=0; i<n; i++) {                                                   \
+        v[i] = *(const type *) (p + i*stride);                              \
+    }                                                                       \
+}
+
+
+/*
+ * A plain C cast of an npy_float64 beyond the range of an integer type, or
+ * of a NaN, is undefined.  _saturate_<type>() truncates toward zero like
+ * the cast, but takes values beyond the range to its nearest limit and NaN
+ * to zero.
+ */
+#define DEFINE_SATURATE(type, lo, hi)                                       \
+static NPY_INLINE type                                                      \
+_saturate_##type(npy_float64 v)                                             \
+{                                                                           \
+    if (!(v >= (npy_float64) (lo))) {                                       \
+        return npy_isnan(v) ? 0 : (lo);                                     \
+    }                                                                       \
+    if (v >= (npy_float64) (hi)) {                                          \
+        return (hi);                                                        \
+    }                                                                       \
+    return (type) v;                                                        \
+}
+
+DEFINE_SATURATE(npy_int8, NPY_MIN_INT8, NPY_MAX_INT8)
+DEFINE_SATURATE(npy_uint8, 0, NPY_MAX_UINT8)
+DEFINE_SATURATE(npy_int16, NPY_MIN_INT16, NPY_MAX_INT16)
+DEFINE_SATURATE(npy_uint16, 0, NPY_MAX_UINT16)
+DEFINE_SATURATE(npy_int32, NPY_MIN_INT32, NPY_MAX_INT32)
+DEFINE_SATURATE(npy_uint32, 0, NPY_MAX_UINT32)
+DEFINE_SATURATE(npy_int64, NPY_MIN_INT64, NPY_MAX_INT64)
+
+
+/*
+ * How pixels beyond the edge of an axis of length n are found:
+ *
+ *   MODE_NEAREST    the nearest edge pixel           a a | a b c d | d d
+ *   MODE_WRAP       the opposite edge (periodic)     c d | a b c d | a b
+ *   MODE_REFLECT    reflection about the edge        b a | a b c d | d c
+ *   MODE_CONSTANT   a constant value                 k k | a b c d | k k
+ */
+typedef enum { MODE_NEAREST, MODE_WRAP, MODE_REFLECT, MODE_CONSTANT } bmode;
+
+
+static NPY_INLINE int
+_parse_mode(const char *name, bmode *mode)
+{
+    static const char *names[] = {"nearest", "wrap", "reflect", "constant"};
+    int i;
+
+    for (i=0; i<(int) (sizeof(names)/sizeof(names[0])); i++) {
+        if (!strcmp(name, names[i])) {
+            *mode = (bmode) i;
+            return 0;
+        }
+    }
+    return -1;
+}
+
+
+/* The pixel standing for index k of an axis of length n, or -1 for the
+   constant of MODE_CONSTANT. */
+static NPY_INLINE npy_intp
+_map_index(npy_intp k, npy_intp n, bmode mode)
+{
+    if (k >= 0 && k < n) return k;
+    switch (mode) {
+    case MODE_NEAREST:
+        return k < 0 ? 0 : n-1;
+    case MODE_WRAP:
+        k %= n;
+        return k < 0 ? k + n : k;
+    case MODE_REFLECT:
+        k %= 2*n;
+        if (k < 0) k += 2*n;
+        return k < n ? k : 2*n-1-k;
+    default:
+        return -1;
+    }
+}
+
+
+/*
+ * The taps of a 1-D shift by 'shift' pixels: output pixel i is
+ * sum(weights[t] * input[i + first + t] for t < ntaps), that is the input
+ * sampled at i - shift.
+ */
+#define MAX_TAPS 10
+
+typedef struct
+{
+    int ntaps;
+    npy_intp first;
+    npy_float64 weights[MAX_TAPS];
+} shift_taps;
+
+
+/* Linear interpolation; whole-pixel shifts take a single tap, so that
+   they copy pixels exactly. */
+static NPY_INLINE void
+_linear_taps(npy_float64 shift, shift_taps *taps)
+{
+    npy_float64 x = -shift, base = floor(x), f = x - base;
+
+    taps->first = (npy_intp) base;
+    taps->weights[0] = 1.0 - f;
+    taps->weights[1] = f;
+    taps->ntaps = f == 0 ? 1 : 2;
+}
+
+
+/*
+ * The interpolation kernels:
+ *
+ *   KERNEL_BILINEAR   linear, 2 taps per axis
+ *   KERNEL_BICUBIC    Keys' cubic convolution with a = -1/2, 4 taps
+ *   KERNEL_LANCZOS3   the windowed sinc of Lanczos, 6 taps
+ *   KERNEL_LANCZOS5   the same with a wider window, 10 taps
+ *
+ * All of them interpolate: whole-pixel shifts copy pixels exactly.
+ */
+typedef enum {
+    KERNEL_BILINEAR, KERNEL_BICUBIC, KERNEL_LANCZOS3, KERNEL_LANCZOS5
+} ikernel;
+
+
+static NPY_INLINE int
+_parse_kernel(const char *name, ikernel *kernel)
+{
+    static const char *names[] = {"bilinear", "bicubic", "lanczos3",
+                                  "lanczos5"};
+    int i;
+
+    for (i=0; i<(int) (sizeof(names)/sizeof(names[0])); i++) {
+        if (!strcmp(name, names[i])) {
+            *kernel = (ikernel) i;
+            return 0;
+        }
+    }
+    return -1;
+}
+
+
+static NPY_INLINE npy_float64
+_cubic(npy_float64 d)
+{
+    d = fabs(d);
+    if (d <= 1) return (1.5*d - 2.5)*d*d + 1;
+    if (d < 2) return ((-0.5*d + 2.5)*d - 4)*d + 2;
+    return 0;
+}
+
+
+static NPY_INLINE npy_float64
+_lanczos(npy_float64 d, int n)
+{
+    npy_float64 px = NPY_PI * d;
+
+    if (d == 0) return 1;
+    if (fabs(d) >= n) return 0;
+    return n * sin(px) * sin(px / n) / (px * px);
+}
+
+
+/*
+ * The weights depend only on the kernel and on the fractional part of the
+ * shift.  They are kept in a small table indexed by that fraction, so that
+ * the shifts of a stack registered to a common sub-pixel grid compute each
+ * set of weights once.  The table is not locked: taps are only ever made
+ * while holding the GIL.
+ */
+#define TAP_CACHE_SIZE 64
+
+static NPY_INLINE void
+_kernel_taps(ikernel kernel, npy_float64 shift, shift_taps *taps)
+{
+    static struct {
+        int valid;
+        ikernel kernel;
+        npy_float64 f;
+        int ntaps;
+        npy_float64 weights[MAX_TAPS];
+    } cache[TAP_CACHE_SIZE];
+    npy_float64 x = -shift, base = floor(x), f = x - base, sum = 0;
+    int t, n, slot;
+
+    if (kernel == KERNEL_BILINEAR || f == 0) {
+        _linear_taps(shift, taps);
+        return;
+    }
+    n = kernel == KERNEL_BICUBIC ? 2 : kernel == KERNEL_LANCZOS3 ? 3 : 5;
+    taps->first = (npy_intp) base - (n-1);
+    slot = ((int) (f * TAP_CACHE_SIZE * 7919) + (int) kernel) %
+        TAP_CACHE_SIZE;
+    if (cache[slot].valid && cache[slot].kernel == kernel &&
+            cache[slot].f == f) {
+        taps->ntaps = cache[slot].ntaps;
+        memcpy(taps->weights, cache[slot].weights, sizeof(taps->weights));
+        return;
+    }
+    /* tap t samples the input at distance f + n-1 - t from x */
+    taps->ntaps = 2*n;
+    for (t=0; t<2*n; t++) {
+        npy_float64 d = f + (n-1) - t;
+        taps->weights[t] = n == 2 ? _cubic(d) : _lanczos(d, n);
+        sum += taps->weights[t];
+    }
+    if (n != 2) {
+        /* so that flat images stay flat */
+        for (t=0; t<2*n; t++) {
+            taps->weights[t] /= sum;
+        }
+    }
+    cache[slot].valid = 1;
+    cache[slot].kernel = kernel;
+    cache[slot].f = f;
+    cache[slot].ntaps = taps->ntaps;
+    memcpy(cache[slot].weights, taps->weights, sizeof(taps->weights));
+}
+
+#endif
@@ -0,0 +1,79 @@
+/*
+ * Running independent jobs on threads of their own, shared by the combine
+ * and translate kernels.
+ */
+#ifndef STSCI_IMAGE_THREADS_H
+#define STSCI_IMAGE_THREADS_H
+
+#include <pythread.h>
+
+#ifndef PYTHREAD_INVALID_THREAD_ID
+#define PYTHREAD_INVALID_THREAD_ID (-1)
+#endif
+
+
+typedef struct
+{
+    void (*func)(void *);
+    void *arg;
+    PyThread_type_lock done;
+} thread_task;
+
+
+static void
+_thread_main(void *arg)
+{
+    thread_task *task = (thread_task *) arg;
+    task->func(task->arg);
+    PyThread_release_lock(task->done);
+}
+
+
+/*
+ * Run func(args[0]) ... func(args[njobs-1]) concurrently and wait for all
+ * of them, the calling thread taking the first one.  Must be called with
+ * the GIL released.  Jobs that cannot be given a thread run inline, so
+ * this never fails.
+ */
+static void
+_run_parallel(void (*func)(void *), void *args, size_t argsize, int njobs)
+{
+    thread_task *tasks = NULL;
+    int i;
+
+    if (njobs > 1) {
+        tasks = (thread_task *) malloc(njobs * sizeof(thread_task));
+    }
+    if (!tasks) {
+        for (i=0; i<njobs; i++) {
+            func((char *) args + i*argsize);
+        }
+        return;
+    }
+    for (i=1; i<njobs; i++) {
+        tasks[i].func = func;
+        tasks[i].arg = (char *) args + i*argsize;
+        tasks[i].done = PyThread_allocate_lock();
+        if (tasks[i].done) {
+            PyThread_acquire_lock(tasks[i].done, WAIT_LOCK);
+            if (PyThread_start_new_thread(_thread_main, &tasks[i]) ==
+                    PYTHREAD_INVALID_THREAD_ID) {
+                PyThread_release_lock(tasks[i].done);
+                func(tasks[i].arg);
+            }
+        } else {
+            func(tasks[i].arg);
+        }
+    }
+    func(args);
+    for (i=1; i<njobs; i++) {
+        if (tasks[i].done) {
+            PyThread_acquire_lock(tasks[i].done, WAIT_LOCK);
+            PyThread_release_lock(tasks[i].done);
+            PyThread_free_lock(tasks[i].done);
+        }
+    }
+    free(tasks);
+}
+
+#endif
@@ -0,0 +1,556 @@
+#include <Python.h>
+#include <numpy/arrayobject.h>
+
+#include "_sample.h"
+#include "_threads.h"
+
+
+/*
+ * Storing rows.
+ *
+ * Images are written in place in their own type, following their strides;
+ * every row is converted from npy_float64 once on its way out, as it was
+ * converted to npy_float64 once on its way in.  Integer images are rounded
+ * to the nearest value and saturate at the limits of their type, since the
+ * bicubic and Lanczos kernels overshoot at sharp edges.
+ */
+typedef void (*storer)(char *, npy_intp, npy_intp, const npy_float64 *);
+
+#define DEFINE_LOAD_STORE(type, convert)                                    \
+DEFINE_LOAD(type)                                                           \
+                                                                            \
+static void                                                                 \
+_store_##type(char *p, npy_intp stride, npy_intp n, const npy_float64 *v)   \
+{                                                                           \
+    npy_intp i;                                                             \
+    for (i=0; i<n; i++) {                                                   \
+        *(type *) (p + i*stride) = convert(v[i]);                           \
+    }                                                                       \
+}
+
+#define DEFINE_ROUND(type)                                                  \
+static NPY_INLINE type                                                      \
+_round_##type(npy_float64 v)                                                \
+{                                                                           \
+    return _saturate_##type(npy_rint(v));                                   \
+}
+
+DEFINE_ROUND(npy_int8)
+DEFINE_ROUND(npy_uint8)
+DEFINE_ROUND(npy_int16)
+DEFINE_ROUND(npy_uint16)
+DEFINE_ROUND(npy_int32)
+DEFINE_ROUND(npy_uint32)
+DEFINE_ROUND(npy_int64)
+
+DEFINE_LOAD_STORE(npy_int8, _round_npy_int8)
+DEFINE_LOAD_STORE(npy_uint8, _round_npy_uint8)
+DEFINE_LOAD_STORE(npy_int16, _round_npy_int16)
+DEFINE_LOAD_STORE(npy_uint16, _round_npy_uint16)
+DEFINE_LOAD_STORE(npy_int32, _round_npy_int32)
+DEFINE_LOAD_STORE(npy_uint32, _round_npy_uint32)
+DEFINE_LOAD_STORE(npy_int64, _round_npy_int64)
+DEFINE_LOAD_STORE(npy_float32, (npy_float32))
+DEFINE_LOAD_STORE(npy_float64, (npy_float64))
+
+
+typedef struct
+{
+    int type_num;
+    loader load;
+    storer store;
+} tmapping;
+
+
+static tmapping types[] = {
+    {NPY_INT8, _load_npy_int8, _store_npy_int8},
+    {NPY_UINT8, _load_npy_uint8, _store_npy_uint8},
+    {NPY_INT16, _load_npy_int16, _store_npy_int16},
+    {NPY_UINT16, _load_npy_uint16, _store_npy_uint16},
+    {NPY_INT32, _load_npy_int32, _store_npy_int32},
+    {NPY_UINT32, _load_npy_uint32, _store_npy_uint32},
+    {NPY_INT64, _load_npy_int64, _store_npy_int64},
+    {NPY_FLOAT32, _load_npy_float32, _store_npy_float32},
+    {NPY_FLOAT64, _load_npy_float64, _store_npy_float64},
+};
+
+
+/* The row functions for 'type_num', or NULL if it has to be converted. */
+static tmapping *
+_find_type(int type_num)
+{
+    size_t i;
+    for (i=0; i<sizeof(types)/sizeof(types[0]); i++) {
+        if (PyArray_EquivTypenums(types[i].type_num, type_num)) {
+            return &types[i];
+        }
+    }
+    return NULL;
+}
+
+
+/*
+ * Shifting.
+ *
+ * The shift is separable: every input row an output row needs is first
+ * shifted along x into a ring of 'ntaps' rows, and the output row is the
+ * weighted sum of that ring.  Consecutive output rows share all but one of
+ * their input rows, so each input row is loaded and shifted along x only
+ * once, and nothing image-sized is ever allocated.
+ *
+ * The output need not have the shape of the input: output pixel (y, x) is
+ * the input sampled at (y - dy, x - dx), whatever lies beyond the input
+ * being found by the boundary mode.
+ */
+
+/* A 2-D image: its first pixel and the length and stride of each axis. */
+typedef struct
+{
+    char *data;
+    npy_intp dims[2], strides[2];
+} plane;
+
+
+static void
+_plane(PyArrayObject *a, int axis, plane *p)
+{
+    p->data = PyArray_BYTES(a);
+    p->dims[0] = PyArray_DIM(a, axis);
+    p->dims[1] = PyArray_DIM(a, axis+1);
+    p->strides[0] = PyArray_STRIDE(a, axis);
+    p->strides[1] = PyArray_STRIDE(a, axis+1);
+}
+
+
+typedef struct
+{
+    shift_taps xt, yt;
+    bmode mode;
+    npy_float64 cval;
+    tmapping *itype, *otype;
+    plane input, output;
+} shift_job;
+
+
+/* Scratch for one shift from an 'icols' to an 'ocols' wide image: the ring,
+   one input and one output row, and the input column of every tap of every
+   output column. */
+#define SHIFT_SCRATCH(icols, ocols) \
+    (((MAX_TAPS + 2) * (ocols) + (icols) + MAX_TAPS) * sizeof(npy_float64))
+
+
+static void
+_shift_row(const shift_job *job, npy_intp row, const npy_intp *cmap,
+           npy_float64 *src, npy_float64 *dest)
+{
+    const plane *a = &job->input;
+    npy_intp i, cols = job->output.dims[1];
+    const npy_float64 *w = job->xt.weights;
+    npy_float64 sum;
+    int t;
+
+    if (row < 0) {
+        for (i=0; i<cols; i++) dest[i] = job->cval;
+        return;
+    }
+    job->itype->load(a->data + row*a->strides[0], a->strides[1], a->dims[1],
+                     src);
+    for (i=0; i<cols; i++) {
+        for (t=0, sum=0; t<job->xt.ntaps; t++) {
+            sum += w[t] * (cmap[i+t] >= 0 ? src[cmap[i+t]] : job->cval);
+        }
+        dest[i] = sum;
+    }
+}
+
+
+static void
+_shift(const shift_job *job, char *scratch)
+{
+    const plane *a = &job->input, *o = &job->output;
+    npy_intp rows = a->dims[0], cols = o->dims[1];
+    npy_intp i, j, k, r, tags[MAX_TAPS];
+    int t, slot, ntaps = job->yt.ntaps;
+    npy_float64 *ring = (npy_float64 *) scratch;
+    npy_float64 *out = ring + MAX_TAPS*cols, *src = out + cols;
+    npy_intp *cmap = (npy_intp *) (src + a->dims[1]);
+
+    for (i=0; i<cols+job->xt.ntaps-1; i++) {
+        cmap[i] = _map_index(i + job->xt.first, a->dims[1], job->mode);
+    }
+    for (t=0; t<ntaps; t++) {
+        tags[t] = -2;
+    }
+    for (j=0; j<o->dims[0]; j++) {
+        for (t=0; t<ntaps; t++) {
+            k = j + job->yt.first + t;
+            r = _map_index(k, rows, job->mode);
+            slot = (int) (((k % ntaps) + ntaps) % ntaps);
+            if (tags[slot] != r) {
+                _shift_row(job, r, cmap, src, ring + slot*cols);
+                tags[slot] = r;
+            }
+        }
+        for (i=0; i<cols; i++) {
+            npy_float64 sum = 0;
+            for (t=0; t<ntaps; t++) {
+                k = j + job->yt.first + t;
+                slot = (int) (((k % ntaps) + ntaps) % ntaps);
+                sum += job->yt.weights[t] * ring[slot*cols + i];
+            }
+            out[i] = sum;
+        }
+        job->otype->store(o->data + j*o->strides[0], o->strides[1], cols,
+                          out);
+    }
+}
+
+
+/*
+ * The input is used in place when it has a supported type, is aligned and
+ * in native byte order; otherwise it is converted to npy_float64.
+ */
+static PyArrayObject *
+_as_input(PyObject *input, tmapping **type)
+{
+    *type = PyArray_Check(input) ?
+        _find_type(PyArray_TYPE((PyArrayObject *) input)) : NULL;
+    if (!*type) {
+        *type = _find_type(NPY_FLOAT64);
+    }
+    return (PyArrayObject *) PyArray_FROM_OTF(
+        input, (*type)->type_num, NPY_ARRAY_ALIGNED | NPY_ARRAY_NOTSWAPPED);
+}
+
+
+/*
+ * The output is written in place when it has a supported type; any other
+ * output goes through a npy_float64 copy that is written back at the end.
+ */
+static PyArrayObject *
+_as_output(PyObject *output, tmapping **type)
+{
+    *type = PyArray_Check(output) ?
+        _find_type(PyArray_TYPE((PyArrayObject *) output)) : NULL;
+    if (*type) {
+        return (PyArrayObject *) PyArray_FROM_OTF(
+            output, (*type)->type_num,
+            NPY_ARRAY_ALIGNED | NPY_ARRAY_NOTSWAPPED | NPY_ARRAY_WRITEABLE |
+            NPY_ARRAY_WRITEBACKIFCOPY);
+    }
+    *type = _find_type(NPY_FLOAT64);
+    return (PyArrayObject *) PyArray_FROM_OTF(output, NPY_FLOAT64,
+                                              NPY_ARRAY_INOUT_ARRAY2);
+}
+
+
+static PyObject *
+_Py_translate(PyObject *obj, PyObject *args, PyObject *kw)
+{
+    PyObject   *input, *output, *result = NULL;
+    double     dx, dy, cval = 0.0;
+    char       *mode = "nearest", *kernel = "bilinear";
+    char       *keywds[] = { "input", "dx", "dy", "output", "mode", "cval",
+                             "kernel", NULL };
+    PyArrayObject *ainput = NULL, *aoutput = NULL;
+    shift_job  job;
+    ikernel    k;
+    char       *scratch = NULL;
+
+    if (!PyArg_ParseTupleAndKeywords(args, kw, "OddO|sds:translate", keywds,
+             &input, &dx, &dy, &output, &mode, &cval, &kernel)) {
+        return NULL;
+    }
+    memset(&job, 0, sizeof(job));
+    if (_parse_mode(mode, &job.mode) < 0) {
+        return PyErr_Format(PyExc_ValueError,
+                            "translate: unknown mode '%s'.", mode);
+    }
+    if (_parse_kernel(kernel, &k) < 0) {
+        return PyErr_Format(PyExc_ValueError,
+                            "translate: unknown kernel '%s'.", kernel);
+    }
+    if (!Py_IS_FINITE(dx) || !Py_IS_FINITE(dy)) {
+        return PyErr_Format(PyExc_ValueError,
+                            "translate: shifts must be finite.");
+    }
+    job.cval = cval;
+    _kernel_taps(k, dx, &job.xt);
+    _kernel_taps(k, dy, &job.yt);
+
+    ainput = _as_input(input, &job.itype);
+    if (!ainput) {
+        goto exit;
+    }
+    aoutput = _as_output(output, &job.otype);
+    if (!aoutput) {
+        goto exit;
+    }
+    if (PyArray_NDIM(ainput) != 2 || PyArray_NDIM(aoutput) != 2) {
+        PyErr_Format(PyExc_ValueError,
+                     "translate: input and output must be 2-D arrays.");
+        goto exit;
+    }
+    if (PyArray_SIZE(ainput) == 0 && PyArray_SIZE(aoutput) > 0) {
+        PyErr_Format(PyExc_ValueError,
+                     "translate: cannot sample an empty input.");
+        goto exit;
+    }
+    _plane(ainput, 0, &job.input);
+    _plane(aoutput, 0, &job.output);
+    if (PyArray_SIZE(aoutput) > 0) {
+        scratch = (char *) malloc(SHIFT_SCRATCH(job.input.dims[1],
+                                                job.output.dims[1]));
+        if (!scratch) {
+            PyErr_NoMemory();
+            goto exit;
+        }
+        Py_BEGIN_ALLOW_THREADS
+        _shift(&job, scratch);
+        Py_END_ALLOW_THREADS
+    }
+
+    Py_INCREF(Py_None);
+    result = Py_None;
+
+  exit:
+    free(scratch);
+    Py_XDECREF(ainput);
+    if (aoutput) {
+        if (result) {
+            PyArray_ResolveWritebackIfCopy(aoutput);
+        } else {
+            PyArray_DiscardWritebackIfCopy(aoutput);
+        }
+        Py_DECREF(aoutput);
+    }
+    return result;
+}
+
+
+/*
+ * Stacks of frames are split into runs of consecutive frames, one per
+ * thread, each shifting its frames by their own offsets with its own
+ * scratch.
+ */
+typedef struct
+{
+    shift_job shift;                 /* frame 0; taps are set per frame */
+    npy_intp istride, ostride;       /* from one frame to the next */
+    const shift_taps *taps;          /* x and y taps of every frame */
+    npy_intp start, stop;
+    char *scratch;
+} stack_job;
+
+
+static void
+_shift_frames(void *arg)
+{
+    stack_job *job = (stack_job *) arg;
+    shift_job frame = job->shift;
+    npy_intp f;
+
+    for (f=job->start; f<job->stop; f++) {
+        frame.input.data = job->shift.input.data + f*job->istride;
+        frame.output.data = job->shift.output.data + f*job->ostride;
+        frame.xt = job->taps[2*f];
+        frame.yt = job->taps[2*f+1];
+        _shift(&frame, job->scratch);
+    }
+}
+
+
+/* Don't bother starting a thread for less than this many pixels. */
+#define MIN_PIXELS_PER_THREAD 65536
+
+
+/* The per-frame offsets: npy_float64, finite, one for each of 'n' frames. */
+static PyArrayObject *
+_offsets(PyObject *a, npy_intp n, const char *name)
+{
+    PyArrayObject *r = (PyArrayObject *) PyArray_FROM_OTF(
+        a, NPY_FLOAT64, NPY_ARRAY_IN_ARRAY);
+    npy_intp i;
+
+    if (!r) {
+        return NULL;
+    }
+    if (PyArray_NDIM(r) != 1 || PyArray_DIM(r, 0) != n) {
+        PyErr_Format(PyExc_ValueError,
+                     "translate_stack: %s must have one offset per frame.",
+                     name);
+        Py_DECREF(r);
+        return NULL;
+    }
+    for (i=0; i<n; i++) {
+        if (!Py_IS_FINITE(((npy_float64 *) PyArray_DATA(r))[i])) {
+            PyErr_Format(PyExc_ValueError,
+                         "translate_stack: shifts must be finite.");
+            Py_DECREF(r);
+            return NULL;
+        }
+    }
+    return r;
+}
+
+
+static PyObject *
+_Py_translate_stack(PyObject *obj, PyObject *args, PyObject *kw)
+{
+    PyObject   *input, *output, *pdxs, *pdys, *result = NULL;
+    double     cval = 0.0;
+    char       *mode = "nearest", *kernel = "bilinear";
+    char       *keywds[] = { "input", "dxs", "dys", "output", "mode", "cval",
+                             "nthreads", "kernel", NULL };
+    PyArrayObject *ainput = NULL, *aoutput = NULL, *dxs = NULL, *dys = NULL;
+    stack_job  *jobs = NULL, job;
+    shift_taps *taps = NULL;
+    ikernel    k;
+    char       *scratch = NULL;
+    size_t     size;
+    npy_intp   i, nframes, pixels;
+    int        nthreads = 1;
+
+    if (!PyArg_ParseTupleAndKeywords(args, kw, "OOOO|sdis:translate_stack",
+             keywds, &input, &pdxs, &pdys, &output, &mode, &cval,
+             &nthreads, &kernel)) {
+        return NULL;
+    }
+    memset(&job, 0, sizeof(job));
+    if (_parse_mode(mode, &job.shift.mode) < 0) {
+        return PyErr_Format(PyExc_ValueError,
+                            "translate_stack: unknown mode '%s'.", mode);
+    }
+    if (_parse_kernel(kernel, &k) < 0) {
+        return PyErr_Format(PyExc_ValueError,
+                            "translate_stack: unknown kernel '%s'.", kernel);
+    }
+    job.shift.cval = cval;
+
+    ainput = _as_input(input, &job.shift.itype);
+    if (!ainput) {
+        goto exit;
+    }
+    aoutput = _as_output(output, &job.shift.otype);
+    if (!aoutput) {
+        goto exit;
+    }
+    if (PyArray_NDIM(ainput) != 3 ||
+            !PyArray_SAMESHAPE(ainput, aoutput)) {
+        PyErr_Format(PyExc_ValueError,
+                     "translate_stack: input and output must be "
+                     "identically shaped 3-D arrays.");
+        goto exit;
+    }
+    nframes = PyArray_DIM(ainput, 0);
+    dxs = _offsets(pdxs, nframes, "dxs");
+    dys = dxs ? _offsets(pdys, nframes, "dys") : NULL;
+    if (!dys) {
+        goto exit;
+    }
+    pixels = PyArray_SIZE(ainput);
+    if (pixels == 0) {
+        goto done;
+    }
+
+    _plane(ainput, 1, &job.shift.input);
+    _plane(aoutput, 1, &job.shift.output);
+    job.istride = PyArray_STRIDE(ainput, 0);
+    job.ostride = PyArray_STRIDE(aoutput, 0);
+    taps = (shift_taps *) malloc(2*nframes * sizeof(shift_taps));
+    if (!taps) {
+        PyErr_NoMemory();
+        goto exit;
+    }
+    for (i=0; i<nframes; i++) {
+        _kernel_taps(k, ((npy_float64 *) PyArray_DATA(dxs))[i], &taps[2*i]);
+        _kernel_taps(k, ((npy_float64 *) PyArray_DATA(dys))[i],
+                     &taps[2*i+1]);
+    }
+    job.taps = taps;
+
+    if (nthreads > nframes) nthreads = (int) nframes;
+    if (nthreads > pixels / MIN_PIXELS_PER_THREAD) {
+        nthreads = (int) (pixels / MIN_PIXELS_PER_THREAD);
+    }
+    if (nthreads < 1) nthreads = 1;
+    size = SHIFT_SCRATCH(job.shift.input.dims[1], job.shift.output.dims[1]);
+    jobs = (stack_job *) malloc(nthreads * sizeof(stack_job));
+    scratch = (char *) malloc(nthreads * size);
+    if (!jobs || !scratch) {
+        PyErr_NoMemory();
+        goto exit;
+    }
+    for (i=0; i<nthreads; i++) {
+        jobs[i] = job;
+        jobs[i].start = nframes * i / nthreads;
+        jobs[i].stop = nframes * (i+1) / nthreads;
+        jobs[i].scratch = scratch + i*size;
+    }
+    Py_BEGIN_ALLOW_THREADS
+    _run_parallel(_shift_frames, jobs, sizeof(stack_job), nthreads);
+    Py_END_ALLOW_THREADS
+
+  done:
+    Py_INCREF(Py_None);
+    result = Py_None;
+
+  exit:
+    free(jobs);
+    free(scratch);
+    free(taps);
+    Py_XDECREF(ainput);
+    Py_XDECREF(dxs);
+    Py_XDECREF(dys);
+    if (aoutput) {
+        if (result) {
+            PyArray_ResolveWritebackIfCopy(aoutput);
+        } else {
+            PyArray_DiscardWritebackIfCopy(aoutput);
+        }
+        Py_DECREF(aoutput);
+    }
+    return result;
+}
+
+static PyMethodDef _translateMethods[] = {
+    {"translate", (PyCFunction) _Py_translate, METH_VARARGS | METH_KEYWORDS},
+    {"translate_stack", (PyCFunction) _Py_translate_stack,
+     METH_VARARGS | METH_KEYWORDS},
+    {NULL, NULL} /* Sentinel */
+};
+
+#if PY_MAJOR_VERSION >= 3
+static struct PyModuleDef moduledef = {
+  PyModuleDef_HEAD_INIT,
+  "_translate",        /* m_name */
+  "Translate module",  /* m_doc */
+  -1,                  /* m_size */
+  _translateMethods,   /* m_methods */
+  NULL,                /* m_reload */
+  NULL,                /* m_traverse */
+  NULL,                /* m_clear */
+  NULL,                /* m_free */
+};
+#endif
+
+PyMODINIT_FUNC
+#if PY_MAJOR_VERSION >= 3
+PyInit__translate(void)
+#else
+init_translate(void)
+#endif
+{
+    PyObject *m;
+#if PY_MAJOR_VERSION >= 3
+    m = PyModule_Create(&moduledef);
+#else
+    m = Py_InitModule("_translate", _translateMethods);
+#endif
+    import_array();
+#if PY_MAJOR_VERSION >= 3
+	return m;
+#else
+	return;
+#endif
+}
@@ -7,3 +7,7 @@ except DistributionNotFound:
 
 from ._image import *
 from .combine import *
+from .tiled import *
+from .accumulate import *
+from .files import *
+from .chunked import *
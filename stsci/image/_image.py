@@ -1,46 +1,72 @@
 from __future__ import division
 
 import numpy as np
-from scipy.signal import correlate2d
-from scipy import ndimage
+from ._translate import translate as _translate_kernel
+from ._translate import translate_stack as _translate_stack_kernel
+from .combine import _default_nthreads
 
 
 def _translate(a, dx, dy, output=None, mode="full", cval=0.0):
     """_translate does positive sub-pixel shifts using bilinear
     interpolation.
+
+    The result is that of correlating 'a' with the 2x2 bilinear kernel of
+    (dx, dy), pixels beyond the edges being 'cval', and 'mode' selects its
+    extent as for `scipy.signal.correlate2d`: 'full' is one row and column
+    larger than 'a', 'same' has its shape and 'valid' is one row and column
+    smaller.  It is written to 'output' in place when one is given.
     """
 
     assert 0 <= dx < 1.0
     assert 0 <= dy < 1.0
 
-    w = (1-dy) * (1-dx)
-    x = (1-dy) * dx
-    y = (1-dx) * dy
-    z = dx * dy
-
-    kernel = np.array([
-        [ z, y ],
-        [ x, w ],
-        ])
-
-    if output is not None:
-        raise NotImplementedError(
-            'scipy.signal.correlate2d does not accept output keyword')
-
-    return correlate2d(a, kernel, mode=mode, fillvalue=cval)
-
-
-def translate(a, sdx, sdy, output=None, mode="nearest", cval=0.0):
+    a = np.asarray(a)
+    grow = {'full': 1, 'same': 0, 'valid': -1}.get(mode)
+    if grow is None:
+        raise ValueError("mode must be 'full', 'same' or 'valid'")
+    shape = tuple(max(n + grow, 0) for n in a.shape)
+    if mode != 'full':
+        # the 'same' and 'valid' results start one pixel into the 'full' one
+        dx, dy = dx - 1, dy - 1
+    return _shift(a, dx, dy, output, shape, 'constant', cval, 'bilinear')
+
+
+def _shift(a, dx, dy, output, shape, mode, cval, kernel):
+    """Sample 'a' at (y - dy, x - dx) into 'output', or into a new array of
+    the type of 'a' when none is given."""
+    if output is None:
+        out = np.empty(shape, dtype=a.dtype)
+    else:
+        out = output
+        if out.shape != shape:
+            raise ValueError("output must have shape %r" % (shape,))
+        if np.may_share_memory(a, out):
+            # rows of 'a' are read while earlier output rows are written
+            a = a.copy()
+    _translate_kernel(a, dx, dy, out, mode, cval, kernel)
+    if output is None:
+        return out
+
+
+def translate(a, sdx, sdy, output=None, mode="nearest", cval=0.0,
+              kernel="bilinear"):
     """translate performs a translation of 'a' by (sdx, sdy)
     storing the result in 'output'.
 
+    The image is interpolated in a single pass, so that output[y, x] is
+    'a' at (y - sdy, x - sdx): positive shifts move the image towards
+    higher indices, as with IRAF's imshift.
+
     Parameters
     ----------
     sdx, sdy : float
         Value to translate image in x and y, respectively
 
     output : ndarray
-        Output array
+        Output array, with the shape of 'a'.  It is written in place, with
+        no intermediate copies, so one set of buffers can be reused for
+        any number of frames.  If none is specified, a new array of the
+        type of 'a' is returned.
 
     mode : {'nearest','wrap','reflect','constant'}
         Supported 'mode's include::
@@ -53,30 +79,87 @@ def translate(a, sdx, sdy, output=None, mode="nearest", cval=0.0):
 
     cval : float
         Value to use if mode set to 'constant'.
+
+    kernel : {'bilinear','bicubic','lanczos3','lanczos5'}
+        The separable interpolation kernel::
+
+            'bilinear'  linear interpolation over 2x2 pixels.
+            'bicubic'   Keys' cubic convolution (a = -0.5) over 4x4 pixels.
+            'lanczos3'  a 3-lobed Lanczos windowed sinc over 6x6 pixels.
+            'lanczos5'  a 5-lobed Lanczos windowed sinc over 10x10 pixels.
+
+        Whole-pixel shifts copy pixels exactly with any kernel.  The
+        weights of each fractional shift are computed once and cached.
+        Integer outputs are rounded to the nearest value, and the
+        overshoot of the bicubic and Lanczos kernels at sharp edges is
+        clipped to the range of their type.
+
+    >>> a = np.arange(12.).reshape((3, 4))
+    >>> translate(a, 1, 0)
+    array([[ 0.,  0.,  1.,  2.],
+           [ 4.,  4.,  5.,  6.],
+           [ 8.,  8.,  9., 10.]])
+    >>> translate(a, -0.5, 0.5, mode='constant')
+    array([[0.25, 0.75, 1.25, 0.75],
+           [2.5 , 3.5 , 4.5 , 2.5 ],
+           [6.5 , 7.5 , 8.5 , 4.5 ]])
     """
 
     a = np.asarray(a)
+    return _shift(a, sdx, sdy, output, a.shape, mode, cval, kernel)
+
+
+def translate_stack(cube, dxs, dys, out=None, nthreads=None, mode="nearest",
+                    cval=0.0, kernel="bilinear"):
+    """translate_stack translates every frame of the (N, Y, X) array 'cube'
+    by its own (dxs[i], dys[i]), as translate() would, in a single call.
+
+    Parameters
+    ----------
+    cube : ndarray
+        The frames to shift, stacked along the first axis.
+
+    dxs, dys : sequence of float
+        Value to translate each frame in x and y, respectively
+
+    out : ndarray
+        Output cube, with the shape of 'cube'.  It is written in place and
+        can be passed on to median(), average() and the other combiners as
+        it is.  If none is specified, a new array of the type of 'cube' is
+        returned.
+
+    nthreads : int
+        The number of threads the frames are split among.  Defaults to the
+        number of cores available to the process and does not affect the
+        result.
+
+    mode, cval, kernel
+        As for translate().
+
+    >>> cube = np.zeros((2, 3, 3))
+    >>> cube[:, 1, 1] = 1
+    >>> translate_stack(cube, [1, 0], [0, -0.5])
+    array([[[0. , 0. , 0. ],
+            [0. , 0. , 1. ],
+            [0. , 0. , 0. ]],
+    <BLANKLINE>
+           [[0. , 0.5, 0. ],
+            [0. , 0.5, 0. ],
+            [0. , 0. , 0. ]]])
+    """
 
-    sdx, sdy = -sdx, -sdy     # Flip sign to match IRAF sign convention
-
-    # _translate works "backwords" due to implementation of 2x2 correlation.
-    if sdx >= 0 and sdy >= 0:
-        rotation = 2
-        dx, dy = abs(sdx), abs(sdy)
-    elif sdy < 0 and sdx >= 0:
-        rotation = 1
-        dx, dy = abs(sdy), abs(sdx)
-    elif sdx < 0 and sdy >= 0:
-        rotation = 3
-        dx, dy = abs(sdy), abs(sdx)
-    elif sdx < 0 and sdy < 0:
-        rotation = 0
-        dx, dy = abs(sdx), abs(sdy)
-
-    b = np.rot90(a, rotation)
-    c = ndimage.shift(b, (int(dx), int(dy)), mode=mode)
-    d = _translate(c, dx % 1, dy % 1, output, 'full', cval)
-    if output is not None:
-        output._copyFrom(np.rot90(output, -rotation%4))
+    cube = np.asarray(cube)
+    if out is None:
+        output = np.empty_like(cube)
     else:
-        return np.rot90(d, -rotation % 4).astype(a.type())
+        output = out
+        if output.shape != cube.shape:
+            raise ValueError("out must have shape %r" % (cube.shape,))
+        if np.may_share_memory(cube, output):
+            cube = cube.copy()
+    if nthreads is None:
+        nthreads = _default_nthreads()
+    _translate_stack_kernel(cube, dxs, dys, output, mode, cval, nthreads,
+                            kernel)
+    if out is None:
+        return output
@@ -0,0 +1,324 @@
+"""Combine frames that arrive one at a time.
+
+A `StackAccumulator` is fed frames with ``add()`` as they become available
+and asked for a combined image with ``result()`` at any point.  The sum,
+mean, minimum, maximum and count are kept as running per-pixel reductions
+and are exact.  The median and the clipping combiners need the values
+themselves; frames are buffered ``capacity`` at a time, and every full
+buffer is reduced with the combine kernels to a single frame that moves up
+to the next level (the "remedian" of Rousseeuw & Bassett, 1990).  Memory
+thus grows with the logarithm of the number of frames, not with the number
+itself, and the robust result is exact for as long as no buffer was ever
+reduced.  Once it was, the result is a weighted combination of the frames
+left in the levels, each standing for the number of frames it was reduced
+from, so it also costs the logarithm of the number of frames.
+
+Full first-level buffers are reduced on a worker thread, where the
+kernels run without the GIL, while ``add()`` keeps filling a second
+buffer.
+"""
+from __future__ import (absolute_import, division, unicode_literals,
+                        print_function)
+
+import threading
+
+import numpy as np
+
+from .combine import _default_nthreads, combine_stats
+
+__all__ = ['StackAccumulator']
+
+
+# the exact running reductions
+_EXACT = ('sum', 'mean', 'average', 'minimum', 'maximum', 'count')
+
+# the buffered combiners, as the combine_stats() statistic and clipping
+_ROBUST = {
+    'median': ('median', None),
+    'sigclip_median': ('median', 'sigma'),
+    'sigclip_average': ('mean', 'sigma'),
+    'madclip_median': ('median', 'mad'),
+    'madclip_average': ('mean', 'mad'),
+}
+
+
+# the scale of the median absolute deviation of a normal distribution, as
+# used by the kernels
+_MAD_TO_SIGMA = 1.482602218505602
+
+
+def _along_stacks(a, index):
+    """The elements of the pixel stacks of 'a' (along its first axis) at
+    'index', which has the shape of a frame or of a stack of them."""
+    pixels = np.ix_(*[np.arange(n) for n in a.shape[1:]])
+    return a[(index,) + pixels]
+
+
+def _weighted_median(values, weights):
+    """The median of every pixel stack of the sorted 'values', each counted
+    'weights' times, as the kernels would find it among the repeated
+    values."""
+    counts = np.cumsum(weights, axis=0)
+    total = counts[-1]
+    lo = np.argmax(counts > (total - 1) // 2, axis=0)
+    hi = np.argmax(counts > total // 2, axis=0)
+    return (_along_stacks(values, hi) + _along_stacks(values, lo)) / 2.0
+
+
+def _weighted_mean(values, weights, total):
+    return (np.where(weights > 0, values, 0) * weights).sum(axis=0) / total
+
+
+def _weighted_combine(values, weights, stat, clip, lsigma, hsigma, maxiter):
+    """Combine the pixel stacks of 'values', each value standing for
+    'weights' values (none if 0), as the kernels would combine the repeated
+    values, but without repeating them."""
+    order = np.argsort(values, axis=0)
+    values = _along_stacks(values, order)
+    weights = _along_stacks(weights, order)
+    total = weights.sum(axis=0)
+    safe = np.maximum(total, 1)
+    for _ in range(maxiter if clip else 0):
+        center = _weighted_median(values, weights)
+        if clip == 'mad':
+            deviations = np.where(weights > 0, np.abs(values - center),
+                                  np.inf)
+            order = np.argsort(deviations, axis=0)
+            spread = _MAD_TO_SIGMA * _weighted_median(
+                _along_stacks(deviations, order),
+                _along_stacks(weights, order))
+        else:
+            mean = _weighted_mean(values, weights, safe)
+            spread = np.sqrt(_weighted_mean((values - mean) ** 2, weights,
+                                            safe))
+        keep = ((values >= center - lsigma * spread) &
+                (values <= center + hsigma * spread))
+        kept = np.where(keep, weights, 0)
+        left = kept.sum(axis=0)
+        # a pass that would reject everything is not applied
+        changed = (total >= 2) & (left > 0) & (left != total)
+        if not changed.any():
+            break
+        weights = np.where(changed, kept, weights)
+        total = np.where(changed, left, total)
+        safe = np.maximum(total, 1)
+    if stat == 'median':
+        result = _weighted_median(values, weights)
+    else:
+        result = _weighted_mean(values, weights, safe)
+    return np.where(total > 0, result, 0.0)
+
+
+class _Level(object):
+    """A buffer of 'capacity' frames and their masks."""
+
+    def __init__(self, capacity, shape, dtype):
+        self.data = np.empty((capacity,) + shape, dtype=dtype)
+        self.masks = np.empty((capacity,) + shape, dtype=bool)
+        self.n = 0
+
+
+class StackAccumulator(object):
+    """Combine identically shaped frames that are added one at a time.
+
+    Parameters
+    ----------
+    capacity : int
+        The number of frames buffered at each level for the robust
+        combiners, the first level twice over while a full buffer is
+        reduced.  The robust result is exact up to this many frames.
+
+    robust : {'median', 'sigclip_median', 'sigclip_average', ...}
+        The combiner used to reduce full buffers, and so the only robust
+        combiner available from ``result()`` once more than 'capacity'
+        frames were added.  Pass None to keep only the exact reductions,
+        without buffering any frames.
+
+    nthreads : int, optional
+        The number of threads the reductions are split among.  Defaults to
+        the number of cores available to the process.
+
+    lsigma, hsigma, maxiter : float, float, int
+        The rejection parameters of the clipping combiners.
+
+    Examples
+    --------
+    >>> acc = StackAccumulator(capacity=3)
+    >>> for v in (5., 1., 4., 2., 3.):
+    ...     acc.add(np.full((2, 2), v))
+    >>> acc.result('mean')
+    array([[3., 3.],
+           [3., 3.]])
+    >>> acc.result('maximum')
+    array([[5., 5.],
+           [5., 5.]])
+    """
+
+    def __init__(self, capacity=32, robust='median', nthreads=None,
+                 lsigma=3.0, hsigma=3.0, maxiter=5):
+        if capacity < 2:
+            raise ValueError("capacity must be at least 2")
+        if robust is not None and robust not in _ROBUST:
+            raise ValueError("unknown robust combiner: %r" % (robust,))
+        self.capacity = capacity
+        self.robust = robust
+        self.nthreads = nthreads
+        self.kernel_args = dict(lsigma=lsigma, hsigma=hsigma,
+                                maxiter=maxiter)
+        self.nframes = 0
+        self.shape = None
+        self._levels = []
+        # the first-level buffer being reduced on the worker thread, which
+        # becomes the next one to fill
+        self._spare = None
+        self._worker = None
+        self._error = None
+
+    def _start(self, frame):
+        self.shape = frame.shape
+        self._sum = np.zeros(self.shape, dtype=np.float64)
+        self._count = np.zeros(self.shape, dtype=np.int32)
+        self._min = np.full(self.shape, np.inf)
+        self._max = np.full(self.shape, -np.inf)
+        self._dtype = frame.dtype
+
+    def add(self, frame, mask=None):
+        """Add a frame, ignoring the pixels where 'mask' is true."""
+        frame = np.asarray(frame)
+        if self.shape is None:
+            self._start(frame)
+        if frame.shape != self.shape or (
+                mask is not None and np.shape(mask) != self.shape):
+            raise ValueError("all arrays must have identical shapes")
+        good = True if mask is None else ~np.asarray(mask, dtype=bool)
+        np.add(self._sum, frame, out=self._sum, where=good)
+        np.add(self._count, 1, out=self._count, where=good)
+        np.fmin(self._min, frame, out=self._min, where=good)
+        np.fmax(self._max, frame, out=self._max, where=good)
+        if self.robust is not None:
+            self._push(0, frame, mask)
+        self.nframes += 1
+
+    def _push(self, k, frame, mask):
+        if k == len(self._levels):
+            self._levels.append(self._level(k))
+        level = self._levels[k]
+        if level.n == self.capacity:
+            # reduced only when full and needed, so that up to 'capacity'
+            # frames stay exact
+            if k == 0:
+                level = self._levels[0] = self._hand_off(level)
+            else:
+                self._push(k + 1, *self._reduce_level(level))
+        level.data[level.n] = frame
+        level.masks[level.n] = False if mask is None else mask
+        level.n += 1
+
+    def _level(self, k):
+        dtype = self._dtype if k == 0 else np.float64
+        return _Level(self.capacity, self.shape, dtype)
+
+    def _hand_off(self, full):
+        """Start reducing the full first level on a worker thread, and
+        return an empty one for the frames that keep arriving."""
+        self._wait()
+        empty = self._spare if self._spare is not None else self._level(0)
+        self._spare = full
+
+        def reduce():
+            try:
+                self._push(1, *self._reduce_level(full))
+            except BaseException as e:
+                self._error = e
+
+        self._worker = threading.Thread(target=reduce)
+        self._worker.daemon = True
+        self._worker.start()
+        return empty
+
+    def _wait(self):
+        """Wait for the reduction on the worker thread, if any."""
+        if self._worker is not None:
+            self._worker.join()
+            self._worker = None
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def _reduce_level(self, level):
+        """Reduce a full level to one frame and the mask of its pixels
+        without good values."""
+        stat, clip = _ROBUST[self.robust]
+        r = self._reduce(level.data, level.masks, stat, clip)
+        level.n = 0
+        return r[stat], r['count'] == 0
+
+    def _reduce(self, arrays, masks, stat, clip):
+        nthreads = self.nthreads
+        if nthreads is None:
+            nthreads = _default_nthreads()
+        return combine_stats(arrays, (stat, 'count'), badmasks=masks,
+                             clip=clip, nthreads=nthreads,
+                             **self.kernel_args)
+
+    def result(self, kind='mean', output=None):
+        """The combination of the frames added so far.
+
+        Parameters
+        ----------
+        kind : {'sum', 'mean', 'minimum', 'maximum', 'count', 'median', ...}
+            'sum', 'mean' (or 'average'), 'minimum', 'maximum' and
+            'count' are exact.  The median and the clipping combiners are
+            exact until more than 'capacity' frames were added; after
+            that only the 'robust' combiner is available, estimated from
+            the buffered and reduced frames, each weighted by the number
+            of frames it stands for.  Pixels with no good values are 0.
+
+        output : ndarray, optional
+            Where to store the result.
+        """
+        if self.shape is None:
+            raise ValueError("no frames were added")
+        if kind in _EXACT:
+            result = self._exact(kind)
+        elif kind in _ROBUST:
+            result = self._robust(kind)
+        else:
+            raise ValueError("unknown combiner: %r" % (kind,))
+        if output is None:
+            return result
+        output[...] = result
+
+    def _exact(self, kind):
+        good = self._count > 0
+        if kind == 'count':
+            return self._count.copy()
+        elif kind == 'sum':
+            return self._sum.copy()
+        elif kind in ('mean', 'average'):
+            return np.divide(self._sum, self._count, out=np.zeros(self.shape),
+                             where=good)
+        extreme = self._min if kind == 'minimum' else self._max
+        return np.where(good, extreme, 0.0)
+
+    def _robust(self, kind):
+        if self.robust is None:
+            raise ValueError("no frames are buffered for %r" % (kind,))
+        self._wait()
+        stat, clip = _ROBUST[kind]
+        if len(self._levels) == 1:
+            level = self._levels[0]
+            return self._reduce(level.data[:level.n], level.masks[:level.n],
+                                stat, clip)[stat]
+        if kind != self.robust:
+            raise ValueError("%r is not available once more than %d frames "
+                             "were added; it is kept for %r only" %
+                             (kind, self.capacity, self.robust))
+        # every frame of level k stands for capacity**k frames
+        values = np.concatenate([level.data[:level.n]
+                                 for level in self._levels])
+        weights = np.concatenate([
+            np.where(level.masks[:level.n], 0, self.capacity ** k)
+            for k, level in enumerate(self._levels)])
+        return _weighted_combine(values, weights, stat, clip,
+                                 **self.kernel_args)
@@ -0,0 +1,139 @@
+"""Combine stacks of images held in chunked arrays, lazily.
+
+The stack is a `dask.array.Array` (or anything `dask.array.asarray` accepts,
+such as a zarr or HDF5 dataset) with the frames along its first axis.  The
+chunks along that axis are merged, so that every chunk holds whole pixel
+stacks, and the combine kernel is mapped over the spatial chunks.  The
+result is a dask array of the combined image, computed only when asked for,
+on whichever scheduler is in use: each chunk is an independent task that a
+threaded, multi-process or distributed scheduler can run anywhere.
+
+Using this module needs `dask`.
+"""
+from __future__ import (absolute_import, division, unicode_literals,
+                        print_function)
+
+import numpy as np
+
+from ._combine import combine as _combine
+from .combine import _frame_terms
+
+__all__ = ['chunked_combine']
+
+
+def _dask_array():
+    try:
+        import dask.array as da
+    except ImportError:
+        raise ImportError("dask is required to combine chunked arrays")
+    return da
+
+
+def _as_stack(da, arrays):
+    """'arrays' as a dask array of frames along its first axis."""
+    if hasattr(arrays, 'ndim') and hasattr(arrays, 'shape'):
+        return da.asarray(arrays)
+    return da.stack([da.asarray(a) for a in arrays])
+
+
+def _combine_chunk(data, *others, **options):
+    """Combine the pixel stacks of one chunk with the kernel."""
+    others = list(others)
+    masks = others.pop(0) if options['masks'] else None
+    kernel_args = dict(options['kernel_args'])
+    if options['weights']:
+        kernel_args['weights'] = others.pop(0)
+    out = np.empty(data.shape[1:], dtype=options['out_dtype'])
+    _combine(data, out, options['nlow'], options['nhigh'], masks,
+             options['kind'], options['nthreads'], **kernel_args)
+    return out
+
+
+def chunked_combine(arrays, kind="median", outtype=None, nlow=0, nhigh=0,
+                    badmasks=None, nthreads=1, **kernel_args):
+    """Lazily combine a chunked stack of identically shaped images.
+
+    Parameters
+    ----------
+    arrays : dask.array.Array or sequence of array-like
+        The stack of frames along its first axis, or a sequence of frames.
+        Anything other than a dask array is wrapped with
+        `dask.array.asarray`, keeping its own chunks if it has any.
+
+    kind : {'median', 'imedian', 'average', 'iaverage', 'minimum', ...}
+        The combine kernel to use, as in `stsci.image.tiled_combine`.
+
+    outtype : dtype, optional
+        The type of the combined image.  Defaults to the type of the stack.
+
+    nlow, nhigh : int
+        The number of pixels to be excluded on the low and high ends of
+        each pixel stack.
+
+    badmasks : dask.array.Array or sequence of array-like, optional
+        The masks of the frames, stacked the same way, where true (or one
+        of the 'bad_bits') indicates that a pixel is not to be included.
+        They are rechunked to match the stack.
+
+    nthreads : int
+        The number of threads each chunk is split among.  The scheduler
+        already runs the chunks in parallel, so one is usually best.
+
+    **kernel_args
+        Further arguments of the kernel, such as 'bad_bits' and
+        'packed_masks', the 'lsigma', 'hsigma' and 'maxiter' of the
+        clipping kernels, or the 'weights', 'scales' and 'zeros' of the
+        averages.  Weights given per pixel are stacked and rechunked like
+        the masks.
+
+    Returns
+    -------
+    output : dask.array.Array
+        The combined image, chunked like the frames of the stack.
+    """
+    da = _dask_array()
+    stack = _as_stack(da, arrays)
+    if stack.ndim < 2:
+        raise ValueError("arrays must be a stack of frames of at least one "
+                         "dimension")
+    kernel_args.update(_frame_terms(kernel_args.pop('weights', None),
+                                    kernel_args.pop('scales', None),
+                                    kernel_args.pop('zeros', None)))
+    weights = kernel_args.pop('weights', None)
+    packed = kernel_args.get('packed_masks', False)
+    if packed and badmasks is not None:
+        if stack.ndim < 3:
+            raise ValueError("packed masks need frames of at least two "
+                             "dimensions")
+        # the packed bits of a row cannot be split between chunks
+        stack = stack.rechunk({0: -1, stack.ndim - 1: -1})
+    else:
+        stack = stack.rechunk({0: -1})
+
+    inputs = [stack]
+    if badmasks is not None:
+        masks = _as_stack(da, badmasks)
+        mask_shape = stack.shape
+        chunks = stack.chunks
+        if packed:
+            mask_shape = stack.shape[:-1] + ((stack.shape[-1] + 7) // 8,)
+            chunks = chunks[:-1] + ((mask_shape[-1],),)
+        if masks.shape != mask_shape:
+            raise ValueError("badmasks must match the shape of arrays")
+        inputs.append(masks.rechunk(chunks))
+    if weights is not None:
+        weights = _as_stack(da, weights)
+        if weights.shape != stack.shape:
+            raise ValueError("weights must match the shape of arrays")
+        inputs.append(weights.rechunk(stack.chunks))
+
+    dtype = np.dtype(outtype or stack.dtype)
+    # blocks are matched by position, so the narrower chunks of packed
+    # masks line up with those of the stack
+    return da.map_blocks(
+        _combine_chunk, *inputs, drop_axis=0, chunks=stack.chunks[1:],
+        dtype=dtype, meta=np.empty((0,) * (stack.ndim - 1), dtype=dtype),
+        token='combine-%s' % kind,
+        masks=badmasks is not None, weights=weights is not None,
+        kernel_args=kernel_args, out_dtype=dtype, kind=kind, nlow=nlow,
+        nhigh=nhigh, nthreads=nthreads)
@@ -1,29 +1,75 @@
 from __future__ import (absolute_import, division, unicode_literals,
                         print_function)
 
+import os as _os
+
 import numpy as np
 from ._combine import combine as _combine
+from ._combine import combine_stats as _combine_stats
+from ._combine import threshhold as _threshhold
 
 
-def _combine_f(funcstr, arrays, output=None, outtype=None, nlow=0, nhigh=0,
-               badmasks=None):
+def _default_nthreads():
+    """The number of cores this process may run on."""
+    try:
+        return len(_os.sched_getaffinity(0))
+    except AttributeError:
+        return _os.cpu_count() or 1
+
+
+def _stack(arrays):
+    """The stack 'arrays' as the kernels take it, and the shape of its
+    frames.  An ndarray is passed whole, as a cube of frames along its first
+    axis; any other sequence frame by frame."""
+    if isinstance(arrays, np.ndarray) and arrays.ndim > 0:
+        return arrays, arrays.shape[1:]
     arrays = [ np.asarray(a) for a in arrays ]
     shape = arrays[0].shape
+    for a in arrays[1:]:
+        if a.shape != shape:
+            raise ValueError("all arrays must have identical shapes")
+    return arrays, shape
+
+
+def _combine_f(funcstr, arrays, output=None, outtype=None, nlow=0, nhigh=0,
+               badmasks=None, nthreads=None, **kernel_args):
+    arrays, shape = _stack(arrays)
     if output is None:
+        # every element is overwritten, so there is nothing to copy
         if outtype is not None:
-            out = arrays[0].astype(outtype)
+            out = np.empty(shape, dtype=outtype)
         else:
-            out = arrays[0].copy()
+            out = np.empty_like(arrays[0])
     else:
         out = output
-    for a in tuple(arrays[1:])+(out,):
-        if a.shape != shape:
-            raise ValueError("all arrays must have identical shapes")
-    _combine(arrays, out, nlow, nhigh, badmasks, funcstr)
+    if out.shape != shape:
+        raise ValueError("all arrays must have identical shapes")
+    if nthreads is None:
+        nthreads = _default_nthreads()
+    _combine(arrays, out, nlow, nhigh, badmasks, funcstr, nthreads,
+             **kernel_args)
     if output is None:
         return out
 
-def imedian(arrays, output=None, outtype=None, nlow=0, nhigh=0, badmasks=None):
+def _frame_terms(weights=None, scales=None, zeros=None):
+    """The kernel arguments for 'weights', 'scales' and 'zeros'.  Weights
+    given as one number per frame are passed as 'frame_weights'."""
+    terms = {}
+    if weights is not None:
+        if np.ndim(weights[0]) == 0:
+            terms['frame_weights'] = weights
+        else:
+            terms['weights'] = weights
+    if scales is not None:
+        terms['scales'] = scales
+    if zeros is not None:
+        terms['zeros'] = zeros
+    return terms
+
+
+def imedian(arrays, output=None, outtype=None, nlow=0, nhigh=0, badmasks=None,
+            nthreads=None, low=None, high=None, bad_bits=None,
+            packed_masks=False):
     """median() nominally computes the median pixels for a stack of
     identically shaped images, filling pixels with no weight with the value from
     the first input array.
@@ -52,6 +98,26 @@ def imedian(arrays, output=None, outtype=None, nlow=0, nhigh=0, badmasks=None):
                indicates that a particular pixel is not to be included in the
                median calculation.
 
+    nthreads : int
+        The number of threads the output rows are split among.  Defaults
+        to the number of cores available to the process.  The result does
+        not depend on it.
+
+    low, high : float, optional
+        Values < low or >= high are rejected while the pixel stacks are
+        gathered, as if masked with threshhold(arrays, low, high) but
+        without building the masks.
+
+    bad_bits : int, optional
+        When 'badmasks' are integer data quality arrays, the flags that mark
+        a pixel as bad: it is excluded when any of them is set.  By default
+        any nonzero value is bad.
+
+    packed_masks : bool
+        Whether 'badmasks' hold eight pixels per byte along their last
+        axis, as from np.packbits(masks, axis=-1) or
+        threshhold(..., packed=True).
+
     Examples
     ---------
     >>> a = np.arange(4)
@@ -79,14 +145,19 @@ def imedian(arrays, output=None, outtype=None, nlow=0, nhigh=0, badmasks=None):
            [ 8, 12]])
 
     """
-    return _combine_f("imedian", arrays, output, outtype, nlow, nhigh, badmasks)
+    return _combine_f("imedian", arrays, output, outtype, nlow, nhigh, badmasks,
+                      nthreads, low=low, high=high, bad_bits=bad_bits,
+                      packed_masks=packed_masks)
 
-def median(arrays, output=None, outtype=None, nlow=0, nhigh=0, badmasks=None):
+def median(arrays, output=None, outtype=None, nlow=0, nhigh=0, badmasks=None,
+           nthreads=None, low=None, high=None, bad_bits=None,
+           packed_masks=False):
     """median() nominally computes the median pixels for a stack of
     identically shaped images.
 
     arrays     specifies a sequence of inputs arrays, which are nominally a
-               stack of identically shaped images.
+               stack of identically shaped images.  A single ndarray is
+               read in place as a cube of frames along its first axis.
 
     output     may be used to specify the output array.  If none is specified,
                either arrays[0] is copied or a new array of type 'outtype'
@@ -105,6 +176,23 @@ def median(arrays, output=None, outtype=None, nlow=0, nhigh=0, badmasks=None):
                indicates that a particular pixel is not to be included in the
                median calculation.
 
+    nthreads   specifies the number of threads the output rows are split
+               among.  It defaults to the number of cores available to the
+               process and does not affect the result.
+
+    low, high  specify threshholds: values < low or >= high are rejected
+               while the pixel stacks are gathered, as if masked with
+               threshhold(arrays, low, high) but without building the masks.
+
+    bad_bits   specifies, when 'badmasks' are integer data quality arrays,
+               the flags that mark a pixel as bad: it is excluded when any
+               of them is set.  By default any nonzero value is bad.
+
+    packed_masks
+               specifies that 'badmasks' hold eight pixels per byte along
+               their last axis, as from np.packbits(masks, axis=-1) or
+               threshhold(..., packed=True).
+
     >>> a = np.arange(4)
     >>> a = a.reshape((2,2))
     >>> arrays = [a*16, a*4, a*2, a*8]
@@ -126,14 +214,21 @@ def median(arrays, output=None, outtype=None, nlow=0, nhigh=0, badmasks=None):
     array([[ 0,  8],
            [16, 24]])
     >>> median(arrays, badmasks=threshhold(arrays, high=25))
+    array([[ 0,  6],
+           [ 8, 12]])
+    >>> median(arrays, high=25)
     array([[ 0,  6],
            [ 8, 12]])
     """
 
-    return _combine_f("median", arrays, output, outtype, nlow, nhigh, badmasks)
+    return _combine_f("median", arrays, output, outtype, nlow, nhigh, badmasks,
+                      nthreads, low=low, high=high, bad_bits=bad_bits,
+                      packed_masks=packed_masks)
 
 
-def iaverage(arrays, output=None, outtype=None, nlow=0, nhigh=0, badmasks=None):
+def iaverage(arrays, output=None, outtype=None, nlow=0, nhigh=0, badmasks=None,
+             nthreads=None, weights=None, scales=None, zeros=None, low=None,
+             high=None, bad_bits=None, packed_masks=False):
     """average() nominally computes the average pixel value for a stack of
     identically shaped images, filling pixels with no weight with the value from
     the first input array.
@@ -158,6 +253,35 @@ def iaverage(arrays, output=None, outtype=None, nlow=0, nhigh=0, badmasks=None):
                indicates that a particular pixel is not to be included in the
                average calculation.
 
+    nthreads   specifies the number of threads the output rows are split
+               among.  It defaults to the number of cores available to the
+               process and does not affect the result.
+
+    low, high  specify threshholds: values < low or >= high are rejected
+               while the pixel stacks are gathered, as if masked with
+               threshhold(arrays, low, high) but without building the masks.
+
+    bad_bits   specifies, when 'badmasks' are integer data quality arrays,
+               the flags that mark a pixel as bad: it is excluded when any
+               of them is set.  By default any nonzero value is bad.
+
+    packed_masks
+               specifies that 'badmasks' hold eight pixels per byte along
+               their last axis, as from np.packbits(masks, axis=-1) or
+               threshhold(..., packed=True).
+
+    weights    specifies either one weight per input array or a stack of
+               weight arrays shaped like 'arrays'.  The result is then the
+               weighted mean of the pixels left after masking and clipping;
+               pixels whose weights sum to zero are set to 0.
+
+    scales     specifies one factor per input array that its pixels are
+               multiplied by before they are combined.
+
+    zeros      specifies one offset per input array that is added to its
+               pixels after scaling, before they are combined.
+
+
     >>> a = np.arange(4)
     >>> a = a.reshape((2,2))
     >>> arrays = [a*16, a*4, a*2, a*8]
@@ -183,10 +307,15 @@ def iaverage(arrays, output=None, outtype=None, nlow=0, nhigh=0, badmasks=None):
            [ 9, 14]])
 
     """
-    return _combine_f("iaverage", arrays, output, outtype, nlow, nhigh, badmasks)
+    return _combine_f("iaverage", arrays, output, outtype, nlow, nhigh, badmasks,
+                      nthreads, low=low, high=high, bad_bits=bad_bits,
+                      packed_masks=packed_masks,
+                      **_frame_terms(weights, scales, zeros))
 
 
-def average(arrays, output=None, outtype=None, nlow=0, nhigh=0, badmasks=None):
+def average(arrays, output=None, outtype=None, nlow=0, nhigh=0, badmasks=None,
+            nthreads=None, weights=None, scales=None, zeros=None, low=None,
+            high=None, bad_bits=None, packed_masks=False):
     """average() nominally computes the average pixel value for a stack of
     identically shaped images.
 
@@ -210,6 +339,35 @@ def average(arrays, output=None, outtype=None, nlow=0, nhigh=0, badmasks=None):
                indicates that a particular pixel is not to be included in the
                average calculation.
 
+    nthreads   specifies the number of threads the output rows are split
+               among.  It defaults to the number of cores available to the
+               process and does not affect the result.
+
+    low, high  specify threshholds: values < low or >= high are rejected
+               while the pixel stacks are gathered, as if masked with
+               threshhold(arrays, low, high) but without building the masks.
+
+    bad_bits   specifies, when 'badmasks' are integer data quality arrays,
+               the flags that mark a pixel as bad: it is excluded when any
+               of them is set.  By default any nonzero value is bad.
+
+    packed_masks
+               specifies that 'badmasks' hold eight pixels per byte along
+               their last axis, as from np.packbits(masks, axis=-1) or
+               threshhold(..., packed=True).
+
+    weights    specifies either one weight per input array or a stack of
+               weight arrays shaped like 'arrays'.  The result is then the
+               weighted mean of the pixels left after masking and clipping;
+               pixels whose weights sum to zero are set to 0.
+
+    scales     specifies one factor per input array that its pixels are
+               multiplied by before they are combined.
+
+    zeros      specifies one offset per input array that is added to its
+               pixels after scaling, before they are combined.
+
+
     >>> a = np.arange(4)
     >>> a = a.reshape((2,2))
     >>> arrays = [a*16, a*4, a*2, a*8]
@@ -233,14 +391,24 @@ def average(arrays, output=None, outtype=None, nlow=0, nhigh=0, badmasks=None):
     >>> average(arrays, badmasks=threshhold(arrays, high=25))
     array([[ 0,  7],
            [ 9, 14]])
+    >>> average(arrays, weights=[1, 0, 0, 1], outtype=np.float64)
+    array([[ 0., 12.],
+           [24., 36.]])
+    >>> average(arrays, scales=[0.5, 2, 4, 1], outtype=np.float64)
+    array([[ 0.,  8.],
+           [16., 24.]])
 
     """
 
     return _combine_f("average", arrays, output, outtype, nlow, nhigh,
-                      badmasks)
+                      badmasks, nthreads, low=low, high=high,
+                      bad_bits=bad_bits, packed_masks=packed_masks,
+                      **_frame_terms(weights, scales, zeros))
 
 
-def minimum(arrays, output=None, outtype=None, nlow=0, nhigh=0, badmasks=None):
+def minimum(arrays, output=None, outtype=None, nlow=0, nhigh=0, badmasks=None,
+            nthreads=None, low=None, high=None, bad_bits=None,
+            packed_masks=False):
     """minimum() nominally computes the minimum pixel value for a stack of
     identically shaped images.
 
@@ -264,6 +432,23 @@ def minimum(arrays, output=None, outtype=None, nlow=0, nhigh=0, badmasks=None):
                indicates that a particular pixel is not to be included in the
                minimum calculation.
 
+    nthreads   specifies the number of threads the output rows are split
+               among.  It defaults to the number of cores available to the
+               process and does not affect the result.
+
+    low, high  specify threshholds: values < low or >= high are rejected
+               while the pixel stacks are gathered, as if masked with
+               threshhold(arrays, low, high) but without building the masks.
+
+    bad_bits   specifies, when 'badmasks' are integer data quality arrays,
+               the flags that mark a pixel as bad: it is excluded when any
+               of them is set.  By default any nonzero value is bad.
+
+    packed_masks
+               specifies that 'badmasks' hold eight pixels per byte along
+               their last axis, as from np.packbits(masks, axis=-1) or
+               threshhold(..., packed=True).
+
     >>> a = np.arange(4)
     >>> a = a.reshape((2,2))
     >>> arrays = [a*16, a*4, a*2, a*8]
@@ -291,15 +476,374 @@ def minimum(arrays, output=None, outtype=None, nlow=0, nhigh=0, badmasks=None):
     """
 
     return _combine_f("minimum", arrays, output, outtype, nlow, nhigh,
-                      badmasks)
+                      badmasks, nthreads, low=low, high=high,
+                      bad_bits=bad_bits, packed_masks=packed_masks)
+
+
+def maximum(arrays, output=None, outtype=None, nlow=0, nhigh=0, badmasks=None,
+            nthreads=None, low=None, high=None, bad_bits=None,
+            packed_masks=False):
+    """maximum() nominally computes the maximum pixel value for a stack of
+    identically shaped images.  It takes the same arguments as minimum(),
+    with 'nhigh' excluding pixels from the maximum on the high end of the
+    pixel stack.
+
+    >>> a = np.arange(4)
+    >>> a = a.reshape((2,2))
+    >>> arrays = [a*16, a*4, a*2, a*8]
+    >>> maximum(arrays)
+    array([[ 0, 16],
+           [32, 48]])
+    >>> maximum(arrays, nhigh=1)
+    array([[ 0,  8],
+           [16, 24]])
+    >>> bm = np.zeros((4,2,2), dtype=np.bool_)
+    >>> bm[0,...] = 1
+    >>> maximum(arrays, badmasks=bm)
+    array([[ 0,  8],
+           [16, 24]])
+    >>> maximum(arrays, high=20)
+    array([[ 0, 16],
+           [16, 12]])
+
+    """
+    return _combine_f("maximum", arrays, output, outtype, nlow, nhigh,
+                      badmasks, nthreads, low=low, high=high,
+                      bad_bits=bad_bits, packed_masks=packed_masks)
+
+
+_CLIP_DOC = """%(name)s() computes the %(stat)s of each pixel stack of
+    identically shaped images after iteratively rejecting outliers.  In
+    every pass, values more than 'lsigma' below or 'hsigma' above the median
+    of the surviving values, in units of their %(spread)s, are rejected.
+    Passes stop when nothing more is rejected or after 'maxiter' passes.
+    The values are gathered and sorted once per pixel, however many passes
+    are made.
+
+    Parameters
+    ----------
+    arrays : list of ndarray
+        A sequence of inputs arrays, which are nominally a stack of
+        identically shaped images.
+
+    output : ndarray
+        Used to specify the output array.  If none is specified, a new
+        array of type 'outtype' (default: that of arrays[0]) is created.
+
+    outtype : dtype
+        The type of the output array when no 'output' is specified.
 
+    nlow, nhigh : int
+        The number of pixels to be excluded on the low and high ends of the
+        pixel stack before clipping starts.
 
-def threshhold(arrays, low=None, high=None, outputs=None):
+    badmasks : list of ndarrays
+        Boolean arrays corresponding to 'arrays', where true indicates that
+        a particular pixel is not to be included in the calculation, or
+        integer data quality arrays.
+
+    lsigma, hsigma : float
+        The lower and upper rejection limits, in units of the %(spread)s.
+
+    maxiter : int
+        The maximum number of rejection passes.
+
+    nthreads : int
+        The number of threads the output rows are split among.  Defaults to
+        the number of cores available to the process.
+
+    low, high : float, optional
+        Values < low or >= high are rejected before clipping starts, as if
+        masked with threshhold(arrays, low, high).
+
+    bad_bits, packed_masks
+        How 'badmasks' are read, as for median().
+
+    Examples
+    --------
+    >>> values = (1., 2., 3., 2., 1., 2., 3., 2., 100.)
+    >>> arrays = [np.full((2, 2), v) for v in values]
+    >>> %(name)s(arrays)
+    array([[2., 2.],
+           [2., 2.]])
+    """
+
+
+def sigclip_median(arrays, output=None, outtype=None, nlow=0, nhigh=0,
+                   badmasks=None, lsigma=3.0, hsigma=3.0, maxiter=5,
+                   nthreads=None, low=None, high=None, bad_bits=None,
+                   packed_masks=False):
+    return _combine_f("sigclip_median", arrays, output, outtype, nlow, nhigh,
+                      badmasks, nthreads, lsigma=lsigma, hsigma=hsigma,
+                      maxiter=maxiter, low=low, high=high, bad_bits=bad_bits,
+                      packed_masks=packed_masks)
+
+
+def sigclip_average(arrays, output=None, outtype=None, nlow=0, nhigh=0,
+                    badmasks=None, lsigma=3.0, hsigma=3.0, maxiter=5,
+                    nthreads=None, low=None, high=None, bad_bits=None,
+                    packed_masks=False):
+    return _combine_f("sigclip_average", arrays, output, outtype, nlow, nhigh,
+                      badmasks, nthreads, lsigma=lsigma, hsigma=hsigma,
+                      maxiter=maxiter, low=low, high=high, bad_bits=bad_bits,
+                      packed_masks=packed_masks)
+
+
+def madclip_median(arrays, output=None, outtype=None, nlow=0, nhigh=0,
+                   badmasks=None, lsigma=3.0, hsigma=3.0, maxiter=5,
+                   nthreads=None, low=None, high=None, bad_bits=None,
+                   packed_masks=False):
+    return _combine_f("madclip_median", arrays, output, outtype, nlow, nhigh,
+                      badmasks, nthreads, lsigma=lsigma, hsigma=hsigma,
+                      maxiter=maxiter, low=low, high=high, bad_bits=bad_bits,
+                      packed_masks=packed_masks)
+
+
+def madclip_average(arrays, output=None, outtype=None, nlow=0, nhigh=0,
+                    badmasks=None, lsigma=3.0, hsigma=3.0, maxiter=5,
+                    nthreads=None, low=None, high=None, bad_bits=None,
+                    packed_masks=False):
+    return _combine_f("madclip_average", arrays, output, outtype, nlow, nhigh,
+                      badmasks, nthreads, lsigma=lsigma, hsigma=hsigma,
+                      maxiter=maxiter, low=low, high=high, bad_bits=bad_bits,
+                      packed_masks=packed_masks)
+
+
+sigclip_median.__doc__ = _CLIP_DOC % dict(
+    name="sigclip_median", stat="median", spread="standard deviation")
+sigclip_average.__doc__ = _CLIP_DOC % dict(
+    name="sigclip_average", stat="average", spread="standard deviation")
+madclip_median.__doc__ = _CLIP_DOC % dict(
+    name="madclip_median", stat="median",
+    spread="median absolute deviation (scaled to a standard deviation)")
+madclip_average.__doc__ = _CLIP_DOC % dict(
+    name="madclip_average", stat="average",
+    spread="median absolute deviation (scaled to a standard deviation)")
+
+
+STATISTICS = ('median', 'mean', 'minimum', 'maximum', 'count', 'std', 'mad')
+
+
+def combine_stats(arrays, stats=STATISTICS, outputs=None, outtype=None,
+                  nlow=0, nhigh=0, badmasks=None, clip=None, lsigma=3.0,
+                  hsigma=3.0, maxiter=5, nthreads=None, bad_bits=None,
+                  packed_masks=False):
+    """combine_stats() computes several statistics of each pixel stack of
+    identically shaped images at once.  Each pixel stack is gathered and
+    sorted a single time, however many statistics are requested.
+
+    Parameters
+    ----------
+    arrays : list of ndarray
+        A sequence of inputs arrays, which are nominally a stack of
+        identically shaped images.
+
+    stats : sequence of str
+        The statistics to compute, any of:
+
+            'median'    as computed by median()
+            'mean'      as computed by average()
+            'minimum'   as computed by minimum()
+            'maximum'   the largest value left
+            'count'     the number of pixels not excluded by 'badmasks'
+            'std'       the standard deviation of the values left
+            'mad'       the median absolute deviation of the values left
+                        from their median (not scaled to a sigma)
+
+        All but 'count' describe the values left once the 'nlow' lowest,
+        the 'nhigh' highest and, if 'clip' is given, the clipped values
+        have been excluded.
+
+    outputs : dict, optional
+        Output arrays keyed by statistic.  Statistics without an entry get
+        a new array of type 'outtype'.
+
+    outtype : dtype, optional
+        The type of the new output arrays.  Defaults to float64, and to
+        int32 for 'count'.
+
+    nlow, nhigh : int
+        The number of pixels to be excluded on the low and high ends of the
+        pixel stack.
+
+    badmasks : list of ndarrays
+        Boolean arrays corresponding to 'arrays', where true indicates that
+        a particular pixel is not to be included.
+
+    clip : {None, 'sigma', 'mad'}
+        Iteratively reject outliers as sigclip_median() and
+        madclip_median() do before the statistics are computed, with the
+        'median' and 'mean' then matching those of the clipping combiners.
+
+    lsigma, hsigma, maxiter : float, float, int
+        The rejection limits and the maximum number of passes of 'clip'.
+
+    nthreads : int
+        The number of threads the output rows are split among.  Defaults to
+        the number of cores available to the process.
+
+    bad_bits, packed_masks
+        How 'badmasks' are read, as for median().
+
+    Returns
+    -------
+    results : dict
+        The statistics requested by 'stats' or 'outputs', keyed by name.
+
+    Examples
+    --------
+    >>> arrays = [np.full((2, 2), v) for v in (4., 1., 3., 2.)]
+    >>> r = combine_stats(arrays, ('median', 'maximum', 'count'), nhigh=1)
+    >>> r['median'], r['maximum'], r['count']
+    (array([[2., 2.],
+           [2., 2.]]), array([[3., 3.],
+           [3., 3.]]), array([[4, 4],
+           [4, 4]], dtype=int32))
+    """
+    arrays, shape = _stack(arrays)
+    if not stats:
+        raise ValueError("no statistics were requested")
+    results = dict(outputs or {})
+    for name in list(results) + list(stats):
+        if name not in STATISTICS:
+            raise ValueError("unknown statistic: %r" % (name,))
+    for name in stats:
+        if name not in results:
+            if outtype is not None:
+                dtype = outtype
+            else:
+                dtype = np.int32 if name == 'count' else np.float64
+            results[name] = np.empty(shape, dtype=dtype)
+    for out in results.values():
+        if out.shape != shape:
+            raise ValueError("all arrays must have identical shapes")
+    if nthreads is None:
+        nthreads = _default_nthreads()
+    _combine_stats(arrays, [results.get(name) for name in STATISTICS], nlow,
+                   nhigh, badmasks, nthreads, clip, lsigma, hsigma, maxiter,
+                   bad_bits, packed_masks)
+    return dict((name, results[name]) for name in STATISTICS
+                if name in results)
+
+
+def shift_and_combine(arrays, offsets, kind="median", output=None,
+                      outtype=None, nlow=0, nhigh=0, badmasks=None,
+                      nthreads=None, **kernel_args):
+    """shift_and_combine() registers a stack of identically shaped images
+    by sub-pixel offsets and combines them, without ever making the shifted
+    copies: each pixel stack is sampled from the inputs, by bilinear
+    interpolation, as it is gathered.
+
+    Parameters
+    ----------
+    arrays : list of 2-D ndarray
+        A sequence of inputs arrays, which are nominally a stack of
+        identically shaped images.
+
+    offsets : sequence of (dx, dy)
+        The shift of each input, as by translate(): output pixel [y, x]
+        combines input i sampled at (y - dy[i], x - dx[i]).
+
+    kind : {'median', 'imedian', 'average', 'iaverage', 'minimum', ...}
+        The combine kernel to use; see the functions of the same name.
+
+    output : ndarray, optional
+        Used to specify the output array.  If none is specified, a new
+        array of type 'outtype' is created.
+
+    outtype : dtype, optional
+        The type of the output array when no 'output' is specified.
+        Defaults to float64.
+
+    nlow, nhigh : int
+        The number of pixels to be excluded on the low and high ends of the
+        pixel stack.
+
+    badmasks : list of ndarrays
+        Boolean arrays corresponding to 'arrays', where true indicates that
+        a particular pixel is not to be included.  They are shifted with
+        their arrays: a sample is excluded when any pixel it interpolates
+        is bad, or when it falls beyond the edges of its input.
+
+    nthreads : int
+        The number of threads the output rows are split among.  Defaults to
+        the number of cores available to the process.
+
+    **kernel_args
+        Further arguments of the kernel, such as the 'lsigma', 'hsigma' and
+        'maxiter' of the clipping kernels or the per-frame 'weights',
+        'scales' and 'zeros' of the averages.
+
+    Examples
+    --------
+    >>> a = np.arange(12.).reshape((3, 4))
+    >>> shift_and_combine([a, np.roll(a, 1, axis=1)], [(0, 0), (-1, 0)],
+    ...                   kind='average')
+    array([[ 0.,  1.,  2.,  3.],
+           [ 4.,  5.,  6.,  7.],
+           [ 8.,  9., 10., 11.]])
+    """
+    arrays, shape = _stack(arrays)
+    offsets = np.asarray(offsets, dtype=np.float64)
+    kernel_args.update(_frame_terms(kernel_args.pop('weights', None),
+                                    kernel_args.pop('scales', None),
+                                    kernel_args.pop('zeros', None)))
+    if output is None:
+        out = np.empty(shape,
+                       dtype=outtype if outtype is not None else np.float64)
+    else:
+        out = output
+    if out.shape != shape:
+        raise ValueError("all arrays must have identical shapes")
+    if out.ndim != 2:
+        raise ValueError("arrays must be 2-dimensional")
+    if offsets.shape != (len(arrays), 2):
+        raise ValueError("offsets must hold a (dx, dy) pair for each array")
+    if nthreads is None:
+        nthreads = _default_nthreads()
+    _combine(arrays, out, nlow, nhigh, badmasks, kind, nthreads,
+             offsets=offsets, **kernel_args)
+    if output is None:
+        return out
+
+
+def threshhold(arrays, low=None, high=None, outputs=None, packed=False,
+               update=False, nthreads=None):
     """threshhold() computes a boolean array 'outputs' with
     corresponding elements for each element of arrays.  The
     boolean value is true where each of the arrays values
     is < the low or >= the high threshholds.
 
+    Each frame is read once, comparing against both threshholds, and its
+    mask is written straight into its plane of 'outputs'; a list of frames
+    is never stacked into one array.
+
+    Parameters
+    ----------
+    arrays : list of ndarray
+        The frames to threshhold, or a single array whose first axis runs
+        over the frames.
+
+    low, high : float, optional
+        Values < low and values >= high are flagged.
+
+    outputs : ndarray or list of ndarray, optional
+        One mask plane per frame: bool arrays of the shape of the frames
+        or, with 'packed', uint8 arrays as from ``np.packbits(mask,
+        axis=-1)``.  Planes of other types receive the flags as 0 and 1.  A new stack of planes is returned when none are given.
+
+    packed : bool
+        Write eight pixels per byte along the last axis, in the bit order
+        of `numpy.packbits`.
+
+    update : bool
+        OR the flags into what 'outputs' already holds, for instance a
+        stack of bad pixel masks, rather than overwriting it.
+
+    nthreads : int
+        The number of threads the rows are split among.  Defaults to the
+        number of cores available to the process.
+
     >>> a=np.arange(100)
     >>> a=a.reshape((10,10))
     >>> (threshhold(a, 1, 50)).astype(np.int8)
@@ -348,44 +892,27 @@ def threshhold(arrays, low=None, high=None, outputs=None):
            [0, 0, 0, 0, 0, 0, 0, 0, 0, 0]], dtype=int8)
 
     """
-    arrays = np.asarray(arrays)
-
-    if high is None and low is None:
-        return np.zeros_like(arrays, dtype=bool)
-
+    if not isinstance(arrays, np.ndarray) and (
+            len(arrays) == 0 or np.ndim(arrays[0]) == 0):
+        # a sequence of numbers, rather than of frames
+        arrays = np.asarray(arrays)
+    if len(arrays) and np.ndim(arrays[0]) == 0:
+        raise ValueError("arrays must be a stack of frames of at least one "
+                         "dimension")
     if outputs is None:
-        outputs = np.empty_like(arrays, dtype=bool)
-
-    if high is None:
-        for k in range(arrays.shape[0]):
-            np.less(arrays[k], low, outputs[k])
-    else:
-        if low is None:
-            for k in range(arrays.shape[0]):
-                np.greater_equal(arrays[k], high, outputs[k])
-        else:
-            for k in range(arrays.shape[0]):
-                arr = arrays[k]
-                out = outputs[k]
-                np.greater_equal(arr, high, out)
-                np.logical_or(out, arr < low, out)
-
+        shape = (len(arrays),) + np.shape(arrays[0])
+        if packed:
+            if len(shape) < 2:
+                raise ValueError("packed masks need frames of at least one "
+                                 "dimension")
+            shape = shape[:-1] + ((shape[-1] + 7) // 8,)
+        if high is None and low is None:
+            return np.zeros(shape, dtype=np.uint8 if packed else bool)
+        outputs = np.empty(shape, dtype=np.uint8 if packed else bool)
+    elif high is None and low is None and update:
+        return outputs
+    if nthreads is None:
+        nthreads = _default_nthreads()
+    _threshhold(arrays, outputs, low, high, packed, update, nthreads)
     return outputs
 
-
-def _bench():
-    """time a 10**6 element median"""
-    import time
-    a = np.arange(10**6)
-    a = a.reshape((1000, 1000))
-    arrays = [a*2, a*64, a*16, a*8]
-    t0 = time.clock()
-    median(arrays)
-    print("maskless:", time.clock()-t0)
-
-    a = np.arange(10**6)
-    a = a.reshape((1000, 1000))
-    arrays = [a*2, a*64, a*16, a*8]
-    t0 = time.clock()
-    median(arrays, badmasks=np.zeros((1000,1000), dtype=np.bool8))
-    print("masked:", time.clock()-t0)
@@ -0,0 +1,257 @@
+"""Combine stacks of images stored in FITS or ``.npy`` files.
+
+The files are opened memory-mapped and combined one block of rows at a
+time, as `stsci.image.tiled_combine` does for arrays: the same rows are read
+from every file (and from its data quality extension), reduced with the
+combine kernels, and appended to the output file before moving on.  Peak
+memory is therefore set by the size of a block, not by the size of the
+stack.
+
+FITS files need `astropy`; ``.npy`` files only need `numpy`.
+"""
+from __future__ import (absolute_import, division, unicode_literals,
+                        print_function)
+
+import os
+
+import numpy as np
+
+from ._combine import combine as _combine
+from .combine import _default_nthreads, _frame_terms
+from .tiled import _block_rows
+
+__all__ = ['combine_files']
+
+
+def _fits():
+    try:
+        from astropy.io import fits
+    except ImportError:
+        raise ImportError("astropy is required to read and write FITS files")
+    return fits
+
+
+def _is_npy(path):
+    return str(path).lower().endswith('.npy')
+
+
+class _Source(object):
+    """One image of a file, which is only ever sliced along its first
+    axis."""
+
+    def __init__(self, path, ext):
+        self.hdul = None
+        if _is_npy(path):
+            self.data = np.load(path, mmap_mode='r')
+            return
+        fits = _fits()
+        self.hdul = fits.open(path, memmap=True)
+        try:
+            hdu = self.hdul[ext]
+            if hdu.header.get('NAXIS', 0) == 0:
+                raise ValueError("%s[%s] has no image data" % (path, ext))
+        except Exception:
+            self.close()
+            raise
+        if (isinstance(hdu, (fits.PrimaryHDU, fits.ImageHDU)) and
+                not any(k in hdu.header for k in ('BSCALE', 'BZERO',
+                                                  'BLANK'))):
+            self.data = hdu.data
+        else:
+            # scaled and compressed images cannot be mapped; their sections
+            # are read and converted on demand instead
+            self.hdul.close()
+            self.hdul = fits.open(path, memmap=False)
+            self.data = self.hdul[ext].section
+
+    @property
+    def shape(self):
+        return tuple(self.data.shape)
+
+    def __getitem__(self, rows):
+        return np.asarray(self.data[rows])
+
+    def close(self):
+        self.data = None
+        if self.hdul is not None:
+            self.hdul.close()
+
+
+class _NpyWriter(object):
+
+    def __init__(self, path, shape, dtype):
+        self.data = np.lib.format.open_memmap(path, mode='w+', dtype=dtype,
+                                              shape=shape)
+        self.row = 0
+
+    def write(self, block):
+        self.data[self.row:self.row + len(block)] = block
+        self.row += len(block)
+
+    def close(self):
+        self.data.flush()
+        self.data = None
+
+
+class _FitsWriter(object):
+
+    def __init__(self, path, shape, dtype, ncombine):
+        fits = _fits()
+        header = fits.PrimaryHDU(data=np.zeros((1,) * len(shape),
+                                               dtype=dtype)).header
+        for i, n in enumerate(shape[::-1]):
+            header['NAXIS%d' % (i + 1)] = n
+        header['NCOMBINE'] = (ncombine, 'number of files combined')
+        # integers stored with an offset, such as unsigned 16-bit ones, are
+        # written as their other-signedness counterparts
+        self.flip = dtype.kind in 'iu' and header.get('BZERO', 0) != 0
+        self.stream = fits.StreamingHDU(path, header)
+
+    def write(self, block):
+        if self.flip:
+            size = block.dtype.itemsize
+            unsigned = block.view('u%d' % size) ^ (1 << (8 * size - 1))
+            block = unsigned.view('%s%d' % ('u' if block.dtype.kind == 'i'
+                                            else 'i', size))
+        self.stream.write(block)
+
+    def close(self):
+        self.stream.close()
+
+
+def combine_files(paths, output=None, ext=0, kind="median", outtype=None,
+                  nlow=0, nhigh=0, mask_ext=None, block_rows=None,
+                  max_memory=2**30, overwrite=False, nthreads=None,
+                  **kernel_args):
+    """Combine identically shaped images stored in FITS or ``.npy`` files
+    in blocks of rows.
+
+    Parameters
+    ----------
+    paths : sequence of str
+        The files to combine.  Names ending in ``.npy`` are read with
+        `numpy.load`, all others as FITS files.
+
+    output : str, optional
+        The file the combined image is written to, a ``.npy`` file if the
+        name ends with ``.npy`` and a FITS file otherwise.  It is written
+        block by block, as the blocks are combined.  If none is specified,
+        the combined image is returned in memory instead.
+
+    ext : int or str or tuple
+        The FITS extension holding the image in every file, in any form
+        accepted by `astropy.io.fits.HDUList`.  Ignored for ``.npy`` files.
+
+    kind : {'median', 'imedian', 'average', 'iaverage', 'minimum', ...}
+        The combine kernel to use, as in `stsci.image.tiled_combine`.
+
+    outtype : dtype, optional
+        The type of the combined image.  Defaults to the type of the data
+        of the first file, after any FITS scaling.
+
+    nlow, nhigh : int
+        The number of pixels to be excluded on the low and high ends of
+        each pixel stack.
+
+    mask_ext : int or str or tuple, optional
+        The FITS extension of every file flagging its bad pixels, such as
+        'DQ'.  Nonzero pixels are excluded, or only those with one of the
+        'bad_bits' set when those are given.
+
+    block_rows : int, optional
+        The number of rows combined at a time.  Defaults to as many as
+        'max_memory' allows.
+
+    max_memory : int
+        Upper bound, in bytes, on the size of one block taken from every
+        file, mask and the output when 'block_rows' is not given.
+
+    overwrite : bool
+        Whether to replace an existing 'output' file.
+
+    nthreads : int, optional
+        The number of threads each block is split among.  Defaults to the
+        number of cores available to the process.
+
+    **kernel_args
+        Further arguments of the kernel, such as 'bad_bits', the 'lsigma',
+        'hsigma' and 'maxiter' of the clipping kernels, or the 'weights',
+        'scales' and 'zeros' of the averages, given as one number per file.
+
+    Returns
+    -------
+    output : ndarray
+        The combined image, when no 'output' was specified.
+    """
+    if len(paths) == 0:
+        raise ValueError("at least one file is required")
+    kernel_args.update(_frame_terms(kernel_args.pop('weights', None),
+                                    kernel_args.pop('scales', None),
+                                    kernel_args.pop('zeros', None)))
+    if 'weights' in kernel_args:
+        raise ValueError("weights must be given as one number per file")
+    if block_rows is not None and block_rows < 1:
+        raise ValueError("block_rows must be at least 1")
+    if output is not None and os.path.exists(output):
+        if not overwrite:
+            raise OSError("%s already exists" % output)
+        # a FITS stream would be appended to the existing file
+        os.remove(output)
+    if nthreads is None:
+        nthreads = _default_nthreads()
+
+    sources, masks, writer, result = [], [], None, None
+    try:
+        for path in paths:
+            sources.append(_Source(path, ext))
+            if mask_ext is not None:
+                masks.append(_Source(path, mask_ext))
+        shape = sources[0].shape
+        for s in sources[1:] + masks:
+            if s.shape != shape:
+                raise ValueError("all images must have identical shapes")
+        if len(shape) == 0:
+            raise ValueError("images must have at least one dimension")
+
+        nrows = shape[0]
+        step = block_rows
+        if step is None:
+            step = _block_rows([s.data for s in sources],
+                               [m.data for m in masks] or None, None,
+                               np.empty(0, dtype=outtype or np.float64),
+                               shape, max_memory)
+        dtype = None
+        for start in range(0, nrows, step):
+            rows = slice(start, min(start + step, nrows))
+            block = [s[rows] for s in sources]
+            bad = [m[rows] for m in masks] or None
+            if dtype is None:
+                dtype = np.dtype(outtype or block[0].dtype).newbyteorder('=')
+                if output is None:
+                    result = np.empty(shape, dtype=dtype)
+                elif _is_npy(output):
+                    writer = _NpyWriter(output, shape, dtype)
+                else:
+                    writer = _FitsWriter(output, shape, dtype, len(paths))
+            if writer is None:
+                out = result[rows]
+            else:
+                out = np.empty((rows.stop - start,) + shape[1:], dtype=dtype)
+            _combine(block, out, nlow, nhigh, bad, kind, nthreads,
+                     **kernel_args)
+            if writer is not None:
+                writer.write(out)
+            del block, bad, out
+        if writer is not None:
+            writer.close()
+            writer = None
+    finally:
+        for s in sources + masks:
+            s.close()
+        if writer is not None:
+            # a failed combine leaves no partial output behind
+            writer.close()
+            os.remove(output)
+
+    if output is None:
+        return result
@@ -39,9 +39,34 @@
 #                     num_combine function.
 from __future__ import (absolute_import, division, unicode_literals,
                         print_function)
+import mmap
+import multiprocessing
+import os
+import queue
+import shutil
+import tempfile
 import warnings
 import numpy as np
 import stsci.image as image
+from .combine import _combine_f, _default_nthreads
+
+# the combine kernel of every combination type
+_KINDS = {
+    'median': 'median',
+    'imedian': 'imedian',
+    'mean': 'average',
+    'iaverage': 'iaverage',
+    'imean': 'iaverage',
+    'sum': 'sum',
+    'minimum': 'minimum',
+    'maximum': 'maximum',
+    'sigclip_median': 'sigclip_median',
+    'sigclip_mean': 'sigclip_average',
+    'sigclip_average': 'sigclip_average',
+    'madclip_median': 'madclip_median',
+    'madclip_mean': 'madclip_average',
+    'madclip_average': 'madclip_average',
+}
 
 
 class numCombine(object):
@@ -105,13 +130,12 @@ class numCombine(object):
         # keep code with new variable name
         arrMaskList = numarrayMaskList
 
-        # Convert the input arrays to the type of array used by the numerix layer
-        for i in range(len(arrObjectList)):
-            arrObjectList[i] = np.asarray(arrObjectList[i])
+        # Convert the input arrays to the type of array used by the numerix
+        # layer, leaving the caller's lists as they are
+        arrObjectList = [np.asarray(a) for a in arrObjectList]
 
         if arrMaskList is not None:
-            for i in range(len(arrMaskList)):
-                arrMaskList[i] = np.asarray(arrMaskList[i])
+            arrMaskList = [np.asarray(m) for m in arrMaskList]
 
         # define variables
         self.__arrObjectList = arrObjectList
@@ -268,25 +292,34 @@ class numCombine(object):
 
 
 def num_combine(data, masks=None, combination_type="median",
-                nlow=0, nhigh=0, upper=None, lower=None):
+                nlow=0, nhigh=0, upper=None, lower=None, lsigma=3.0,
+                hsigma=3.0, maxiter=5, nthreads=None, output=None):
     """ A lite version of the imcombine IRAF task
 
     Parameters
     ----------
     data : list of 2D numpy.ndarray or a 3D numpy.ndarray
         A sequence of inputs arrays, which are nominally a stack of identically
-        shaped images.
+        shaped images.  The frames are read in place, whether they come as a
+        cube or as a list of arrays or `numpy.memmap` files; a list is never
+        stacked into a cube.
 
     masks : list of 2D numpy.ndarray or a 3D numpy.ndarray
         A sequence of mask arrays to use for masking out 'bad' pixels from the
         combination. The ndarray should be a numpy array, despite the variable
         name.
 
-    combinationType : {'median', 'imedian', 'iaverage', 'mean', 'sum', 'minimum'}
+    combinationType : {'median', 'imedian', 'iaverage', 'mean', 'sum', 'minimum', 'maximum', 'sigclip_median', 'sigclip_mean', 'madclip_median', 'madclip_mean'}
         Type of operation should be used to combine the images.
         The 'imedian' and 'iaverage' types ignore pixels which have been
         flagged as bad in all input arrays and returns the value from the last
         image in the stack for that pixel.
+        The 'sigclip_*' and 'madclip_*' types iteratively reject outliers
+        using the standard deviation or the median absolute deviation of
+        each pixel stack, and return the median or mean of what is left.
+        Every type honours 'masks', 'nlow', 'nhigh', 'upper' and 'lower',
+        and has a variant prefixed with 'nan' ('nanmedian', 'nansum', ...)
+        that also ignores NaN pixels.
 
     nlow : int, optional
         Number of low pixels to throw out of the median calculation.
@@ -300,10 +333,27 @@ def num_combine(data, masks=None, combination_type="median",
     lower : float, optional
         Throw out values < lower in a median calculation.
 
+    lsigma, hsigma : float, optional
+        Lower and upper rejection limits of the 'sigclip_*' and 'madclip_*'
+        types, in units of the standard deviation.
+
+    maxiter : int, optional
+        Maximum number of rejection passes of the 'sigclip_*' and
+        'madclip_*' types.
+
+    nthreads : int, optional
+        Number of threads the output rows are split among.  Defaults to the
+        number of cores available to the process.
+
+    output : numpy.ndarray, optional
+        Where to store the combined array, for instance a `numpy.memmap`
+        opened for writing.  Defaults to a new array of the type of the
+        first frame.
+
     Returns
     -------
     comb_arr : numpy.ndarray
-        Combined output array.
+        Combined output array, 'output' if one was given.
 
     Examples
     --------
@@ -323,50 +373,252 @@ def num_combine(data, masks=None, combination_type="median",
            [1.0166667, 1.0166667, 1.0166667, 1.0166667, 1.0166667],
            [1.0166667, 1.0166667, 1.0166667, 1.0166667, 1.0166667]], dtype=float32)
     """
-    data = np.asarray(data)
-    if masks is not None:
-        masks = np.asarray(masks)
-
     # Simple sanity check to make sure that the min/max clipping doesn't throw
     # out all of the pixels.
-    if data.shape[0] - nlow - nhigh < 1:
+    if len(data) - nlow - nhigh < 1:
         raise ValueError("Rejecting all pixels due to large 'nval' and/or "
                          "'nhigh'!")
 
-    # Create output numarray object
-    comb_arr = np.empty_like(data[0])
-
-    # Create the threshold masks if necessary and combine them with the
-    # input masks (if any).
-    if lower is not None or upper is not None:
-        thmasks = image.threshhold(data, low=lower, high=upper)
-        if masks is None:
-            masks = thmasks
-        else:
-            masks = np.logical_or(masks, thmasks)
+    # Create output numarray object; the frames and masks go to the kernels
+    # as they are, which check their shapes
+    if output is None:
+        first = np.asarray(data[0])
+        comb_arr = np.empty(first.shape, dtype=first.dtype)
+    else:
+        comb_arr = output
 
-    # Combine the input images.
+    # The kernels reject values beyond the thresholds as they gather each
+    # pixel stack, along with the masked ones (and NaNs, for the 'nan*'
+    # types), so no threshold masks are built.
     combination_type = combination_type.lower()
-
-    if combination_type == 'median':
-        image.median(data, comb_arr, comb_arr.dtype, nlow=nlow, nhigh=nhigh,
-                     badmasks=masks)
-    elif combination_type == 'imedian':
-        image.imedian(data, comb_arr, comb_arr.dtype, nlow=nlow, nhigh=nhigh,
-                      badmasks=masks)
-    elif combination_type in ['iaverage', 'imean']:
-        image.iaverage(data, comb_arr, comb_arr.dtype, nlow=nlow, nhigh=nhigh,
-                       badmasks=masks)
-    elif combination_type == 'mean':
-        image.average(data, comb_arr, comb_arr.dtype, nlow=nlow, nhigh=nhigh,
-                      badmasks=masks)
-    elif combination_type == 'sum':
-        np.sum(data, axis=0, out=comb_arr)
-    elif combination_type == 'minimum':
-        image.minimum(data, comb_arr, comb_arr.dtype, nlow=nlow, nhigh=nhigh,
-                      badmasks=masks)
-    else:
+    prefix = 'nan' if combination_type.startswith('nan') else ''
+    kind = _KINDS.get(combination_type[len(prefix):])
+    if kind is None:
         comb_arr.fill(0)
         print("Combination type not supported!!!")
+    else:
+        _combine_f(prefix + kind, data, comb_arr, nlow=nlow, nhigh=nhigh,
+                   badmasks=masks, low=lower, high=upper, lsigma=lsigma,
+                   hsigma=hsigma, maxiter=maxiter, nthreads=nthreads)
 
     return comb_arr
+
+
+class _SharedArray(object):
+    """An array in a file that every process maps, instead of pickling it."""
+
+    def __init__(self, filename, dtype, shape, offset=0, order='C'):
+        self.filename = filename
+        self.dtype = dtype
+        self.shape = shape
+        self.offset = offset
+        self.order = order
+
+    def open(self, mode='r'):
+        return np.memmap(self.filename, dtype=self.dtype, mode=mode,
+                         offset=self.offset, shape=self.shape,
+                         order=self.order)
+
+
+def _shares_in_place(a):
+    """Whether 'a' is a memory-mapped file that other processes can map."""
+    return (isinstance(a, np.memmap) and isinstance(a.base, mmap.mmap) and
+            (a.flags.c_contiguous or a.flags.f_contiguous))
+
+
+def _share(a, directory, name):
+    """'a' as a _SharedArray: a memory-mapped file is mapped again in
+    place, anything else is written to a new file in 'directory'."""
+    if _shares_in_place(a):
+        return _SharedArray(a.filename, a.dtype, a.shape, a.offset,
+                            'C' if a.flags.c_contiguous else 'F')
+    a = np.asarray(a)
+    shared = _SharedArray(os.path.join(directory, name), a.dtype, a.shape)
+    shared.open('w+')[...] = a
+    return shared
+
+
+def _share_stack(stack, directory, name):
+    """A cube or a sequence of frames as _SharedArrays."""
+    if isinstance(stack, np.ndarray):
+        return _share(stack, directory, name)
+    return [_share(a, directory, '%s-%d' % (name, i))
+            for i, a in enumerate(stack)]
+
+
+def _open_stack(stack):
+    if isinstance(stack, _SharedArray):
+        return stack.open()
+    return [a.open() for a in stack]
+
+
+def _run_job(args):
+    """Run one job of num_combine_many() in a worker."""
+    index, data, masks, output, kwargs = args
+    out = output.open('r+')
+    num_combine(_open_stack(data),
+                None if masks is None else _open_stack(masks),
+                output=out, **kwargs)
+    out.flush()
+    return index
+
+
+def _nbytes(stack):
+    if isinstance(stack, np.ndarray):
+        return stack.nbytes
+    return sum(np.asarray(a).nbytes for a in stack)
+
+
+class _Staged(object):
+    """The shared inputs and output of one job of num_combine_many(), and
+    what is left to do once it is done."""
+
+    def __init__(self, index, job, directory):
+        job = dict(job)
+        data = job.pop('data')
+        masks = job.pop('masks', None)
+        self.output = job.pop('output', None)
+        job['nthreads'] = 1
+        self.files = []
+        self.data = self._share(data, directory, 'data-%d' % index)
+        self.masks = None
+        if masks is not None:
+            self.masks = self._share(masks, directory, 'masks-%d' % index)
+        out = self.output
+        if (out is not None and _shares_in_place(out) and
+                out.flags.writeable):
+            # written by the worker in place
+            self.shared_output = _share(out, directory, 'output-%d' % index)
+        else:
+            if out is None:
+                first = np.asarray(data[0])
+                dtype, shape = first.dtype, first.shape
+            else:
+                dtype, shape = out.dtype, out.shape
+            self.shared_output = _SharedArray(
+                os.path.join(directory, 'output-%d' % index), dtype, shape)
+            self.shared_output.open('w+')
+            self.files.append(self.shared_output.filename)
+        self.task = (index, self.data, self.masks, self.shared_output, job)
+
+    def _share(self, stack, directory, name):
+        shared = _share_stack(stack, directory, name)
+        for a in [shared] if isinstance(shared, _SharedArray) else shared:
+            if os.path.dirname(a.filename) == directory:
+                self.files.append(a.filename)
+        return shared
+
+    def finish(self):
+        """The result of the job, with its staged files removed."""
+        result = self.output
+        if self.shared_output.filename in self.files:
+            combined = self.shared_output.open()
+            if result is None:
+                result = np.array(combined)
+            else:
+                result[...] = combined
+            del combined
+        elif isinstance(result, np.memmap):
+            result.flush()
+        self.remove()
+        return result
+
+    def remove(self):
+        for filename in self.files:
+            try:
+                os.remove(filename)
+            except OSError:
+                pass
+        self.files = []
+
+
+def num_combine_many(jobs, workers=None, tmpdir=None):
+    """ Run many independent `num_combine` calls on a pool of processes.
+
+    Parameters
+    ----------
+    jobs : sequence of dict
+        The keyword arguments of every `num_combine` call, 'data' (and
+        'masks', and 'output') included.
+
+    workers : int, optional
+        Number of worker processes.  Defaults to the number of cores
+        available to the process; with a single worker, the jobs run in
+        this process.
+
+    tmpdir : str, optional
+        Where the inputs that are not already memory-mapped files, and the
+        outputs, are written for the workers to map.  Defaults to
+        ``/dev/shm`` when it exists (memory shared between processes) and
+        to the system's temporary directory otherwise.
+
+    Returns
+    -------
+    results : list of numpy.ndarray
+        The combined array of every job, in the order of 'jobs': its
+        'output' when it has one, and a new array otherwise.
+
+    Notes
+    -----
+    No array is ever pickled.  The frames, masks and output of a job are
+    memory-mapped files that the worker running it maps.  Arrays that
+    already are `numpy.memmap` files are mapped as they are, so an
+    'output' opened for writing that way is written by the worker in
+    place; any other array is copied to a file in 'tmpdir' when the job is
+    handed out, and back when it is done, and the file is removed.  At most
+    one job per worker is staged at a time, so the scratch space needed is
+    that of the largest jobs, not of all of them.  The jobs are handed out
+    largest first, by the size of their frames, and each worker takes the
+    next one as soon as it is done, so large and small jobs balance across
+    the workers.  Each job runs on one thread per worker.
+
+    Examples
+    --------
+    >>> import numpy as np
+    >>> from stsci.image import numcombine as nc
+    >>> jobs = [dict(data=np.full((3, 2, 2), v), combination_type='sum')
+    ...         for v in (1., 2.)]
+    >>> [r[0, 0] for r in nc.num_combine_many(jobs, workers=2)]
+    [3.0, 6.0]
+    """
+    jobs = list(jobs)
+    if workers is None:
+        workers = _default_nthreads()
+    workers = max(1, min(workers, len(jobs)))
+    if workers == 1:
+        return [num_combine(**job) for job in jobs]
+
+    if tmpdir is None and os.path.isdir('/dev/shm'):
+        tmpdir = '/dev/shm'
+    # handed out from the end: largest first, to whichever worker is free
+    order = sorted(range(len(jobs)), key=lambda i: _nbytes(jobs[i]['data']))
+    directory = tempfile.mkdtemp(prefix='num_combine_many-', dir=tmpdir)
+    results = [None] * len(jobs)
+    staged = {}
+    done = queue.Queue()
+    pool = multiprocessing.Pool(workers)
+
+    def hand_out():
+        i = order.pop()
+        staged[i] = _Staged(i, jobs[i], directory)
+        pool.apply_async(_run_job, (staged[i].task,), callback=done.put,
+                         error_callback=done.put)
+
+    try:
+        while order and len(staged) < workers:
+            hand_out()
+        while staged:
+            i = done.get()
+            if isinstance(i, BaseException):
+                raise i
+            results[i] = staged.pop(i).finish()
+            if order:
+                hand_out()
+        pool.close()
+    except BaseException:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+        shutil.rmtree(directory, ignore_errors=True)
+    return results
@@ -0,0 +1,170 @@
+import threading
+import tracemalloc
+
+import numpy as np
+import pytest
+
+from stsci.image import StackAccumulator, combine
+
+
+def _frames(n, seed=0):
+    rng = np.random.RandomState(seed)
+    frames = rng.normal(size=(n, 5, 6)).astype(np.float32)
+    masks = rng.uniform(size=frames.shape) < 0.2
+    return frames, masks
+
+
+def test_exact():
+    frames, masks = _frames(40)
+    acc = StackAccumulator(capacity=4)
+    for f, m in zip(frames, masks):
+        acc.add(f, m)
+    good = ~masks
+    count = good.sum(axis=0)
+    total = np.where(good, frames, 0).astype(np.float64).sum(axis=0)
+    assert acc.nframes == 40
+    np.testing.assert_array_equal(acc.result('count'), count)
+    np.testing.assert_allclose(acc.result('sum'), total, rtol=1e-12)
+    np.testing.assert_allclose(acc.result('mean'), total / count,
+                               rtol=1e-12)
+    np.testing.assert_array_equal(
+        acc.result('minimum'), np.where(good, frames, np.inf).min(axis=0))
+    np.testing.assert_array_equal(
+        acc.result('maximum'), np.where(good, frames, -np.inf).max(axis=0))
+
+
+@pytest.mark.parametrize('kind', ['median', 'sigclip_median',
+                                  'madclip_average'])
+def test_robust_exact_within_capacity(kind):
+    frames, masks = _frames(10, 1)
+    acc = StackAccumulator(capacity=10)
+    for f, m in zip(frames, masks):
+        acc.add(f, m)
+    expected = getattr(combine, kind)(frames, badmasks=masks,
+                                      outtype=np.float64)
+    np.testing.assert_array_equal(acc.result(kind), expected)
+
+
+def test_remedian():
+    rng = np.random.RandomState(2)
+    frames = rng.normal(size=(200, 8, 8)) + 10
+    acc = StackAccumulator(capacity=5)
+    for f in frames:
+        acc.add(f)
+    # an estimate, within the scatter of a median of few frames
+    estimate = acc.result('median')
+    # a few levels of five frames, never all 200 frames
+    assert len(acc._levels) == 4
+    assert sum(level.n for level in acc._levels) < 20
+    np.testing.assert_allclose(estimate, np.median(frames, axis=0), atol=0.6)
+    with pytest.raises(ValueError):
+        acc.result('sigclip_median')
+
+
+def _repeated(acc, kind):
+    # the levels combined with every frame repeated as many times as the
+    # number of frames it stands for
+    arrays, masks = [], []
+    for k, level in enumerate(acc._levels):
+        for i in range(level.n):
+            arrays.extend([level.data[i]] * acc.capacity ** k)
+            masks.extend([level.masks[i]] * acc.capacity ** k)
+    kernel_args = acc.kernel_args if kind != 'median' else {}
+    return getattr(combine, kind)(arrays, badmasks=masks,
+                                  outtype=np.float64, **kernel_args)
+
+
+@pytest.mark.parametrize('kind', ['median', 'sigclip_median',
+                                  'sigclip_average', 'madclip_median',
+                                  'madclip_average'])
+def test_weighted_levels(kind):
+    frames, masks = _frames(58, 3)
+    frames[::7, 1] += 20
+    masks[:, 0, 0] = True
+    masks[:3, 0, 1] = False
+    acc = StackAccumulator(capacity=3, robust=kind, lsigma=2, hsigma=2)
+    for f, m in zip(frames, masks):
+        acc.add(f, m)
+    result = acc.result(kind)
+    np.testing.assert_allclose(result, _repeated(acc, kind), rtol=1e-12,
+                               atol=1e-12)
+    assert result[0, 0] == 0
+
+
+def test_result_does_not_grow_with_frames():
+    rng = np.random.RandomState(4)
+    acc = StackAccumulator(capacity=4)
+    for _ in range(4000):
+        acc.add(rng.normal(size=(20, 20)))
+    acc.result('median')
+    tracemalloc.start()
+    try:
+        acc.result('median')
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    # scratch for the at most 4 frames left in each of 6 levels, not for
+    # the 4000 frames they stand for
+    assert len(acc._levels) == 6
+    assert peak < 400 * 20 * 20 * 8
+
+
+def test_reductions_run_on_a_worker():
+    threads = []
+    acc = StackAccumulator(capacity=2)
+    reduce = acc._reduce
+
+    def spy(*args, **kwargs):
+        threads.append(threading.current_thread())
+        return reduce(*args, **kwargs)
+
+    acc._reduce = spy
+    for v in range(9):
+        acc.add(np.full((2, 2), float(v)))
+    acc.result('median')
+    assert threads
+    assert all(t is not threading.current_thread() for t in threads)
+
+    def fail(*args, **kwargs):
+        raise MemoryError
+    acc._reduce = fail
+    for _ in range(2):
+        acc.add(np.ones((2, 2)))
+    with pytest.raises(MemoryError):
+        acc.result('median')
+
+
+def test_fully_masked_pixels():
+    acc = StackAccumulator(capacity=2)
+    masks = np.zeros((2, 2), dtype=bool)
+    masks[0, 0] = True
+    for v in range(5):
+        acc.add(np.full((2, 2), float(v)), masks)
+    assert acc.result('count')[0, 0] == 0
+    assert acc.result('mean')[0, 0] == 0
+    assert acc.result('median')[0, 0] == 0
+    assert acc.result('minimum')[0, 0] == 0
+
+
+def test_no_robust_buffer():
+    acc = StackAccumulator(robust=None)
+    acc.add(np.ones((3, 3)))
+    assert acc._levels == []
+    out = np.empty((3, 3))
+    acc.result('sum', output=out)
+    np.testing.assert_array_equal(out, 1)
+    with pytest.raises(ValueError):
+        acc.result('median')
+
+
+def test_errors():
+    acc = StackAccumulator()
+    with pytest.raises(ValueError):
+        acc.result()
+    acc.add(np.ones((3, 3)))
+    with pytest.raises(ValueError):
+        acc.add(np.ones((3, 4)))
+    with pytest.raises(ValueError):
+        acc.result('mode')
+    with pytest.raises(ValueError):
+        StackAccumulator(robust='mode')
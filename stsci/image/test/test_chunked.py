@@ -0,0 +1,80 @@
+import numpy as np
+import pytest
+
+from stsci.image import chunked_combine, combine
+
+dask = pytest.importorskip('dask')
+da = pytest.importorskip('dask.array')
+
+
+def _stack(depth=9, shape=(20, 31), dtype=np.float32, seed=0):
+    rng = np.random.RandomState(seed)
+    return rng.normal(1000, 30, size=(depth,) + shape).astype(dtype)
+
+
+def _compute(result):
+    return result.compute(scheduler='threads')
+
+
+@pytest.mark.parametrize('kind', ['median', 'average', 'minimum', 'sum',
+                                  'sigclip_median'])
+def test_matches_combine(kind):
+    stack = _stack()
+    masks = np.random.RandomState(1).uniform(size=stack.shape) < 0.3
+    expected = np.empty(stack.shape[1:], dtype=stack.dtype)
+    combine._combine_f(kind, stack, expected, nlow=1, badmasks=masks)
+    result = chunked_combine(da.from_array(stack, chunks=(2, 7, 6)), kind,
+                             nlow=1,
+                             badmasks=da.from_array(masks, chunks=(3, 5, 5)))
+    assert isinstance(result, da.Array)
+    assert result.chunks == ((7, 7, 6), (6, 6, 6, 6, 6, 1))
+    np.testing.assert_array_equal(_compute(result), expected)
+
+
+def test_is_lazy():
+    calls = []
+
+    def frame(i):
+        calls.append(i)
+        return _stack(1, seed=i)[0]
+
+    frames = [da.from_delayed(dask.delayed(frame)(i),
+                              shape=(20, 31), dtype=np.float32)
+              for i in range(4)]
+    result = chunked_combine(frames, 'maximum', outtype=np.float64)
+    assert not calls and result.dtype == np.float64
+    np.testing.assert_array_equal(
+        _compute(result),
+        np.max([_stack(1, seed=i)[0] for i in range(4)], axis=0))
+    assert sorted(calls) == [0, 1, 2, 3]
+
+
+def test_masks_and_weights():
+    stack = _stack(dtype=np.float64)
+    chunks = da.from_array(stack, chunks=(4, 8, 8))
+    bad = np.random.RandomState(2).uniform(size=stack.shape) < 0.3
+    expected = combine.median(stack, badmasks=bad)
+    np.testing.assert_array_equal(
+        _compute(chunked_combine(chunks, badmasks=np.packbits(bad, axis=-1),
+                                 packed_masks=True)), expected)
+    np.testing.assert_array_equal(
+        _compute(chunked_combine(chunks, badmasks=bad.astype(np.uint8) << 3,
+                                 bad_bits=0x8)), expected)
+    weights = np.random.RandomState(3).uniform(0.5, 2, size=stack.shape)
+    np.testing.assert_allclose(
+        _compute(chunked_combine(chunks, 'average', weights=weights)),
+        np.average(stack, axis=0, weights=weights), rtol=1e-12)
+    frame_weights = np.arange(1., 10.)
+    np.testing.assert_allclose(
+        _compute(chunked_combine(chunks, 'average', weights=frame_weights)),
+        np.average(stack, axis=0, weights=frame_weights), rtol=1e-12)
+
+
+def test_errors():
+    stack = da.from_array(_stack(), chunks=(3, 10, 10))
+    with pytest.raises(ValueError):
+        chunked_combine(stack[:, 0, 0])
+    with pytest.raises(ValueError):
+        chunked_combine(stack, badmasks=np.zeros((9, 20, 30), dtype=bool))
+    with pytest.raises(ValueError):
+        chunked_combine(stack, 'average', weights=np.ones((9, 20, 30)))
@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+
+from stsci.image import combine
+from stsci.image.numcombine import num_combine
+
+
+def _reference(values, mad, median, lsigma=3.0, hsigma=3.0, maxiter=5):
+    v = np.sort(values)
+    for _ in range(maxiter):
+        if len(v) < 2:
+            break
+        center = np.median(v)
+        if mad:
+            spread = 1.482602218505602 * np.median(np.abs(v - center))
+        else:
+            spread = v.std()
+        keep = (v >= center - lsigma * spread) & (v <= center + hsigma * spread)
+        if keep.all() or not keep.any():
+            break
+        v = v[keep]
+    return np.median(v) if median else v.mean()
+
+
+@pytest.mark.parametrize('kind', ['sigclip_median', 'sigclip_average',
+                                  'madclip_median', 'madclip_average'])
+def test_clip(kind):
+    rng = np.random.RandomState(0)
+    stack = rng.normal(size=(25, 8, 9))
+    # cosmic rays
+    stack[rng.uniform(size=stack.shape) < 0.05] += 50
+    result = getattr(combine, kind)(stack, lsigma=2.5, hsigma=2.0)
+    mad, median = kind.startswith('mad'), kind.endswith('median')
+    for index in np.ndindex(*result.shape):
+        expected = _reference(stack[(slice(None),) + index], mad, median,
+                              2.5, 2.0)
+        assert np.isclose(result[index], expected, rtol=1e-12, atol=1e-12)
+    assert np.abs(result).max() < 2
+
+
+def test_unclipped_matches_plain_combiners():
+    rng = np.random.RandomState(1)
+    stack = rng.normal(size=(16, 5, 6))
+    masks = rng.uniform(size=stack.shape) < 0.2
+    kw = dict(nlow=2, nhigh=1, badmasks=masks)
+    np.testing.assert_array_equal(
+        combine.sigclip_average(stack, lsigma=np.inf, hsigma=np.inf, **kw),
+        combine.average(stack, **kw))
+    np.testing.assert_array_equal(
+        combine.madclip_median(stack, maxiter=0, **kw),
+        combine.median(stack, **kw))
+
+
+def test_num_combine_clip_types():
+    stack = np.ones((9, 4, 4), dtype=np.float32)
+    stack[3] = 1000
+    for kind in ('sigclip_median', 'sigclip_mean', 'madclip_median',
+                 'madclip_mean'):
+        np.testing.assert_array_equal(
+            num_combine(stack, combination_type=kind), 1)
+
+
+def test_negative_sigma():
+    with pytest.raises(ValueError):
+        combine.sigclip_median(np.ones((3, 2, 2)), lsigma=-1)
@@ -0,0 +1,77 @@
+import numpy as np
+import pytest
+
+from stsci.image import combine
+
+
+def _cube(dtype=np.float32, shape=(7, 13, 17), seed=0):
+    rng = np.random.RandomState(seed)
+    return rng.normal(1000, 30, size=shape).astype(dtype)
+
+
+@pytest.mark.parametrize('kind', ['median', 'imedian', 'average', 'minimum',
+                                  'sigclip_median', 'madclip_average'])
+def test_cube_matches_list(kind):
+    cube = _cube()
+    masks = np.random.RandomState(1).uniform(size=cube.shape) < 0.2
+    func = getattr(combine, kind)
+    expected = func(list(cube), badmasks=list(masks))
+    np.testing.assert_array_equal(func(cube, badmasks=masks), expected)
+    np.testing.assert_array_equal(func(cube, badmasks=list(masks)), expected)
+    np.testing.assert_array_equal(func(list(cube), badmasks=masks), expected)
+
+
+@pytest.mark.parametrize('dtype', [np.int16, np.uint16, np.int32, np.float64,
+                                   np.dtype('>f4')])
+def test_cube_types(dtype):
+    cube = _cube(dtype)
+    np.testing.assert_array_equal(combine.median(cube, nlow=1, nhigh=2),
+                                  combine.median(list(cube), nlow=1, nhigh=2))
+
+
+def test_strided_cubes():
+    cube = _cube(shape=(20, 9, 6))
+    expected = combine.average(list(cube[::2, :, ::-1]), nlow=1)
+    np.testing.assert_array_equal(
+        combine.average(cube[::2, :, ::-1], nlow=1), expected)
+    # frames along the last axis of the data
+    frames = np.ascontiguousarray(cube.transpose(1, 2, 0))
+    np.testing.assert_array_equal(
+        combine.median(frames.transpose(2, 0, 1)), combine.median(cube))
+
+
+def test_flag_cubes():
+    cube = _cube()
+    rng = np.random.RandomState(2)
+    dq = rng.randint(0, 64, size=cube.shape).astype(np.uint16)
+    expected = combine.average(list(cube), badmasks=list(dq), bad_bits=0x21)
+    np.testing.assert_array_equal(
+        combine.average(cube, badmasks=dq, bad_bits=0x21), expected)
+    bad = rng.uniform(size=cube.shape) < 0.3
+    packed = np.packbits(bad, axis=-1)
+    np.testing.assert_array_equal(
+        combine.median(cube, badmasks=packed, packed_masks=True),
+        combine.median(cube, badmasks=bad))
+
+
+def test_cube_stats_and_shifts():
+    cube = _cube(np.float64, (5, 11, 12))
+    expected = combine.combine_stats(list(cube), nlow=1)
+    result = combine.combine_stats(cube, nlow=1)
+    for name in expected:
+        np.testing.assert_array_equal(result[name], expected[name])
+    offsets = np.random.RandomState(3).uniform(-2, 2, size=(5, 2))
+    np.testing.assert_array_equal(
+        combine.shift_and_combine(cube, offsets),
+        combine.shift_and_combine(list(cube), offsets))
+
+
+def test_cube_errors():
+    cube = _cube()
+    with pytest.raises(ValueError):
+        combine.median(cube, badmasks=np.zeros(cube.shape[:2], dtype=bool))
+    with pytest.raises(ValueError):
+        combine.median(cube, badmasks=np.zeros((6,) + cube.shape[1:],
+                                               dtype=bool))
+    with pytest.raises(ValueError):
+        combine.median(cube, output=np.empty(cube.shape[1:][::-1]))
@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+
+from stsci.image import combine
+
+
+@pytest.fixture
+def stack():
+    rng = np.random.RandomState(0)
+    return rng.uniform(0, 250, size=(9, 20, 30)).round()
+
+
+@pytest.mark.parametrize('dtype', ['int16', 'uint16', 'int32', 'int64',
+                                   'float32', 'float64', '>f4', 'uint8'])
+@pytest.mark.parametrize('kind', ['median', 'average', 'minimum'])
+def test_input_types(stack, dtype, kind):
+    f = getattr(combine, kind)
+    frames = [a.astype(dtype) for a in stack]
+    expected = f(list(stack), outtype=np.float64, nlow=1, nhigh=2)
+    result = f(frames, outtype=np.float64, nlow=1, nhigh=2)
+    np.testing.assert_array_equal(result, expected)
+
+
+@pytest.mark.parametrize('outtype', ['int16', 'uint16', 'int32', 'float32',
+                                     'float64', 'int8', '>f8'])
+def test_output_types(stack, outtype):
+    expected = combine.average(stack, outtype=np.float64)
+    if np.dtype(outtype).kind in 'iu':
+        # integer outputs saturate rather than wrap
+        info = np.iinfo(outtype)
+        expected = np.clip(expected, info.min, info.max)
+    expected = expected.astype(outtype)
+    result = combine.average(stack.astype(np.float32), outtype=outtype)
+    assert result.dtype == np.dtype(outtype)
+    np.testing.assert_array_equal(result, expected)
+
+    output = np.zeros(stack.shape[2:0:-1], dtype=outtype).T
+    combine.average(stack.astype(np.float32), output=output)
+    np.testing.assert_array_equal(output, expected)
+
+
+def test_strided_readonly_inputs(stack):
+    expected = combine.median(stack[:, ::2, ::3].copy())
+    frames = stack.astype(np.float32)
+    frames.flags.writeable = False
+    result = combine.median(frames[:, ::2, ::3], outtype=np.float64)
+    np.testing.assert_array_equal(result, expected)
+
+
+def test_bool_and_byte_masks(stack):
+    masks = np.random.RandomState(1).uniform(size=stack.shape) < 0.4
+    expected = combine.median(stack, badmasks=masks)
+    for m in (masks.astype(np.uint8), masks.view(np.int8),
+              np.asfortranarray(masks)):
+        np.testing.assert_array_equal(
+            combine.median(stack, badmasks=m), expected)
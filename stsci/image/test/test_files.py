@@ -0,0 +1,100 @@
+import numpy as np
+import pytest
+
+from stsci.image import combine, combine_files
+
+
+def _stack(depth=5, shape=(23, 17), dtype=np.float32, seed=0):
+    rng = np.random.RandomState(seed)
+    return rng.normal(1000, 30, size=(depth,) + shape).astype(dtype)
+
+
+def _save(tmpdir, stack):
+    paths = []
+    for i, frame in enumerate(stack):
+        paths.append(str(tmpdir.join('%d.npy' % i)))
+        np.save(paths[-1], frame)
+    return paths
+
+
+@pytest.mark.parametrize('block_rows', [1, 4, 100])
+def test_npy(tmpdir, block_rows):
+    stack = _stack()
+    paths = _save(tmpdir, stack)
+    expected = combine.median(stack, nlow=1)
+    np.testing.assert_array_equal(
+        combine_files(paths, nlow=1, block_rows=block_rows), expected)
+    output = str(tmpdir.join('out.npy'))
+    assert combine_files(paths, output, nlow=1, block_rows=block_rows) is None
+    np.testing.assert_array_equal(np.load(output), expected)
+
+
+def test_options(tmpdir):
+    stack = _stack()
+    paths = _save(tmpdir, stack)
+    weights = [1., 2., 3., 4., 5.]
+    np.testing.assert_array_equal(
+        combine_files(paths, kind='average', weights=weights,
+                      outtype=np.float64, max_memory=1),
+        combine.average(stack, weights=weights, outtype=np.float64))
+    output = str(tmpdir.join('out.npy'))
+    combine_files(paths, output, kind='minimum')
+    with pytest.raises(OSError):
+        combine_files(paths, output)
+    combine_files(paths, output, kind='maximum', overwrite=True)
+    np.testing.assert_array_equal(np.load(output), stack.max(axis=0))
+
+
+def test_errors(tmpdir):
+    paths = _save(tmpdir, _stack())
+    np.save(str(tmpdir.join('small.npy')), np.zeros((23, 16)))
+    with pytest.raises(ValueError):
+        combine_files(paths + [str(tmpdir.join('small.npy'))])
+    with pytest.raises(ValueError):
+        combine_files(paths, weights=list(_stack()))
+    with pytest.raises(ValueError):
+        combine_files([])
+    output = tmpdir.join('out.npy')
+    with pytest.raises(ValueError):
+        combine_files(paths, str(output), kind='mode')
+    assert not output.check()
+
+
+@pytest.mark.parametrize('dtype', [np.uint16, np.int16, np.float32])
+def test_fits(tmpdir, dtype):
+    fits = pytest.importorskip('astropy.io.fits')
+    stack = _stack(dtype=dtype)
+    dq = (np.random.RandomState(1).uniform(size=stack.shape) < 0.3) * 0x84
+    paths = []
+    for i, (frame, flags) in enumerate(zip(stack, dq.astype(np.int16))):
+        paths.append(str(tmpdir.join('%d.fits' % i)))
+        fits.HDUList([fits.PrimaryHDU(),
+                      fits.ImageHDU(frame, name='SCI'),
+                      fits.ImageHDU(flags, name='DQ')]).writeto(paths[-1])
+    expected = combine.median(stack, badmasks=dq, bad_bits=0x4)
+    output = str(tmpdir.join('out.fits'))
+    combine_files(paths, output, ext='SCI', mask_ext='DQ', bad_bits=0x4,
+                  block_rows=5)
+    with fits.open(output) as hdul:
+        assert hdul[0].header['NCOMBINE'] == len(paths)
+        assert hdul[0].data.dtype.type == dtype
+        np.testing.assert_array_equal(hdul[0].data, expected)
+    np.testing.assert_array_equal(
+        combine_files(paths, ext=('SCI', 1), mask_ext='DQ', bad_bits=0x4,
+                      max_memory=1000),
+        expected)
+
+
+def test_scaled_fits(tmpdir):
+    fits = pytest.importorskip('astropy.io.fits')
+    stack = _stack()
+    paths = []
+    for i, frame in enumerate(stack):
+        hdu = fits.PrimaryHDU(frame)
+        hdu.scale('int16', bscale=0.05, bzero=1000)
+        paths.append(str(tmpdir.join('%d.fits' % i)))
+        hdu.writeto(paths[-1])
+    scaled = np.array([fits.getdata(path) for path in paths])
+    result = combine_files(paths, kind='average', block_rows=3)
+    assert result.dtype == scaled.dtype
+    np.testing.assert_array_equal(result, combine.average(scaled))
@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+
+from stsci.image import combine, numcombine, tiled_combine
+
+KERNELS = ['median', 'imedian', 'average', 'iaverage', 'minimum',
+           'sigclip_median', 'madclip_average']
+
+LIMITS = [(10, None), (None, 40), (10, 40), (45, 5)]
+
+
+@pytest.mark.parametrize('kind', KERNELS)
+@pytest.mark.parametrize('limits', LIMITS)
+@pytest.mark.parametrize('dtype', [np.int16, np.float32])
+def test_matches_threshhold_masks(kind, limits, dtype):
+    rng = np.random.RandomState(0)
+    stack = rng.randint(0, 50, size=(7, 6, 9)).astype(dtype)
+    low, high = limits
+    f = getattr(combine, kind)
+    expected = f(stack, badmasks=combine.threshhold(stack, low, high),
+                 nlow=1)
+    result = f(stack, low=low, high=high, nlow=1)
+    np.testing.assert_array_equal(result, expected)
+
+
+@pytest.mark.parametrize('kind', KERNELS)
+def test_with_badmasks(kind):
+    rng = np.random.RandomState(1)
+    stack = rng.normal(size=(9, 5, 8))
+    masks = rng.uniform(size=stack.shape) < 0.3
+    f = getattr(combine, kind)
+    expected = f(stack, badmasks=masks | combine.threshhold(stack, -1, 1))
+    result = f(stack, badmasks=masks, low=-1, high=1)
+    np.testing.assert_array_equal(result, expected)
+
+
+def test_num_combine():
+    rng = np.random.RandomState(2)
+    data = rng.normal(size=(6, 10, 10)).astype(np.float32)
+    masks = rng.uniform(size=data.shape) < 0.2
+    kept = masks.copy()
+    for kind in ['median', 'imedian', 'iaverage', 'mean', 'minimum',
+                 'sigclip_mean']:
+        result = numcombine.num_combine(data, masks=masks,
+                                        combination_type=kind, lower=-1.5,
+                                        upper=1.2)
+        expected = numcombine.num_combine(
+            data, masks=masks | combine.threshhold(data, -1.5, 1.2),
+            combination_type=kind)
+        np.testing.assert_array_equal(result, expected)
+    np.testing.assert_array_equal(masks, kept)
+
+
+def test_tiled():
+    rng = np.random.RandomState(3)
+    stack = rng.normal(size=(5, 12, 7))
+    expected = combine.median(stack, low=-1, high=1.5)
+    result = tiled_combine(list(stack), 'median', low=-1, high=1.5,
+                           max_memory=3000)
+    np.testing.assert_array_equal(result, expected)
+
+
+def test_errors():
+    stack = np.ones((3, 4, 4))
+    with pytest.raises(TypeError):
+        combine.median(stack, low='x')
+    with pytest.raises(ValueError):
+        combine.shift_and_combine(stack, np.zeros((3, 2)), high=2)
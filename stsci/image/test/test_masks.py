@@ -0,0 +1,91 @@
+import numpy as np
+import pytest
+
+from stsci.image import combine, tiled_combine
+
+
+def _stack(seed, shape=(7, 6, 13)):
+    rng = np.random.RandomState(seed)
+    return rng.normal(size=shape), rng
+
+
+@pytest.mark.parametrize('dtype', [np.uint8, np.int16, np.uint16, np.int32,
+                                   np.uint32, np.int64])
+def test_dq_flags(dtype):
+    stack, rng = _stack(0)
+    dq = rng.randint(0, 128, size=stack.shape).astype(dtype)
+    dq[rng.uniform(size=stack.shape) < 0.5] = 0
+    bad_bits = 4 | 32
+    expected = combine.median(stack, badmasks=(dq & bad_bits) != 0)
+    result = combine.median(stack, badmasks=dq, bad_bits=bad_bits)
+    np.testing.assert_array_equal(result, expected)
+    # without bad_bits any nonzero flag is bad
+    np.testing.assert_array_equal(combine.median(stack, badmasks=dq),
+                                  combine.median(stack, badmasks=dq != 0))
+
+
+def test_high_and_mixed_flags():
+    stack, rng = _stack(1)
+    dq = rng.randint(0, 2, size=stack.shape).astype(np.uint16) << 12
+    expected = combine.average(stack, badmasks=dq != 0)
+    np.testing.assert_array_equal(
+        combine.average(stack, badmasks=dq, bad_bits=1 << 12), expected)
+    assert not (combine.average(stack, badmasks=dq, bad_bits=1) -
+                combine.average(stack)).any()
+    # frames of different flag types are read at the widest size
+    mixed = [(d != 0).astype(np.uint8) if i % 2 else d.astype(np.uint32)
+             for i, d in enumerate(dq)]
+    np.testing.assert_array_equal(combine.average(stack, badmasks=mixed),
+                                  expected)
+
+
+@pytest.mark.parametrize('cols', [1, 7, 8, 13, 24])
+def test_packed(cols):
+    stack, rng = _stack(cols, (5, 4, cols))
+    masks = rng.uniform(size=stack.shape) < 0.3
+    packed = np.packbits(masks, axis=-1)
+    for kind in ['median', 'iaverage', 'sigclip_average']:
+        f = getattr(combine, kind)
+        np.testing.assert_array_equal(
+            f(stack, badmasks=packed, packed_masks=True),
+            f(stack, badmasks=masks))
+    np.testing.assert_array_equal(
+        combine.median(stack, badmasks=combine.threshhold(
+            stack, -1, 1, packed=True), packed_masks=True),
+        combine.median(stack, low=-1, high=1))
+
+
+def test_other_entry_points():
+    stack, rng = _stack(2, (6, 12, 20))
+    dq = (rng.uniform(size=stack.shape) < 0.2).astype(np.uint16) * 8
+    bad = dq != 0
+    stats = combine.combine_stats(stack, ('median', 'count'), badmasks=dq,
+                                  bad_bits=8)
+    expected = combine.combine_stats(stack, ('median', 'count'),
+                                     badmasks=bad)
+    for name in stats:
+        np.testing.assert_array_equal(stats[name], expected[name])
+    packed = np.packbits(bad, axis=-1)
+    np.testing.assert_array_equal(
+        tiled_combine(list(stack), 'median', badmasks=list(packed),
+                      packed_masks=True, max_memory=2000),
+        combine.median(stack, badmasks=bad))
+    offsets = rng.uniform(-1, 1, size=(6, 2))
+    np.testing.assert_array_equal(
+        combine.shift_and_combine(stack, offsets, badmasks=dq, bad_bits=8),
+        combine.shift_and_combine(stack, offsets, badmasks=bad))
+
+
+def test_errors():
+    stack = np.zeros((2, 3, 9))
+    with pytest.raises(ValueError):
+        combine.median(stack, badmasks=np.zeros((2, 3, 1), np.uint8),
+                       packed_masks=True)
+    with pytest.raises(ValueError):
+        combine.median(stack, badmasks=np.zeros((2, 3, 2), np.uint8),
+                       packed_masks=True, bad_bits=1)
+    with pytest.raises(ValueError):
+        combine.median(stack, badmasks=np.zeros((2, 3, 8), np.uint16),
+                       bad_bits=1)
+    with pytest.raises(TypeError):
+        combine.median(stack, badmasks=np.zeros(stack.shape))
@@ -0,0 +1,40 @@
+import numpy as np
+import pytest
+
+from stsci.image import combine
+
+
+# The kernels start a thread for every 65536 input values at most, so the
+# stack has over 64 times that many; its 1025 output rows are split unevenly
+# among 3, 7 and 64 threads.
+SHAPE = (16, 5, 205, 256)
+
+
+@pytest.fixture(scope='module')
+def stack():
+    rng = np.random.RandomState(0)
+    return rng.normal(size=SHAPE).astype(np.float32)
+
+
+@pytest.mark.parametrize('kind',
+                         ['median', 'imedian', 'average', 'iaverage',
+                          'minimum'])
+def test_threads_match_serial(stack, kind):
+    f = getattr(combine, kind)
+    masks = np.random.RandomState(1).uniform(size=stack.shape) < 0.9
+    serial = f(stack, nlow=2, nhigh=3, badmasks=masks, nthreads=1)
+    for nthreads in (2, 3, 7, 64):
+        threaded = f(stack, nlow=2, nhigh=3, badmasks=masks,
+                     nthreads=nthreads)
+        np.testing.assert_array_equal(threaded, serial)
+
+
+def test_default_nthreads(stack):
+    assert combine._default_nthreads() >= 1
+    np.testing.assert_array_equal(combine.median(stack),
+                                  combine.median(stack, nthreads=1))
+
+
+def test_mask_shape_mismatch(stack):
+    with pytest.raises(ValueError):
+        combine.median(stack, badmasks=np.zeros(SHAPE[:-1], dtype=bool))
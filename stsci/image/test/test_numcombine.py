@@ -0,0 +1,163 @@
+import os
+import tracemalloc
+import warnings
+
+import numpy as np
+import pytest
+
+from stsci.image import numcombine
+
+
+def _frames(depth=6, shape=(20, 30), seed=0):
+    rng = np.random.RandomState(seed)
+    return [rng.normal(100, 10, size=shape).astype(np.float32)
+            for _ in range(depth)]
+
+
+@pytest.mark.parametrize('kind', ['median', 'mean', 'sum', 'minimum',
+                                  'sigclip_mean'])
+def test_lists_match_cubes(kind):
+    frames = _frames()
+    masks = [m < 0.2 for m in np.random.RandomState(1).uniform(
+        size=(6, 20, 30))]
+    expected = numcombine.num_combine(np.array(frames), np.array(masks),
+                                      combination_type=kind, nlow=1)
+    result = numcombine.num_combine(frames, masks, combination_type=kind,
+                                    nlow=1)
+    assert result.dtype == np.float32
+    np.testing.assert_array_equal(result, expected)
+
+
+def test_memmaps(tmpdir):
+    frames = _frames()
+    files = []
+    for i, frame in enumerate(frames):
+        m = np.lib.format.open_memmap(str(tmpdir.join('%d.npy' % i)),
+                                      mode='w+', dtype=frame.dtype,
+                                      shape=frame.shape)
+        m[...] = frame
+        files.append(m)
+    result = numcombine.num_combine(files, combination_type='median')
+    assert type(result) is np.ndarray
+    np.testing.assert_array_equal(
+        result, numcombine.num_combine(frames, combination_type='median'))
+
+
+def test_no_stack_is_built():
+    frames = _frames(40, (100, 100))
+    numcombine.num_combine(frames, combination_type='median')
+    tracemalloc.start()
+    try:
+        numcombine.num_combine(frames, combination_type='median')
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    # far less than the 1.6 MB of a cube of the frames
+    assert peak < 4 * frames[0].nbytes
+
+
+def test_shapes_are_checked():
+    frames = _frames()
+    with pytest.raises(ValueError):
+        numcombine.num_combine(frames + [np.zeros((20, 31))])
+    with pytest.raises(ValueError):
+        numcombine.num_combine(frames, [np.zeros((20, 31), dtype=bool)] * 6)
+    with pytest.raises(ValueError):
+        numcombine.num_combine(frames, nlow=3, nhigh=3)
+
+
+def test_numCombine_leaves_lists_alone():
+    frames = [f.tolist() for f in _frames(3, (4, 5))]
+    masks = [[[False] * 5] * 4] * 3
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', DeprecationWarning)
+        c = numcombine.numCombine(frames, masks, combinationType='mean')
+    assert all(isinstance(f, list) for f in frames)
+    assert all(isinstance(m, list) for m in masks)
+    np.testing.assert_allclose(c.combArrObj, np.mean(frames, axis=0),
+                               rtol=1e-12)
+
+
+def test_num_combine_many(tmpdir):
+    rng = np.random.RandomState(2)
+    memmap = np.lib.format.open_memmap(str(tmpdir.join('cube.npy')),
+                                       mode='w+', dtype=np.int16,
+                                       shape=(5, 8, 9))
+    memmap[...] = rng.randint(0, 1000, size=memmap.shape)
+    jobs = [
+        dict(data=rng.normal(size=(7, 30, 20)), combination_type='median',
+             nlow=1),
+        dict(data=_frames(4, (5, 6)), masks=rng.uniform(size=(4, 5, 6)) < .3,
+             combination_type='nanmean'),
+        dict(data=memmap, combination_type='sum'),
+        dict(data=_frames(3, (2, 2)), combination_type='maximum'),
+    ]
+    scratch = tmpdir.mkdir('scratch')
+    results = numcombine.num_combine_many(jobs, workers=2,
+                                          tmpdir=str(scratch))
+    assert len(results) == len(jobs)
+    for job, result in zip(jobs, results):
+        expected = numcombine.num_combine(**job)
+        assert type(result) is np.ndarray and result.dtype == expected.dtype
+        np.testing.assert_array_equal(result, expected)
+    assert not scratch.listdir()
+    serial = numcombine.num_combine_many(jobs, workers=1)
+    for a, b in zip(serial, results):
+        np.testing.assert_array_equal(a, b)
+
+
+def test_num_combine_many_shares_memmaps(tmpdir):
+    path = str(tmpdir.join('cube.npy'))
+    memmap = np.lib.format.open_memmap(path, mode='w+', dtype=np.float32,
+                                       shape=(3, 4, 5))
+    shared = numcombine._share(memmap, str(tmpdir), 'unused')
+    assert shared.filename == path and shared.offset == memmap.offset
+    assert not tmpdir.join('unused').check()
+
+
+def test_num_combine_many_errors(tmpdir):
+    jobs = [dict(data=_frames(3, (4, 4))),
+            dict(data=_frames(2, (4, 4)), nlow=1, nhigh=1)]
+    with pytest.raises(ValueError):
+        numcombine.num_combine_many(jobs, workers=2, tmpdir=str(tmpdir))
+    assert not tmpdir.listdir()
+
+
+def test_num_combine_many_outputs(tmpdir):
+    rng = np.random.RandomState(3)
+    cubes = [rng.normal(size=(5, 6, 7)) for _ in range(3)]
+    mapped = np.lib.format.open_memmap(str(tmpdir.join('out.npy')),
+                                       mode='w+', dtype=np.float32,
+                                       shape=(6, 7))
+    private = np.empty((6, 7), dtype=np.float32)
+    jobs = [dict(data=cubes[0], output=mapped),
+            dict(data=cubes[1], output=private, combination_type='mean'),
+            dict(data=cubes[2])]
+    scratch = tmpdir.mkdir('scratch')
+    results = numcombine.num_combine_many(jobs, workers=2,
+                                          tmpdir=str(scratch))
+    assert results[0] is mapped and results[1] is private
+    for job, result in zip(jobs, results):
+        expected = numcombine.num_combine(**dict(job, output=None))
+        np.testing.assert_allclose(result, expected, rtol=1e-6)
+    np.testing.assert_allclose(np.load(str(tmpdir.join('out.npy'))),
+                               results[0])
+    assert not scratch.listdir()
+
+
+def test_num_combine_many_stages_per_worker(tmpdir, monkeypatch):
+    staged = []
+    base = numcombine._Staged
+
+    class Staged(base):
+        def __init__(self, index, job, directory):
+            base.__init__(self, index, job, directory)
+            staged.append(len(os.listdir(directory)))
+
+    monkeypatch.setattr(numcombine, '_Staged', Staged)
+    jobs = [dict(data=np.full((3, 4, 4), float(i))) for i in range(8)]
+    results = numcombine.num_combine_many(jobs, workers=2,
+                                          tmpdir=str(tmpdir))
+    assert [r[0, 0] for r in results] == list(range(8))
+    # the frames and output of at most two jobs at a time
+    assert len(staged) == 8 and max(staged) <= 4
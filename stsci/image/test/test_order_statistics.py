@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+
+from stsci.image import combine
+
+
+def _reference(kind, stack, masks, nlow, nhigh):
+    """Fully sort every pixel stack, as the combiners used to."""
+    out = np.zeros(stack.shape[1:])
+    for index in np.ndindex(*out.shape):
+        values = stack[(slice(None),) + index]
+        if masks is not None:
+            values = values[~masks[(slice(None),) + index]]
+        values = np.sort(values)
+        n = len(values)
+        lo, hi = nlow, nhigh
+        if kind == 'median':
+            if n > 0:
+                while lo + hi >= n:
+                    hi, lo = max(hi - 1, 0), max(lo - 1, 0)
+                m = n - lo - hi
+                mid = m // 2 + lo
+                if m % 2:
+                    out[index] = values[mid]
+                else:
+                    out[index] = (values[mid] + values[mid - 1]) / 2.0
+        elif kind == 'average':
+            m = n - lo - hi
+            if m > 0:
+                # np.add.accumulate sums strictly left to right
+                out[index] = np.add.accumulate(values[lo:lo + m])[-1] / m
+            elif n == len(stack):
+                out[index] = values[-1]
+        elif kind == 'minimum':
+            if n - lo - hi > 0:
+                out[index] = values[lo]
+    return out
+
+
+@pytest.mark.parametrize('kind', ['median', 'average', 'minimum'])
+@pytest.mark.parametrize('n', [1, 2, 3, 4, 5, 6, 7, 8, 9, 16, 17, 64, 257])
+def test_matches_full_sort(kind, n):
+    rng = np.random.RandomState(n)
+    stack = rng.normal(size=(n, 4, 5))
+    # repeated values exercise the partitioning with ties
+    stack[:, 0] = rng.randint(0, 3, size=(n, 5))
+    masks = rng.uniform(size=stack.shape) < 0.3
+    for nlow, nhigh in [(0, 0), (1, 0), (0, 1), (n // 3, n // 4), (n, n)]:
+        for m in (None, masks):
+            result = getattr(combine, kind)(stack, nlow=nlow, nhigh=nhigh,
+                                            badmasks=m)
+            expected = _reference(kind, stack, m, nlow, nhigh)
+            np.testing.assert_array_equal(result, expected)
+
+
+@pytest.mark.parametrize('n', [63, 64, 65, 1801, 2500])
+def test_deep_stacks(n):
+    rng = np.random.RandomState(n)
+    stack = rng.normal(size=(n, 3, 4))
+    masks = rng.uniform(size=stack.shape) < 0.2
+    for kind in ('median', 'average', 'minimum'):
+        result = getattr(combine, kind)(stack, nlow=3, nhigh=5,
+                                        badmasks=masks, nthreads=2)
+        expected = _reference(kind, stack, masks, 3, 5)
+        np.testing.assert_array_equal(result, expected)
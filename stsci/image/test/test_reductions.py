@@ -0,0 +1,114 @@
+import numpy as np
+import pytest
+
+from stsci.image import combine, numcombine, tiled_combine
+
+
+def _stack(depth=9, shape=(6, 7), seed=0):
+    rng = np.random.RandomState(seed)
+    return rng.normal(100, 10, size=(depth,) + shape)
+
+
+def _kept(stack, masks, nlow, nhigh):
+    """The values of every pixel stack left after masking and rejecting
+    the nlow lowest and nhigh highest, NaN elsewhere."""
+    values = np.sort(np.where(masks, np.inf, stack), axis=0)
+    good = (~masks).sum(axis=0)
+    rank = np.arange(len(stack))[:, None, None]
+    keep = (rank >= nlow) & (rank < good - nhigh)
+    return np.where(keep, values, np.nan)
+
+
+@pytest.mark.parametrize('depth', [9, 30])
+@pytest.mark.parametrize('nlow, nhigh', [(0, 0), (1, 0), (0, 2), (2, 1)])
+def test_sum_and_maximum(depth, nlow, nhigh):
+    stack = _stack(depth)
+    masks = np.random.RandomState(1).uniform(size=stack.shape) < 0.2
+    kept = _kept(stack, masks, nlow, nhigh)
+    none = np.isnan(kept).all(axis=0)
+    out = np.empty(stack.shape[1:])
+    combine._combine_f('sum', stack, out, nlow=nlow, nhigh=nhigh,
+                       badmasks=masks)
+    np.testing.assert_allclose(out, np.nansum(kept, axis=0), rtol=1e-12)
+    result = combine.maximum(stack, nlow=nlow, nhigh=nhigh, badmasks=masks)
+    expected = np.where(none, 0, np.nanmax(np.where(none, 0, kept), axis=0))
+    np.testing.assert_array_equal(result, expected)
+
+
+@pytest.mark.parametrize('depth', [12, 30])
+@pytest.mark.parametrize('kind, reduce', [
+    ('median', np.nanmedian), ('average', np.nanmean),
+    ('minimum', np.nanmin), ('maximum', np.nanmax), ('sum', np.nansum)])
+def test_nan_kinds(kind, reduce, depth):
+    stack = _stack(depth)
+    rng = np.random.RandomState(2)
+    stack[rng.uniform(size=stack.shape) < 0.3] = np.nan
+    stack[:, 0, 0] = np.nan
+    out = np.empty(stack.shape[1:])
+    combine._combine_f('nan' + kind, stack, out)
+    np.testing.assert_allclose(out[1:], reduce(stack[:, 1:], axis=0),
+                               rtol=1e-12)
+    assert out[0, 0] == 0
+
+
+def test_nan_fill_and_weights():
+    stack = _stack(4, (1, 3))
+    stack[:, 0, 0] = [np.nan, 0, np.nan, 5]
+    stack[:, 0, 1] = np.nan
+    masks = np.ones(stack.shape, dtype=bool)
+    out = np.empty(stack.shape[1:])
+    combine._combine_f('nanimedian', stack, out, badmasks=masks)
+    assert out[0, 0] == 5 and out[0, 1] == 0
+    weights = np.arange(1., 5.)
+    stack[1, 0, 2] = np.nan
+    combine._combine_f('nanaverage', stack, out, frame_weights=weights)
+    good = np.array([0, 2, 3])
+    np.testing.assert_allclose(
+        out[0, 2], np.average(stack[good, 0, 2], weights=weights[good]))
+
+
+def test_num_combine():
+    stack = _stack(8).astype(np.float32)
+    masks = np.random.RandomState(3).uniform(size=stack.shape) < 0.25
+    expected = np.where(masks, 0, stack.astype(np.float64)).sum(axis=0)
+    np.testing.assert_allclose(
+        numcombine.num_combine(stack, masks, combination_type='sum'),
+        expected.astype(np.float32), rtol=1e-6)
+    np.testing.assert_array_equal(
+        numcombine.num_combine(stack, combination_type='maximum', nhigh=1),
+        np.sort(stack, axis=0)[-2])
+    stack[0, :3] = np.nan
+    np.testing.assert_allclose(
+        numcombine.num_combine(stack, combination_type='nanmean'),
+        np.nanmean(stack.astype(np.float64), axis=0).astype(np.float32),
+        rtol=1e-6)
+    np.testing.assert_array_equal(
+        numcombine.num_combine(stack, combination_type='NaNsigclip_median'),
+        combine.sigclip_median(np.where(np.isnan(stack), 0, stack),
+                               badmasks=np.isnan(stack)))
+
+
+def test_tiled_kinds():
+    stack = _stack(5)
+    stack[2, 1] = np.nan
+    np.testing.assert_allclose(tiled_combine(list(stack), kind='nansum',
+                                             max_memory=1),
+                               np.nansum(stack, axis=0), rtol=1e-12)
+
+
+@pytest.mark.parametrize('dtype', [np.int8, np.uint8, np.int16, np.uint16,
+                                   np.int32, np.int64])
+def test_integer_outputs_saturate(dtype):
+    info = np.iinfo(dtype)
+    stack = _stack(5, (2, 3))
+    # truncated like numpy's casts, out of range values and NaN saturate
+    stack[:, 0] = [[-2.7, 2.7, 0.5], [-1e30, 1e30, -0.5], [0, 0, 0],
+                   [1, 2, 3], [4, 5, 6]]
+    stack[:, 1, 0] = np.nan
+    out = np.empty(stack.shape[1:], dtype=dtype)
+    combine._combine_f('minimum', stack, out)
+    expected = np.clip(np.trunc(stack.min(axis=0)), info.min, info.max)
+    expected[1, 0] = 0
+    np.testing.assert_array_equal(out, expected)
+    combine._combine_f('average', stack, out)
+    assert out[1, 0] == 0
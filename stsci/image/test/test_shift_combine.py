@@ -0,0 +1,101 @@
+import numpy as np
+import pytest
+
+from stsci.image import combine, translate, translate_stack
+
+
+def _registered(stack, offsets, masks=None):
+    """The shifted frames and the masks of their good samples."""
+    frames, good = [], []
+    ones = np.ones(stack.shape[1:])
+    for i, (dx, dy) in enumerate(offsets):
+        frames.append(translate(stack[i], dx, dy, mode='constant'))
+        # a sample is good when every input pixel it draws on is
+        bad = ones if masks is None else 1.0 - masks[i]
+        weight = translate(bad.astype(np.float64), dx, dy, mode='constant')
+        good.append(weight > 1 - 1e-9)
+    return np.array(frames), np.array(good)
+
+
+def _reference(frames, good, reduce):
+    out = np.zeros(frames.shape[1:])
+    for index in np.ndindex(*out.shape):
+        values = frames[(slice(None),) + index][good[(slice(None),) + index]]
+        if len(values):
+            out[index] = reduce(values)
+    return out
+
+
+@pytest.mark.parametrize('dtype', [np.float32, np.int16, np.float64])
+def test_median(dtype):
+    rng = np.random.RandomState(0)
+    stack = (rng.uniform(0, 100, size=(5, 17, 23))).astype(dtype)
+    offsets = rng.uniform(-3, 3, size=(5, 2))
+    result = combine.shift_and_combine(stack, offsets)
+    frames, good = _registered(stack.astype(np.float64), offsets)
+    np.testing.assert_allclose(result, _reference(frames, good, np.median),
+                               rtol=1e-12)
+
+
+def test_interior_matches_translate_stack():
+    rng = np.random.RandomState(1)
+    stack = rng.normal(size=(7, 20, 30))
+    offsets = rng.uniform(-2, 2, size=(7, 2))
+    shifted = translate_stack(stack, offsets[:, 0], offsets[:, 1])
+    result = combine.shift_and_combine(stack, offsets, nlow=1, nhigh=1,
+                                       kind='average')
+    expected = np.sort(shifted, axis=0)[1:-1].mean(axis=0)
+    np.testing.assert_allclose(result[3:-3, 3:-3], expected[3:-3, 3:-3],
+                               rtol=1e-12)
+
+
+def test_whole_pixel_offsets():
+    rng = np.random.RandomState(2)
+    a = rng.randint(0, 1000, size=(12, 15)).astype(np.int32)
+    stack = [np.roll(np.roll(a, -dy, 0), -dx, 1)
+             for dx, dy in [(0, 0), (2, 1), (-1, 3)]]
+    offsets = [(0, 0), (2, 1), (-1, 3)]
+    result = combine.shift_and_combine(stack, offsets, kind='minimum',
+                                       outtype=np.int32)
+    np.testing.assert_array_equal(result, a)
+
+
+def test_masks_are_shifted():
+    rng = np.random.RandomState(3)
+    stack = rng.normal(size=(6, 14, 16))
+    masks = rng.uniform(size=stack.shape) < 0.1
+    offsets = rng.uniform(-1.5, 1.5, size=(6, 2))
+    result = combine.shift_and_combine(stack, offsets, badmasks=masks,
+                                       kind='average', nthreads=3)
+    frames, good = _registered(stack, offsets, masks)
+    np.testing.assert_allclose(result, _reference(frames, good, np.mean),
+                               rtol=1e-12)
+
+
+def test_out_of_frame():
+    stack = np.ones((2, 4, 4))
+    result = combine.shift_and_combine(stack, [(10, 0), (0, -10)])
+    assert not result.any()
+
+
+def test_output_and_threads():
+    rng = np.random.RandomState(4)
+    stack = rng.normal(size=(9, 40, 33))
+    offsets = rng.uniform(-4, 4, size=(9, 2))
+    expected = combine.shift_and_combine(stack, offsets, nthreads=1)
+    out = np.empty((40, 33), dtype=np.float32)
+    combine.shift_and_combine(stack, offsets, output=out, nthreads=4)
+    np.testing.assert_array_equal(out, expected.astype(np.float32))
+
+
+def test_errors():
+    stack = np.ones((3, 4, 4))
+    with pytest.raises(ValueError):
+        combine.shift_and_combine(stack, [(0, 0), (1, 1)])
+    with pytest.raises(ValueError):
+        combine.shift_and_combine(stack, [(0, 0), (1, 1), (np.nan, 0)])
+    with pytest.raises(ValueError):
+        combine.shift_and_combine(np.ones((3, 4)), np.zeros((3, 2)))
+    with pytest.raises(ValueError):
+        combine.shift_and_combine(stack, np.zeros((3, 2)), kind='average',
+                                  weights=np.ones((3, 4, 4)))
@@ -0,0 +1,77 @@
+import numpy as np
+import pytest
+
+from stsci.image import combine
+
+
+def _stack(n, seed=0):
+    rng = np.random.RandomState(seed)
+    stack = rng.normal(size=(n, 6, 7))
+    stack[:, 0] = rng.randint(0, 3, size=(n, 7))
+    masks = rng.uniform(size=stack.shape) < 0.3
+    return stack, masks
+
+
+@pytest.mark.parametrize('n', [1, 2, 5, 8, 17, 80])
+def test_matches_single_combiners(n):
+    stack, masks = _stack(n, n)
+    for nlow, nhigh in [(0, 0), (1, 0), (1, 2), (n, n)]:
+        for m in (None, masks):
+            r = combine.combine_stats(stack, nlow=nlow, nhigh=nhigh,
+                                      badmasks=m, nthreads=2)
+            for name, f in (('median', combine.median),
+                            ('mean', combine.average),
+                            ('minimum', combine.minimum)):
+                np.testing.assert_array_equal(
+                    r[name], f(stack, outtype=np.float64, nlow=nlow,
+                               nhigh=nhigh, badmasks=m))
+            good = n if m is None else (~m).sum(axis=0)
+            np.testing.assert_array_equal(r['count'], good)
+
+
+def test_spread():
+    stack, masks = _stack(9, 1)
+    r = combine.combine_stats(stack, badmasks=masks, nlow=1, nhigh=1)
+    for index in np.ndindex(*stack.shape[1:]):
+        values = np.sort(stack[(slice(None),) + index][
+            ~masks[(slice(None),) + index]])[1:-1]
+        if len(values) == 0:
+            assert r['maximum'][index] == r['std'][index] == 0
+            continue
+        assert r['maximum'][index] == values[-1]
+        np.testing.assert_allclose(r['std'][index], values.std(), atol=1e-12)
+        mad = np.median(np.abs(values - np.median(values)))
+        np.testing.assert_allclose(r['mad'][index], mad, atol=1e-12)
+
+
+@pytest.mark.parametrize('clip', ['sigma', 'mad'])
+def test_clip(clip):
+    rng = np.random.RandomState(2)
+    stack = rng.normal(size=(25, 5, 5))
+    stack[3] += 50
+    r = combine.combine_stats(stack, ('median', 'mean'), clip=clip,
+                              lsigma=2.5, hsigma=2.0)
+    kind = 'sigclip' if clip == 'sigma' else 'madclip'
+    for name, stat in (('median', 'median'), ('mean', 'average')):
+        f = getattr(combine, '%s_%s' % (kind, stat))
+        np.testing.assert_array_equal(r[name],
+                                      f(stack, lsigma=2.5, hsigma=2.0))
+
+
+def test_outputs():
+    stack, masks = _stack(6)
+    out = np.zeros(stack.shape[1:], dtype=np.float32)
+    r = combine.combine_stats(stack, ('count',), outputs={'median': out})
+    assert r['median'] is out and sorted(r) == ['count', 'median']
+    np.testing.assert_array_equal(
+        out, combine.median(stack, outtype=np.float32))
+
+
+def test_errors():
+    stack, masks = _stack(3)
+    with pytest.raises(ValueError):
+        combine.combine_stats(stack, ('mode',))
+    with pytest.raises(ValueError):
+        combine.combine_stats(stack, clip='biweight')
+    with pytest.raises(ValueError):
+        combine.combine_stats(stack, outputs={'mean': np.empty((2, 2))})
@@ -1,4 +1,5 @@
 import numpy as np
+import pytest
 from stsci.image import combine
 
 
@@ -79,3 +80,91 @@ def test_threshold4():
          [0, 0, 0, 0, 0, 0, 0, 0, 0, 0],
          [0, 0, 0, 0, 0, 0, 0, 0, 0, 0]], dtype=np.int8)
     assert (result == expected).all()
+
+
+def _expected(stack, low, high):
+    stack = np.asarray(stack, dtype=np.float64)
+    result = np.zeros(stack.shape, dtype=bool)
+    if low is not None:
+        result |= stack < low
+    if high is not None:
+        result |= stack >= high
+    return result
+
+
+@pytest.mark.parametrize('dtype', [np.int16, np.uint8, np.int32, np.float32,
+                                   np.float64, '>f4'])
+@pytest.mark.parametrize('limits', [(10, None), (None, 40), (10, 40.5)])
+def test_threshhold_frames(dtype, limits):
+    rng = np.random.RandomState(0)
+    frames = [rng.randint(0, 50, size=(7, 13)).astype(dtype)
+              for _ in range(4)]
+    result = combine.threshhold(frames, *limits, nthreads=2)
+    assert result.dtype == bool and result.shape == (4, 7, 13)
+    np.testing.assert_array_equal(result, _expected(frames, *limits))
+
+
+def test_threshhold_outputs():
+    rng = np.random.RandomState(1)
+    stack = rng.normal(size=(3, 5, 19))
+    planes = [np.ones((5, 19), dtype=bool) for _ in range(3)]
+    assert combine.threshhold(stack, -1, 1, outputs=planes) is planes
+    np.testing.assert_array_equal(planes, _expected(stack, -1, 1))
+    # a strided view of a mask stack is written in place
+    masks = np.zeros((3, 5, 38), dtype=bool)
+    combine.threshhold(stack, -1, 1, outputs=masks[:, :, ::2])
+    np.testing.assert_array_equal(masks[:, :, ::2], _expected(stack, -1, 1))
+    assert not masks[:, :, 1::2].any()
+
+
+@pytest.mark.parametrize('dtype', [np.uint8, np.int32, np.float64])
+def test_threshhold_typed_outputs(dtype):
+    stack = np.arange(12.).reshape(3, 2, 2)
+    planes = np.full(stack.shape, 7, dtype=dtype)
+    assert combine.threshhold(stack, 1, 9, outputs=planes) is planes
+    assert planes.dtype == dtype
+    np.testing.assert_array_equal(planes, _expected(stack, 1, 9))
+    combine.threshhold(stack, high=11, outputs=planes, update=True)
+    np.testing.assert_array_equal(planes, _expected(stack, 1, 9))
+
+
+def test_threshhold_update():
+    rng = np.random.RandomState(2)
+    stack = rng.normal(size=(4, 6, 6))
+    bad = rng.uniform(size=stack.shape) < 0.2
+    masks = bad.copy()
+    combine.threshhold(stack, high=1, outputs=masks, update=True)
+    np.testing.assert_array_equal(masks, bad | (stack >= 1))
+    # with no limits there is nothing to add
+    combine.threshhold(stack, outputs=masks, update=True)
+    np.testing.assert_array_equal(masks, bad | (stack >= 1))
+
+
+@pytest.mark.parametrize('cols', [1, 8, 13, 16, 21])
+def test_threshhold_packed(cols):
+    rng = np.random.RandomState(cols)
+    stack = rng.normal(size=(3, 4, cols))
+    expected = np.packbits(_expected(stack, -0.5, 0.5), axis=-1)
+    result = combine.threshhold(stack, -0.5, 0.5, packed=True)
+    assert result.dtype == np.uint8
+    np.testing.assert_array_equal(result, expected)
+    old = np.packbits(rng.uniform(size=stack.shape) < 0.3, axis=-1)
+    planes = old.copy()
+    combine.threshhold(stack, -0.5, 0.5, outputs=planes, packed=True,
+                       update=True)
+    np.testing.assert_array_equal(planes, old | expected)
+
+
+def test_threshhold_errors():
+    stack = np.zeros((2, 3, 4))
+    with pytest.raises(ValueError):
+        combine.threshhold(stack, 1, outputs=np.zeros((2, 3, 5), dtype=bool))
+    with pytest.raises(ValueError):
+        combine.threshhold(stack, 1, outputs=np.zeros((1, 3, 4), dtype=bool))
+    with pytest.raises(ValueError):
+        combine.threshhold(stack, 1, packed=True,
+                           outputs=np.zeros((2, 3, 4), dtype=np.uint8))
+    with pytest.raises(ValueError):
+        combine.threshhold([np.zeros((3, 4)), np.zeros((3, 5))], 1)
+    with pytest.raises(ValueError, match="dimension"):
+        combine.threshhold(np.arange(4.), 1)
@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+
+from stsci.image import combine, tiled_combine
+
+
+@pytest.fixture
+def frames(tmp_path):
+    rng = np.random.RandomState(0)
+    stack = rng.normal(size=(7, 23, 11)).astype(np.float32)
+    paths = []
+    for i, frame in enumerate(stack):
+        path = str(tmp_path / ('frame%d.dat' % i))
+        m = np.memmap(path, dtype=np.float32, mode='w+', shape=frame.shape)
+        m[:] = frame
+        m.flush()
+        paths.append(path)
+    return stack, paths
+
+
+@pytest.mark.parametrize('kind', ['median', 'imedian', 'average',
+                                  'iaverage', 'minimum'])
+@pytest.mark.parametrize('max_memory', [1, 1000, 2**30])
+def test_matches_in_memory(frames, kind, max_memory):
+    stack, paths = frames
+    memmaps = [np.memmap(p, dtype=np.float32, mode='r', shape=stack.shape[1:])
+               for p in paths]
+    masks = np.random.RandomState(1).uniform(size=stack.shape) < 0.3
+    expected = getattr(combine, kind)(list(stack), nlow=1, nhigh=2,
+                                      badmasks=masks)
+    result = tiled_combine(memmaps, kind, nlow=1, nhigh=2, badmasks=masks,
+                           max_memory=max_memory)
+    assert result.dtype == np.float32
+    np.testing.assert_array_equal(result, expected)
+
+
+def test_memmap_output(frames, tmp_path):
+    stack, paths = frames
+    memmaps = [np.memmap(p, dtype=np.float32, mode='r', shape=stack.shape[1:])
+               for p in paths]
+    output = np.lib.format.open_memmap(str(tmp_path / 'out.npy'), mode='w+',
+                                       dtype=np.float64,
+                                       shape=stack.shape[1:])
+    assert tiled_combine(memmaps, output=output, max_memory=500) is None
+    output.flush()
+    np.testing.assert_array_equal(np.load(str(tmp_path / 'out.npy')),
+                                  combine.median(stack, outtype=np.float64))
+
+
+def test_shape_mismatch():
+    with pytest.raises(ValueError):
+        tiled_combine([np.zeros((3, 4)), np.zeros((4, 3))])
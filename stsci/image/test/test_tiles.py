@@ -0,0 +1,71 @@
+import numpy as np
+import pytest
+
+from stsci.image import combine
+
+# deep enough to be gathered a tile of columns at a time, with rows of
+# several tiles and a partial one
+DEPTH, SHAPE = 24, (3, 1601)
+
+
+def _stack(dtype=np.float64, seed=0):
+    rng = np.random.RandomState(seed)
+    return rng.normal(100, 10, size=(DEPTH,) + SHAPE).astype(dtype)
+
+
+def _masks(seed=1, density=0.3):
+    rng = np.random.RandomState(seed)
+    return rng.uniform(size=(DEPTH,) + SHAPE) < density
+
+
+@pytest.mark.parametrize('dtype', [np.int16, np.float32, np.float64])
+def test_median(dtype):
+    stack = _stack(dtype)
+    masks = _masks()
+    expected = np.nanmedian(np.where(masks, np.nan, stack.astype(float)),
+                            axis=0)
+    result = combine.median(stack, badmasks=masks, outtype=np.float64)
+    np.testing.assert_allclose(result, expected, rtol=1e-12)
+
+
+def test_frames_and_reductions():
+    stack = _stack()
+    np.testing.assert_array_equal(combine.minimum(list(stack)),
+                                  stack.min(axis=0))
+    np.testing.assert_allclose(combine.average(stack, nlow=2, nhigh=3),
+                               np.sort(stack, axis=0)[2:-3].mean(axis=0),
+                               rtol=1e-12)
+
+
+def test_weights_and_limits():
+    stack = _stack()
+    weights = np.random.RandomState(2).uniform(0.5, 2, size=stack.shape)
+    np.testing.assert_allclose(
+        combine.average(stack, weights=weights),
+        np.average(stack, axis=0, weights=weights), rtol=1e-12)
+    good = (stack >= 90) & (stack < 110)
+    expected = np.nanmedian(np.where(good, stack, np.nan), axis=0)
+    np.testing.assert_allclose(combine.median(stack, low=90, high=110),
+                               expected, rtol=1e-12)
+
+
+def test_flags():
+    stack = _stack()
+    masks = _masks()
+    expected = combine.median(stack, badmasks=masks)
+    dq = masks.astype(np.uint32) << 7 | 0x4
+    np.testing.assert_array_equal(
+        combine.median(stack, badmasks=dq, bad_bits=0x80), expected)
+    np.testing.assert_array_equal(
+        combine.median(stack, badmasks=np.packbits(masks, axis=-1),
+                       packed_masks=True), expected)
+
+
+def test_stats():
+    stack = _stack()
+    masks = _masks()
+    result = combine.combine_stats(stack, ('mean', 'count'), badmasks=masks)
+    np.testing.assert_array_equal(result['count'], (~masks).sum(axis=0))
+    np.testing.assert_allclose(
+        result['mean'], np.nanmean(np.where(masks, np.nan, stack), axis=0),
+        rtol=1e-12)
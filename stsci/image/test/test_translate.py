@@ -0,0 +1,234 @@
+import numpy as np
+import pytest
+from scipy import ndimage
+
+from stsci.image import translate
+
+# the scipy.ndimage modes that extend the image the same way
+SCIPY_MODES = {'nearest': 'nearest', 'wrap': 'grid-wrap',
+               'reflect': 'reflect', 'constant': 'grid-constant'}
+
+SHIFTS = [(0, 0), (0.5, 0), (0, -0.25), (0.3, 0.6), (-0.7, 0.2),
+          (-2.25, -1.5), (3, -4), (12.6, -19.2)]
+
+
+@pytest.mark.parametrize('mode', sorted(SCIPY_MODES))
+@pytest.mark.parametrize('shift', SHIFTS)
+def test_matches_ndimage(mode, shift):
+    rng = np.random.RandomState(0)
+    a = rng.normal(size=(9, 11))
+    result = translate(a, shift[0], shift[1], mode=mode, cval=1.5)
+    expected = ndimage.shift(a, (shift[1], shift[0]), order=1,
+                             mode=SCIPY_MODES[mode], cval=1.5)
+    np.testing.assert_allclose(result, expected, rtol=0, atol=1e-12)
+
+
+def test_integer_shifts_are_exact():
+    a = np.arange(30, dtype=np.int32).reshape((5, 6))
+    result = translate(a, 2, -1)
+    assert result.dtype == np.int32
+    np.testing.assert_array_equal(result[:4, 2:], a[1:, :4])
+
+
+@pytest.mark.parametrize('dtype', [np.int16, np.uint16, np.float32,
+                                   np.uint8, '>f8'])
+def test_dtypes(dtype):
+    a = np.arange(48).reshape((6, 8)).astype(dtype)
+    result = translate(a, 0.5, -0.25)
+    assert result.dtype == a.dtype
+    expected = translate(a.astype(np.float64), 0.5, -0.25)
+    if a.dtype.kind in 'iu':
+        expected = np.rint(expected)
+    np.testing.assert_array_equal(result, expected.astype(dtype))
+
+
+def test_output():
+    a = np.arange(48.).reshape((6, 8))
+    out = np.zeros((6, 16), dtype=np.float32)[:, ::2]
+    assert translate(a, 0.25, 1.5, output=out) is None
+    np.testing.assert_allclose(out, translate(a, 0.25, 1.5), rtol=1e-6)
+
+
+def test_errors():
+    a = np.ones((3, 4))
+    with pytest.raises(ValueError):
+        translate(a, 0.5, 0.5, mode='mirror')
+    with pytest.raises(ValueError):
+        translate(a, 0.5, 0.5, output=np.empty((4, 3)))
+    with pytest.raises(ValueError):
+        translate(np.ones((2, 3, 4)), 0.5, 0.5)
+    with pytest.raises(ValueError):
+        translate(a, np.nan, 0.5)
+
+
+@pytest.mark.parametrize('mode', ['full', 'same', 'valid'])
+@pytest.mark.parametrize('shift', [(0, 0), (0.3, 0.6), (0.75, 0)])
+def test_private_translate(mode, shift):
+    from scipy.signal import correlate2d
+    from stsci.image._image import _translate
+    dx, dy = shift
+    a = np.random.RandomState(1).normal(size=(6, 7))
+    kernel = np.array([[dx * dy, (1 - dx) * dy],
+                       [(1 - dy) * dx, (1 - dy) * (1 - dx)]])
+    expected = correlate2d(a, kernel, mode=mode, fillvalue=0.5)
+    result = _translate(a, dx, dy, mode=mode, cval=0.5)
+    np.testing.assert_allclose(result, expected, rtol=0, atol=1e-12)
+    out = np.empty(expected.shape, dtype=np.float32)
+    assert _translate(a, dx, dy, output=out, mode=mode, cval=0.5) is None
+    np.testing.assert_allclose(out, expected, rtol=1e-6)
+
+
+def test_reused_buffers():
+    rng = np.random.RandomState(2)
+    frames = rng.normal(size=(6, 8, 9)).astype(np.float32)
+    ring = [np.empty((8, 9), dtype=np.float32) for i in range(2)]
+    for i, frame in enumerate(frames):
+        out = ring[i % 2]
+        translate(frame, 0.1 * i, -0.2 * i, output=out)
+        np.testing.assert_array_equal(out, translate(frame, 0.1 * i,
+                                                     -0.2 * i))
+
+
+def test_in_place():
+    a = np.arange(48.).reshape((6, 8))
+    expected = translate(a, 1.5, 0.25)
+    translate(a, 1.5, 0.25, output=a)
+    np.testing.assert_array_equal(a, expected)
+
+
+@pytest.mark.parametrize('nthreads', [1, 3])
+def test_translate_stack(nthreads):
+    from stsci.image import translate_stack, median
+    rng = np.random.RandomState(3)
+    cube = rng.normal(size=(5, 300, 260)).astype(np.float32)
+    dxs = rng.uniform(-3, 3, size=5)
+    dys = rng.uniform(-3, 3, size=5)
+    result = translate_stack(cube, dxs, dys, nthreads=nthreads,
+                             mode='reflect')
+    for frame, shifted, dx, dy in zip(cube, result, dxs, dys):
+        np.testing.assert_array_equal(
+            shifted, translate(frame, dx, dy, mode='reflect'))
+    out = np.empty_like(cube)
+    assert translate_stack(cube, dxs, dys, out=out, mode='reflect') is None
+    np.testing.assert_array_equal(out, result)
+    median(out)
+
+
+def test_translate_stack_errors():
+    from stsci.image import translate_stack
+    cube = np.ones((3, 4, 5))
+    with pytest.raises(ValueError):
+        translate_stack(cube, [1, 2], [1, 2, 3])
+    with pytest.raises(ValueError):
+        translate_stack(cube[0], [1], [1])
+    with pytest.raises(ValueError):
+        translate_stack(cube, [1, 2, 3], [1, 2, 3], out=np.ones((3, 4, 4)))
+
+
+# the numpy.pad modes that extend the image the same way
+PAD_MODES = {'nearest': 'edge', 'wrap': 'wrap', 'reflect': 'symmetric',
+             'constant': 'constant'}
+
+
+def _kernel_weights(kernel, f):
+    """The taps of sampling at fraction 'f' past a pixel: the first tap's
+    offset from that pixel and the weights."""
+    n = {'bicubic': 2, 'lanczos3': 3, 'lanczos5': 5}[kernel]
+    d = f + (n - 1) - np.arange(2 * n)
+    if kernel == 'bicubic':
+        ad = np.abs(d)
+        w = np.where(ad <= 1, 1.5 * ad**3 - 2.5 * ad**2 + 1,
+                     -0.5 * ad**3 + 2.5 * ad**2 - 4 * ad + 2)
+    else:
+        w = np.sinc(d) * np.sinc(d / n)
+        w /= w.sum()
+    return 1 - n, w
+
+
+def _reference(a, dx, dy, kernel, mode, cval):
+    """Shift 'a' with the separable taps of 'kernel', one axis at a time."""
+    pad = 30
+    kw = {'constant_values': cval} if mode == 'constant' else {}
+    p = np.pad(a, pad, mode=PAD_MODES[mode], **kw)
+    for axis, shift in ((1, dx), (0, dy)):
+        x = -shift
+        base = int(np.floor(x))
+        first, w = _kernel_weights(kernel, x - base)
+        out = 0
+        for t, weight in enumerate(w):
+            out = out + weight * np.roll(p, -(base + first + t), axis=axis)
+        p = out
+    return p[pad:-pad, pad:-pad]
+
+
+@pytest.mark.parametrize('kernel', ['bicubic', 'lanczos3', 'lanczos5'])
+@pytest.mark.parametrize('mode', sorted(PAD_MODES))
+@pytest.mark.parametrize('shift', SHIFTS[1:6])
+def test_kernels(kernel, mode, shift):
+    rng = np.random.RandomState(1)
+    a = rng.normal(size=(13, 12))
+    result = translate(a, shift[0], shift[1], mode=mode, cval=0.5,
+                       kernel=kernel)
+    expected = _reference(a, shift[0], shift[1], kernel, mode, 0.5)
+    np.testing.assert_allclose(result, expected, rtol=0, atol=1e-12)
+
+
+@pytest.mark.parametrize('kernel', ['bilinear', 'bicubic', 'lanczos3',
+                                    'lanczos5'])
+def test_kernel_properties(kernel):
+    # whole-pixel shifts are exact, flat images stay flat and the cached
+    # weights of a fractional shift give the same result as fresh ones
+    a = np.arange(99, dtype=np.int32).reshape((9, 11))
+    result = translate(a, -3, 2, kernel=kernel)
+    np.testing.assert_array_equal(result[2:, :-3], a[:-2, 3:])
+    flat = translate(np.full((8, 8), 7.0), 0.37, -1.81, kernel=kernel)
+    np.testing.assert_allclose(flat, 7.0, rtol=1e-14)
+    b = np.random.RandomState(2).normal(size=(10, 10))
+    first = translate(b, 0.37, 5.25, kernel=kernel)
+    for dx, dy in [(1.37, 0.25), (0.37, 5.25)]:
+        translate(b, dx, dy, kernel=kernel)
+    np.testing.assert_array_equal(translate(b, 0.37, 5.25, kernel=kernel),
+                                  first)
+
+
+@pytest.mark.parametrize('kernel', ['bicubic', 'lanczos3', 'lanczos5'])
+@pytest.mark.parametrize('dtype', [np.uint8, np.int16])
+def test_ringing_saturates(kernel, dtype):
+    # the overshoot on either side of a step edge is rounded and clipped to
+    # the range of the type, never wrapped around
+    info = np.iinfo(dtype)
+    a = np.full((4, 16), info.min, dtype=dtype)
+    a[:, 8:] = info.max
+    for dx in (0.5, -0.3):
+        expected = translate(a.astype(np.float64), dx, 0, kernel=kernel)
+        assert expected.min() < info.min and expected.max() > info.max
+        result = translate(a, dx, 0, kernel=kernel)
+        np.testing.assert_array_equal(
+            result, np.clip(np.rint(expected), info.min, info.max))
+
+
+def test_bicubic_reproduces_quadratics():
+    y, x = np.mgrid[:12, :14].astype(np.float64)
+    a = 0.5 * x**2 - x * y + 2 * y
+    result = translate(a, 0.3, -0.45, kernel='bicubic')
+    xs, ys = x - 0.3, y + 0.45
+    expected = 0.5 * xs**2 - xs * ys + 2 * ys
+    np.testing.assert_allclose(result[3:-3, 3:-3], expected[3:-3, 3:-3],
+                               atol=1e-10)
+
+
+def test_translate_stack_kernels():
+    from stsci.image import translate_stack
+    rng = np.random.RandomState(3)
+    cube = rng.normal(size=(4, 10, 12))
+    dxs, dys = rng.uniform(-3, 3, 4), rng.uniform(-3, 3, 4)
+    result = translate_stack(cube, dxs, dys, kernel='lanczos3', mode='wrap',
+                             nthreads=2)
+    for i in range(4):
+        np.testing.assert_array_equal(
+            result[i], translate(cube[i], dxs[i], dys[i], kernel='lanczos3',
+                                 mode='wrap'))
+    with pytest.raises(ValueError):
+        translate_stack(cube, dxs, dys, kernel='spline')
+    with pytest.raises(ValueError):
+        translate(cube[0], 0.5, 0.5, kernel='spline')
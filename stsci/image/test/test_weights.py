@@ -0,0 +1,101 @@
+import numpy as np
+import pytest
+
+from stsci.image import combine, tiled_combine
+
+
+def _reference(stack, weights, masks, nlow, nhigh):
+    """Weighted mean of every pixel stack after masking and clipping."""
+    out = np.zeros(stack.shape[1:])
+    for index in np.ndindex(*out.shape):
+        values = stack[(slice(None),) + index]
+        w = weights[(slice(None),) + index]
+        if masks is not None:
+            keep = ~masks[(slice(None),) + index]
+            values, w = values[keep], w[keep]
+        order = np.argsort(values, kind='stable')
+        kept = order[nlow:len(values) - nhigh]
+        if len(kept) and w[kept].sum() != 0:
+            out[index] = (values[kept] * w[kept]).sum() / w[kept].sum()
+    return out
+
+
+@pytest.mark.parametrize('n', [1, 3, 8, 20, 70])
+def test_pixel_weights(n):
+    rng = np.random.RandomState(n)
+    stack = rng.normal(size=(n, 5, 6))
+    weights = rng.uniform(0.5, 2, size=stack.shape)
+    masks = rng.uniform(size=stack.shape) < 0.2
+    for nlow, nhigh in [(0, 0), (1, 0), (1, 2)]:
+        if nlow + nhigh >= n:
+            continue
+        for m in (None, masks):
+            result = combine.average(stack, nlow=nlow, nhigh=nhigh,
+                                     badmasks=m, weights=weights)
+            expected = _reference(stack, weights, m, nlow, nhigh)
+            np.testing.assert_allclose(result, expected, rtol=1e-12)
+
+
+def test_frame_weights():
+    rng = np.random.RandomState(1)
+    stack = rng.normal(size=(6, 4, 5))
+    w = rng.uniform(0.5, 2, size=6)
+    result = combine.average(stack, weights=w)
+    np.testing.assert_allclose(result, np.average(stack, axis=0, weights=w))
+    # a per-pixel stack of the same weights gives the same result
+    pixel = np.broadcast_to(w[:, None, None], stack.shape).astype(np.float32)
+    np.testing.assert_allclose(combine.average(stack, weights=pixel), result,
+                               rtol=1e-6)
+
+
+def test_scales_and_zeros():
+    rng = np.random.RandomState(2)
+    stack = rng.normal(size=(5, 4, 5)).astype(np.float32)
+    scales = rng.uniform(0.5, 2, size=5)
+    zeros = rng.normal(size=5)
+    result = combine.average(stack, scales=scales, zeros=zeros,
+                             outtype=np.float64, nlow=1)
+    adjusted = np.sort(stack * scales[:, None, None] + zeros[:, None, None],
+                       axis=0)
+    np.testing.assert_allclose(result, adjusted[1:].mean(axis=0), rtol=1e-12)
+    # unit scales and zero offsets change nothing
+    np.testing.assert_array_equal(
+        combine.average(stack, scales=np.ones(5), zeros=np.zeros(5)),
+        combine.average(stack))
+
+
+def test_iaverage_fill():
+    # the first nonzero input fills a fully masked stack, after scaling
+    stack = np.array([[[0]], [[4]], [[5]]], dtype=np.float64)
+    masks = np.ones(stack.shape, dtype=bool)
+    result = combine.iaverage(stack, badmasks=masks, weights=[1, 2, 3],
+                              scales=[2, 3, 1])
+    np.testing.assert_array_equal(result, [[12]])
+
+
+def test_zero_weights():
+    stack = np.ones((3, 2, 2))
+    assert not combine.average(stack, weights=[0, 0, 0]).any()
+
+
+def test_tiled():
+    rng = np.random.RandomState(3)
+    stack = rng.normal(size=(7, 12, 9))
+    weights = rng.uniform(0.5, 2, size=stack.shape)
+    expected = combine.average(stack, weights=weights, zeros=np.arange(7))
+    result = tiled_combine(list(stack), 'average', weights=list(weights),
+                           zeros=np.arange(7), max_memory=2000)
+    np.testing.assert_array_equal(result, expected)
+
+
+def test_errors():
+    stack = np.ones((3, 2, 2))
+    with pytest.raises(ValueError):
+        combine.average(stack, weights=[1, 2])
+    with pytest.raises(ValueError):
+        combine.average(stack, weights=np.ones((3, 2, 3)))
+    with pytest.raises(ValueError):
+        combine.average(stack, scales=[1, 2])
+    with pytest.raises(ValueError):
+        combine._combine(stack, np.empty((2, 2)), kind='median',
+                         frame_weights=[1, 1, 1])
@@ -0,0 +1,160 @@
+"""Combine stacks of images that are too large to hold in memory at once.
+
+The frames are combined one block of rows at a time: the same rows are
+taken from every frame (and mask), reduced with the combine kernels, and
+written to the matching rows of the output before moving on.  Frames may be
+any array-likes that support ``shape`` and slicing along the first axis,
+such as `numpy.memmap` files, so only the current block ever needs to be
+resident.
+"""
+from __future__ import (absolute_import, division, unicode_literals,
+                        print_function)
+
+import numpy as np
+
+from ._combine import combine as _combine
+from .combine import _default_nthreads, _frame_terms
+
+__all__ = ['tiled_combine']
+
+
+def _shape(a):
+    """The shape of an array-like without reading its data."""
+    shape = getattr(a, 'shape', None)
+    if shape is None:
+        shape = np.shape(a)
+    return tuple(shape)
+
+
+def _itemsize(a):
+    dtype = getattr(a, 'dtype', None)
+    return np.dtype(dtype).itemsize if dtype is not None else 8
+
+
+def _block_rows(arrays, badmasks, weights, output, shape, max_memory):
+    """The number of rows whose block from every frame, mask, weight and
+    the output fits in 'max_memory' bytes (at least one)."""
+    row_size = int(np.prod(shape[1:], dtype=np.int64))
+    row_bytes = sum(_itemsize(a) for a in arrays) * row_size
+    for others in (badmasks, weights):
+        if others is not None:
+            row_bytes += sum(_itemsize(m) for m in others) * row_size
+    row_bytes += output.dtype.itemsize * row_size
+    return max(1, int(max_memory // max(row_bytes, 1)))
+
+
+def tiled_combine(arrays, kind="median", output=None, outtype=None, nlow=0,
+                  nhigh=0, badmasks=None, max_memory=2**30, nthreads=None,
+                  **kernel_args):
+    """Combine a stack of identically shaped images in blocks of rows.
+
+    Parameters
+    ----------
+    arrays : sequence of array-like
+        The frames to combine, for instance `numpy.memmap` arrays.  They
+        are only ever sliced along their first axis, never read whole.
+
+    kind : {'median', 'imedian', 'average', 'iaverage', 'minimum', ...}
+        The combine kernel to use; see the functions of the same name in
+        `stsci.image.combine`.  'sum' adds the values left in each pixel
+        stack, and every kind prefixed with 'nan' ('nanmedian', ...) also
+        ignores NaN pixels.
+
+    output : ndarray, optional
+        Where to store the result, for instance a `numpy.memmap` opened
+        for writing.  If none is specified, a new array of type 'outtype'
+        is created.
+
+    outtype : dtype, optional
+        The type of the output array when no 'output' is specified.
+        Defaults to the type of the first frame.
+
+    nlow, nhigh : int
+        The number of pixels to be excluded on the low and high ends of
+        each pixel stack.
+
+    badmasks : sequence of array-like, optional
+        Boolean frames corresponding to 'arrays', where true indicates that
+        a pixel is not to be included.  They are read block by block as
+        well.
+
+    max_memory : int
+        Upper bound, in bytes, on the size of one block taken from every
+        frame, mask and the output.  At least one row is always combined
+        at a time.
+
+    nthreads : int, optional
+        The number of threads each block is split among.  Defaults to the
+        number of cores available to the process.
+
+    **kernel_args
+        Further arguments of the kernel, such as the 'lsigma', 'hsigma' and
+        'maxiter' of the clipping kernels or the 'weights', 'scales' and
+        'zeros' of the averages.  Weights given per pixel are read block by
+        block like the frames.
+
+    Returns
+    -------
+    output : ndarray
+        The combined image, when no 'output' was specified.
+    """
+    if len(arrays) == 0:
+        raise ValueError("at least one array is required")
+    shape = _shape(arrays[0])
+    kernel_args.update(_frame_terms(kernel_args.pop('weights', None),
+                                    kernel_args.pop('scales', None),
+                                    kernel_args.pop('zeros', None)))
+    weights = kernel_args.pop('weights', None)
+    others = list(arrays[1:])
+    for name, extra in (('badmasks', badmasks), ('weights', weights)):
+        if extra is not None:
+            if len(extra) != len(arrays):
+                raise ValueError("%s must have one entry per array" % name)
+            if name == 'weights':
+                others.extend(extra)
+    for a in others:
+        if _shape(a) != shape:
+            raise ValueError("all arrays must have identical shapes")
+    if len(shape) == 0:
+        raise ValueError("arrays must have at least one dimension")
+    if badmasks is not None:
+        mask_shape = shape
+        if kernel_args.get('packed_masks'):
+            # eight pixels to a byte along the last axis, which must not be
+            # the one the blocks are cut along
+            if len(shape) < 2:
+                raise ValueError("packed masks need arrays of at least two "
+                                 "dimensions")
+            mask_shape = shape[:-1] + ((shape[-1] + 7) // 8,)
+        for m in badmasks:
+            if _shape(m) != mask_shape:
+                raise ValueError("badmasks must match the shape of arrays")
+
+    if output is None:
+        if outtype is None:
+            outtype = getattr(arrays[0], 'dtype', np.float64)
+        out = np.empty(shape, dtype=outtype)
+    else:
+        out = output
+        if out.shape != shape:
+            raise ValueError("all arrays must have identical shapes")
+    if nthreads is None:
+        nthreads = _default_nthreads()
+
+    nrows = shape[0]
+    step = _block_rows(arrays, badmasks, weights, out, shape, max_memory)
+    for start in range(0, nrows, step):
+        rows = slice(start, min(start + step, nrows))
+        block = [np.asarray(a[rows]) for a in arrays]
+        masks = None
+        if badmasks is not None:
+            masks = [np.asarray(m[rows]) for m in badmasks]
+        if weights is not None:
+            kernel_args['weights'] = [np.asarray(w[rows]) for w in weights]
+        _combine(block, out[rows], nlow, nhigh, masks, kind, nthreads,
+                 **kernel_args)
+        del block, masks
+        kernel_args.pop('weights', None)
+
+    if output is None:
+        return out